@@ -0,0 +1,1354 @@
+"""
+解析与爬取吞吐量的benchmark：
+
+    python benchmark.py                          # 运行所有benchmark，结果保存到data/benchmarks/<commit>.json，有失败时返回1
+    python benchmark.py --compare data/benchmarks/<旧commit>.json   # 与之前的结果比较，有退化或失败时返回1
+    python benchmark.py parse_wiki_page job_get_extra_links --latency 0.05
+    python benchmark.py --check                  # 运行assert形式的检查，有失败时返回1
+
+每个benchmark在单独的子进程中运行，以便分别统计峰值内存；p50/p95只对逐页计时的benchmark统计。
+job_*在本地模拟服务器上运行main.py中的任务，不访问外网；为了测量代码本身的吞吐量，
+benchmark使用的配置关闭了缓存、代理与[RATELIMIT]限流，sqlite存储不使用仓库中的文件
+"""
+import argparse
+import atexit
+import configparser
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WIKI_PAGE_DIR = os.path.join(ROOT, "data", "wikiPages")
+RESULT_DIR = os.path.join(ROOT, "data", "benchmarks")
+
+# pages_per_sec下降、p95_ms与peak_rss_mb上升超过阈值时视为退化
+_higher_is_better = {"pages_per_sec": True, "p95_ms": False, "peak_rss_mb": False}
+
+
+def load_config(base_url=None) -> configparser.ConfigParser:
+    """
+    benchmark与检查使用的配置：关闭缓存、代理与限流；
+    有状态的sqlite存储只保存在内存中或指向临时目录，不读写仓库中data/下的文件，结果不受上次运行影响
+    """
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, "config.ini"), encoding="utf-8")
+    config["CACHE"]["enabled"] = "false"
+    config["PROXY"]["url"] = ""
+    config.remove_section("RATELIMIT")
+    state_dir = tempfile.mkdtemp(prefix="wiki_spider_")
+    atexit.register(shutil.rmtree, state_dir, ignore_errors=True)
+    config["ENTITY"]["cache_file"] = ""
+    config["CANONICAL"]["index_file"] = ""
+    config["ALIGN"]["store_file"] = ""
+    config["METRICS"]["dump_file"] = ""
+    config["RECRAWL"]["state_file"] = os.path.join(state_dir, "recrawl.state")
+    config["ARCHIVE"]["file"] = os.path.join(state_dir, "pages.pack")
+    if base_url is not None:
+        if not config.has_section("BAIDU"):
+            config.add_section("BAIDU")
+        config["BAIDU"]["base_url"] = base_url
+    return config
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def make_baidu_pages(page_dir, count, seed=0):
+    """
+    生成结构与百度百科词条相同的网页，属性表格中的链接指向其他生成的词条，
+    可以被BaiduSpider.process_body与get_extra_links_from_body解析
+    :return: 词条名的list
+    """
+    rng = random.Random(seed)
+    titles = ["词条{:05d}".format(i) for i in range(count)]
+    filler = "军事装备与武器系统的发展历史。" * 40
+    for i, title in enumerate(titles):
+        blocks = []
+        for side in ("left", "right"):
+            items = []
+            for j in range(8):
+                value = "属性值{}-{}".format(i, j)
+                if rng.random() < 0.3:
+                    value = '<a target="_blank" href="/item/{}">{}</a>'.format(rng.choice(titles), value)
+                items.append('<dt class="basicInfo-item name">属性{}</dt>\n'
+                             '<dd class="basicInfo-item value">\n{}\n</dd>'.format(j, value))
+            blocks.append('<dl class="basicInfo-block basicInfo-{}">\n{}\n</dl>'.format(side, "\n".join(items)))
+        paras = "\n".join('<div class="para">{}[{}]</div>'.format(filler, k) for k in range(rng.randint(5, 20)))
+        body = ('<html><head><title>{title}_百度百科</title></head><body>\n'
+                '<dl class="lemmaWgt-lemmaTitle lemmaWgt-lemmaTitle-">\n'
+                '<dd class="lemmaWgt-lemmaTitle-title"><h1>{title}</h1></dd></dl>\n'
+                '<div class="lemma-summary" label-module="lemmaSummary">{summary}</div>\n'
+                '<div class="basic-info cmn-clearfix">\n{blocks}\n</div>\n{paras}\n'
+                '</body></html>').format(title=title, summary=filler, blocks="\n".join(blocks), paras=paras)
+        with open(os.path.join(page_dir, title + ".html"), "w", encoding="utf-8") as f:
+            f.write(body)
+    return titles
+
+
+def time_items(fn, items):
+    """
+    :return: 每个item的耗时（秒）与失败数
+    """
+    latencies = []
+    errors = 0
+    for item in items:
+        start = time.perf_counter()
+        try:
+            fn(item)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def read_wiki_pages():
+    pages = []
+    for name in sorted(os.listdir(WIKI_PAGE_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(WIKI_PAGE_DIR, name), encoding="utf-8") as f:
+                pages.append(f.read())
+    return pages
+
+
+def bench_parse_wiki_page(args):
+    """WikiSpider.process_body逐页解析data/wikiPages"""
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(load_config(), "zh")
+    pages = read_wiki_pages()
+    latencies, errors = time_items(s.process_body, pages)
+    return {"items": len(pages), "seconds": sum(latencies), "latencies": latencies, "errors": errors}
+
+
+def bench_parse_wiki_corpus(args):
+    """WikiSpider.process_body一次解析整个data/wikiPages，包括读文件"""
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(load_config(), "zh")
+    start = time.perf_counter()
+    pages = read_wiki_pages()
+    _, errors = time_items(s.process_body, pages)
+    return {"items": len(pages), "seconds": time.perf_counter() - start, "errors": errors}
+
+
+def bench_strip_info_value(args):
+    """WikiSpider.strip_info_value处理data/wikiPages中所有infobox的值"""
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(load_config(), "zh")
+    values = []
+    for body in read_wiki_pages():
+        doc = s.parser.parse(body)
+        for table in s.parser.find_all(doc, "table", cls="infobox"):
+            values.extend(s.parser.text(td) for td in s.parser.find_all(table, "td"))
+    values = values * 20
+    latencies, errors = time_items(s.strip_info_value, values)
+    return {"items": len(values), "seconds": sum(latencies), "latencies": latencies, "errors": errors}
+
+
+def bench_parse_baidu_page(args):
+    """BaiduSpider.process_body逐页解析生成的百科网页"""
+    from spider.baidu_spider import BaiduSpider
+    s = BaiduSpider(load_config())
+    with tempfile.TemporaryDirectory() as page_dir:
+        titles = make_baidu_pages(page_dir, args.baidu_pages)
+        pages = []
+        for title in titles:
+            with open(os.path.join(page_dir, title + ".html"), encoding="utf-8") as f:
+                pages.append(f.read())
+    latencies, errors = time_items(s.process_body, pages)
+    return {"items": len(pages), "seconds": sum(latencies), "latencies": latencies, "errors": errors}
+
+
+def bench_job_get_web_content_json(args):
+    """main.get_web_content_json通过本地模拟的百科抓取并解析生成的网页"""
+    import main
+    from spider.local_server import LocalWikiServer
+    with tempfile.TemporaryDirectory() as work_dir:
+        page_dir = os.path.join(work_dir, "pages")
+        os.mkdir(page_dir)
+        titles = make_baidu_pages(page_dir, args.baidu_pages)
+        with LocalWikiServer(page_dir, latency=args.latency, prefix="/item/") as server:
+            url_file = os.path.join(work_dir, "urls.txt")
+            with open(url_file, "w", encoding="utf-8") as f:
+                f.writelines(server.url_for(title) + "\n" for title in titles)
+            start = time.perf_counter()
+            main.get_web_content_json(load_config(server.base_url + "/"), "zh", url_file,
+                                      os.path.join(work_dir, "out.txt"))
+            seconds = time.perf_counter() - start
+            return {"items": len(titles), "seconds": seconds, "requests": server.request_count}
+
+
+def bench_job_get_extra_links(args):
+    """main.get_extra_links从本地模拟的百科的一部分词条出发，沿属性表格链接扩展"""
+    import main
+    from spider.local_server import LocalWikiServer
+    with tempfile.TemporaryDirectory() as work_dir:
+        page_dir = os.path.join(work_dir, "pages")
+        os.mkdir(page_dir)
+        titles = make_baidu_pages(page_dir, args.baidu_pages)
+        with LocalWikiServer(page_dir, latency=args.latency, prefix="/item/") as server:
+            url_file = os.path.join(work_dir, "urls.txt")
+            with open(url_file, "w", encoding="utf-8") as f:
+                f.writelines(server.url_for(title) + "\n" for title in titles[:len(titles) // 10 or 1])
+            start = time.perf_counter()
+            main.get_extra_links(load_config(server.base_url + "/"), url_file, os.path.join(work_dir, "out.txt"))
+            seconds = time.perf_counter() - start
+            return {"items": server.request_count, "seconds": seconds, "requests": server.request_count}
+
+
+def time_command(cmd, runs):
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_cli_startup(args):
+    """python cli.py --help的启动时间，cli.py不应在模块加载时导入spider与第三方库"""
+    latencies = time_command([sys.executable, os.path.join(ROOT, "cli.py"), "--help"], 10)
+    return {"items": len(latencies), "seconds": sum(latencies), "latencies": latencies}
+
+
+def bench_spider_import(args):
+    """导入spider.baidu_spider与spider.wikipedia_spider的时间，即entity等简单子命令的启动开销"""
+    latencies = time_command([sys.executable, "-c", "import spider.baidu_spider, spider.wikipedia_spider"], 10)
+    return {"items": len(latencies), "seconds": sum(latencies), "latencies": latencies}
+
+
+# 导入cli、main与spider时不应加载的第三方库，只有用到它们的子命令才导入
+_HEAVY_MODULES = ("pandas", "numpy", "aiohttp", "pyarrow", "msgpack", "opencc")
+
+
+def check_lazy_imports(args):
+    """导入cli、main与两个spider并构造命令行解析器时不加载_HEAVY_MODULES"""
+    code = ("import json, sys\n"
+            "import cli, main, spider.baidu_spider, spider.wikipedia_spider\n"
+            "cli.build_parser()\n"
+            "print(json.dumps([m for m in {!r} if m in sys.modules]))".format(_HEAVY_MODULES))
+    p = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    loaded = json.loads(p.stdout.strip().splitlines()[-1])
+    assert not loaded, "imported at startup: {}".format(", ".join(loaded))
+
+
+def check_async_engine(args):
+    """
+    WikiSpider的asyncio引擎从本地模拟的Wikipedia抓取data/wikiPages中的所有网页：
+    结果与直接解析本地文件相同，每个网页只请求一次，同时在途的请求数超过线程池的上限，
+    解析不在事件循环所在的线程中进行
+    """
+    from spider.local_server import LocalWikiServer
+    from spider.session import get_pool_size
+    from spider.wikipedia_spider import WikiSpider
+    config = load_config()
+    s = WikiSpider(config, "zh")
+    expected = {}
+    for page in read_wiki_pages():
+        try:
+            r = s.process_body(page)
+        except Exception:  # 没有infobox等无法解析的网页，asyncio引擎同样会跳过
+            continue
+        if r is not None:
+            expected.update(r)
+    threads = set()
+
+    def process(url, body):
+        threads.add(threading.get_ident())
+        return s.process_body(body)
+
+    # 延迟足够长，所有请求都能同时在途
+    with LocalWikiServer(WIKI_PAGE_DIR, latency=max(args.latency, 0.2)) as server:
+        urls = server.page_urls()
+        results = s.async_fetcher.fetch_all(urls, process)
+        assert server.request_count == len(urls), "{} requests for {} pages".format(server.request_count, len(urls))
+        assert server.max_inflight > get_pool_size(config), \
+            "only {} requests in flight".format(server.max_inflight)
+    actual = {}
+    for r in results:
+        actual.update(r)
+    assert expected, "no page in {} could be parsed".format(WIKI_PAGE_DIR)
+    assert actual == expected, "async results differ from parsing the files: {} vs {} pages".format(
+        len(actual), len(expected))
+    assert threading.get_ident() not in threads, "pages were parsed on the event loop thread"
+
+
+def check_rate_limit(args):
+    """
+    本地模拟服务器按每秒rate个请求限流、超过时返回429：
+    以前固定线程数、不重试的抓取方式会丢失网页；按config.ini中[RATELIMIT]与[RETRY]限流重试时所有网页都能抓到，
+    吞吐量接近服务端的上限，并且被429拒绝与重试的请求比固定线程数加重试少
+    """
+    from spider.executor import imap_unordered
+    from spider.local_server import LocalWikiServer
+    from spider.session import get_pool_size
+    from spider.wikipedia_spider import WikiSpider
+    rate = 20
+    full_config = configparser.ConfigParser()
+    full_config.read(os.path.join(ROOT, "config.ini"), encoding="utf-8")
+
+    def crawl(config):
+        s = WikiSpider(config, "zh")
+        with LocalWikiServer(WIKI_PAGE_DIR, latency=args.latency, rate_limit=rate, retry_after=1) as server:
+            urls = server.page_urls()
+            start = time.perf_counter()
+            fetched = sum(1 for body in imap_unordered(s.session.get_text, urls, get_pool_size(config))
+                          if body is not None)
+            return fetched, len(urls), time.perf_counter() - start, server.request_count
+
+    fixed = load_config()
+    fixed["RETRY"]["max_retries"] = "0"
+    fetched, total, _, _ = crawl(fixed)
+    assert fetched < total, "the stand-in server did not throttle the fixed thread pool"
+
+    fixed["RETRY"]["max_retries"] = full_config["RETRY"]["max_retries"]
+    _, _, _, fixed_requests = crawl(fixed)
+
+    adaptive = load_config()
+    adaptive.read_dict({"RATELIMIT": dict(full_config["RATELIMIT"])})
+    fetched, total, seconds, requests = crawl(adaptive)
+    assert fetched == total, "lost {} of {} pages".format(total - fetched, total)
+    assert total / seconds >= rate * 0.8, "{:.1f} pages/s under a limit of {}/s".format(total / seconds, rate)
+    assert requests < fixed_requests, "{} requests with rate limiting, {} without".format(requests, fixed_requests)
+
+
+def check_langlinks(args):
+    """
+    WikiSpider.align_language在本地模拟的Wikipedia上分别下载网页与通过api对齐data/wikiPages中的词条：
+    两种方式输出的对齐链接相同，api方式的请求数与传输字节数都少一个数量级以上，输入中不是词条页面的url被跳过
+    """
+    from spider.local_server import LocalWikiServer
+    from spider.output import iter_records
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(load_config(), "zh")
+    os.makedirs("data", exist_ok=True)
+    output_file = "data/中文-日本語-align-urls.txt"
+
+    def align(urls, use_api):
+        with open("urls.txt", "w", encoding="utf-8") as f:
+            f.writelines(url + "\n" for url in urls)
+        requests, bytes_sent = server.request_count, server.bytes_sent
+        s.align_language("urls.txt", "中文", "日本語", use_api=use_api)
+        records = sorted(json.dumps(r, ensure_ascii=False) for r in iter_records(output_file))
+        return records, server.request_count - requests, server.bytes_sent - bytes_sent
+
+    with LocalWikiServer(WIKI_PAGE_DIR, latency=args.latency) as server:
+        html_records, html_requests, html_bytes = align(server.page_urls(), False)
+        api_records, api_requests, api_bytes = align(
+            server.page_urls() + [server.base_url + "/w/index.php?title=not_a_page_url"], True)
+    assert html_records, "no page in {} links to a Japanese page".format(WIKI_PAGE_DIR)
+    assert api_records == html_records, "{} records from the api, {} from the pages".format(
+        len(api_records), len(html_records))
+    assert api_requests * 10 <= html_requests, "{} api requests for {} pages".format(api_requests, html_requests)
+    assert api_bytes * 10 <= html_bytes, "{} bytes from the api, {} from the pages".format(api_bytes, html_bytes)
+
+
+def check_response_cache(args):
+    """
+    ResponseCache：未过期时不发请求，过期后带ETag重新验证得到304时不重新下载；
+    url的不同写法共用一条缓存，/zh-cn/等变体路径不共用；内容相同的网页只存一份；
+    超过max_size时淘汰最久未访问的条目，淘汰后索引中的大小与磁盘上的文件一致
+    """
+    from spider.cache import ResponseCache
+    from spider.local_server import LocalWikiServer
+    from spider.session import SpiderSession
+    cache = ResponseCache("http_cache", ttl=3600)
+    session = SpiderSession(cache=cache)
+    with LocalWikiServer(WIKI_PAGE_DIR, latency=args.latency) as server:
+        url = server.page_urls()[0]
+        first = session.get_text(url)
+        assert first is not None and server.request_count == 1
+        assert session.get_text(url) == first and server.request_count == 1, "a fresh entry was refetched"
+        cache.ttl = 0
+        bytes_sent = server.bytes_sent
+        assert session.get_text(url) == first and server.request_count == 2, "an expired entry was not revalidated"
+        assert server.bytes_sent == bytes_sent, "a 304 revalidation downloaded the page again"
+        cache.ttl = 3600
+        assert session.get_text(url) == first and server.request_count == 2, "revalidation did not reset the ttl"
+
+    cache.store("HTTPS://zh.wikipedia.org/wiki/%E6%AD%A5%E6%9E%AA#history", "a")
+    assert cache.lookup("https://zh.wikipedia.org/wiki/步枪").text == "a"
+    assert cache.lookup("https://zh.wikipedia.org/zh-cn/步枪") is None, "variant paths share a cache entry"
+    cache.store("https://zh.wikipedia.org/zh-cn/步枪", "a")
+    # 抓取的网页与两个变体共用的"a"
+    assert cache.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 2, "identical bodies are stored twice"
+
+    rng = random.Random(0)
+    texts = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8000)) for _ in range(10)]
+    cache = ResponseCache("small_cache", max_size=25000)
+    for i, text in enumerate(texts):
+        cache.store("https://example.org/item/{}".format(i), text)
+        # 第一个条目一直在被访问，淘汰时应保留
+        assert cache.lookup("https://example.org/item/0").text == texts[0]
+        time.sleep(0.01)
+    assert cache.total_size <= cache.max_size
+    assert cache.lookup("https://example.org/item/0") is not None, "a recently used entry was evicted"
+    assert cache.lookup("https://example.org/item/1") is None, "the least recently used entry was kept"
+    assert cache.lookup("https://example.org/item/9").text == texts[9]
+    blobs = sum(len(files) for _, _, files in os.walk(os.path.join("small_cache", "objects")))
+    assert blobs == cache.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], "evicted blobs left on disk"
+    assert cache.total_size == cache.conn.execute("SELECT SUM(size) FROM blobs").fetchone()[0]
+
+
+def check_jsonl_output(args):
+    """
+    imap_unordered只比已返回的结果多取max_pending个输入，结果不丢不重；
+    JsonlWriter写出的记录与iter_records读回的相同，append时接在已有记录之后，旧的JSON数组格式也能读取
+    """
+    from spider.executor import imap_unordered
+    from spider.output import iter_records, open_writer
+    taken = []
+
+    def inputs():
+        for i in range(1000):
+            taken.append(i)
+            yield i
+
+    results = []
+    for r in imap_unordered(lambda i: i * i, inputs(), max_workers=4, max_pending=8):
+        assert len(taken) <= len(results) + 1 + 8, "{} inputs taken for {} results".format(len(taken), len(results))
+        results.append(r)
+    assert sorted(results) == [i * i for i in range(1000)]
+
+    records = [{"步枪{}".format(i): {"国家": "中国", "summary": "第{}条\n".format(i), "imgs": []}} for i in range(100)]
+    records += [["id", "名称", ["https://example.org/1.jpg"]], {"url": "u", "中文": None}]
+    with open_writer("records.txt") as writer:
+        for record in records[:50]:
+            writer.write(record)
+    with open_writer("records.txt", append=True) as writer:
+        for record in records[50:]:
+            writer.write(record)
+    assert list(iter_records("records.txt")) == records
+    with open("records.txt", encoding="utf-8") as f:
+        assert sum(1 for _ in f) == len(records), "records are not one per line"
+    with open("legacy.txt", "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    assert list(iter_records("legacy.txt")) == records
+
+
+def check_binary_output(args):
+    """
+    msgpack（含gzip）与Parquet写出的实体记录、对齐记录与其他记录用iter_records读回后与写入的相同，
+    跨越多个row group时也不丢记录；fields只保留实体记录中的这些字段，三种格式的结果相同
+    """
+    from spider.output import iter_records, open_writer
+    entity = {"M16突击步枪": {"国家": "美国", "口径": "5.56毫米", "paragraph_text": ["第一段", "第二段"],
+                            "imgs": ["https://example.org/m16.jpg"]}}
+    records = [{"步枪{}".format(i): {"类型": "突击步枪", "summary": "摘要{}".format(i)}} for i in range(25)]
+    records += [
+        entity,
+        {"url": "https://zh.wikipedia.org/zh-cn/M16", "chinese": entity, "ja": None},
+        {"空实体": {}},
+        ["id", "名称", []],
+        {"url": "https://example.org/", "links": ["a", "b"]},
+    ]
+    kwargs = {"records.parquet": {"row_group_size": 10}, "records.msgpack": {}, "records.msgpack.gz": {},
+              "records.txt": {}}
+    selected = []
+    for path, writer_kwargs in kwargs.items():
+        with open_writer(path, **writer_kwargs) as writer:
+            for record in records:
+                writer.write(record)
+        assert list(iter_records(path)) == records, "{} did not round-trip".format(path)
+        selected.append(list(iter_records(path, fields=["口径", "paragraph_text"])))
+    assert all(r == selected[0] for r in selected), "fields differ between formats"
+    assert selected[0][25] == {"M16突击步枪": {"口径": "5.56毫米", "paragraph_text": ["第一段", "第二段"]}}
+    assert selected[0][26]["chinese"] == selected[0][25] and selected[0][26]["ja"] is None
+    assert selected[0][0] == {"步枪0": {}} and selected[0][-2:] == records[-2:]
+    with open("records.msgpack.gz", "rb") as f:
+        assert f.read(2) == b"\x1f\x8b", ".msgpack.gz is not gzip-compressed"
+
+
+def check_crawl_resume(args):
+    """
+    main.get_extra_links在本地模拟的百科上爬到一半被中断后用--resume继续：
+    已完成的url不再请求，最终输出的url与一次爬完的相同
+    """
+    import main
+    from spider.crawl_state import DONE, CrawlState
+    from spider.local_server import LocalWikiServer
+    os.mkdir("pages")
+    titles = make_baidu_pages("pages", 200)
+    crawl_extra_links = main.crawl_extra_links
+    completed = []
+
+    def interrupted(configure, s, urls, handle, *rest):
+        def handle_until_killed(url, r):
+            if len(completed) == 20:
+                raise KeyboardInterrupt
+            handle(url, r)
+            completed.append(url)
+
+        crawl_extra_links(configure, s, urls, handle_until_killed, *rest)
+
+    def read_urls(path):
+        with open(path, encoding="utf-8") as f:
+            return set(f.read().split())
+
+    with LocalWikiServer("pages", latency=args.latency, prefix="/item/") as server:
+        config = load_config(server.base_url + "/")
+        with open("urls.txt", "w", encoding="utf-8") as f:
+            f.writelines(server.url_for(title) + "\n" for title in titles[:10])
+        main.get_extra_links(config, "urls.txt", "full.txt")
+        full_requests = server.request_count
+
+        main.crawl_extra_links = interrupted
+        try:
+            main.get_extra_links(config, "urls.txt", "out.txt")
+            raise AssertionError("the crawl was not interrupted")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            main.crawl_extra_links = crawl_extra_links
+        state = CrawlState("out.txt.state")
+        done = state.count(status=DONE)
+        state.close()
+        assert done == 20, "{} urls recorded as done before the interruption".format(done)
+
+        requests = server.request_count
+        main.get_extra_links(config, "urls.txt", "out.txt", resume=True)
+        resumed_requests = server.request_count - requests
+    assert read_urls("out.txt") == read_urls("full.txt"), "the resumed crawl found different urls"
+    assert resumed_requests == full_requests - done, "{} requests after resuming, {} urls left".format(
+        resumed_requests, full_requests - done)
+
+
+def check_frontier(args):
+    """
+    Frontier按层BFS时每个url只出现一次，所在的层数等于离初始url的最短距离；
+    同一个词条的不同写法（/zh-cn/、移动版、#fragment）只算一个url
+    """
+    from collections import deque
+    from spider.canonical import canonicalize
+    from spider.frontier import Frontier
+    rng = random.Random(0)
+    urls = [canonicalize("https://zh.wikipedia.org/wiki/词条{}".format(i)) for i in range(500)]
+    links = {url: rng.sample(urls, 5) for url in urls}
+    seeds = urls[:3]
+
+    distance = {url: 0 for url in seeds}
+    queue = deque(seeds)
+    while queue:
+        url = queue.popleft()
+        for link in links[url]:
+            if link not in distance:
+                distance[link] = distance[url] + 1
+                queue.append(link)
+
+    def spellings(url):
+        title = url.rsplit("/", 1)[1]
+        return [url, "https://zh.m.wikipedia.org/zh-cn/" + title, url + "#history"]
+
+    frontier = Frontier()
+    assert frontier.seed(u for url in seeds for u in spellings(url)) == len(seeds)
+    found = {}
+    level, batch = frontier.pop_level()
+    while batch:
+        for url in batch:
+            assert url not in found, "{} was popped twice".format(url)
+            found[url] = level
+            frontier.complete(url, [u for link in links[url] for u in spellings(link)])
+        level, batch = frontier.pop_level()
+    assert found == distance, "{} urls found, {} reachable, levels differ".format(len(found), len(distance))
+    assert len(frontier) == len(distance)
+
+
+def check_offline_extract(args):
+    """
+    OfflineExtractor增量提取data/wikiPages的一部分：第二次运行全部跳过；
+    只改了修改时间的文件跳过，内容变化的文件重新解析，删除的文件从manifest中去掉；
+    html解析后端变化后全部重新解析；manifest中的结果与直接解析文件的相同
+    """
+    from spider.offline import OfflineExtractor
+    from spider.wikipedia_spider import WikiSpider
+    os.mkdir("pages")
+    names = sorted(f for f in os.listdir(WIKI_PAGE_DIR) if f.endswith(".html"))[:6]
+    for name in names:
+        shutil.copy(os.path.join(WIKI_PAGE_DIR, name), "pages")
+    paths = [os.path.join("pages", name) for name in names]
+    config = load_config()
+    s = WikiSpider(config, "zh")
+
+    def expected():
+        results = []
+        for path in sorted(paths):
+            with open(path, encoding="utf-8") as f:
+                try:
+                    results.append(s.process_body(f.read()))
+                except Exception:  # 无法解析的网页在manifest中记为失败
+                    pass
+        return results
+
+    def run():
+        extractor = OfflineExtractor(config, WikiSpider, ("zh",), "manifest.sqlite")
+        try:
+            stats = extractor.run(paths, processes=2)
+            return stats, list(extractor.records())
+        finally:
+            extractor.close()
+
+    stats, records = run()
+    assert stats["extracted"] + stats["failed"] == len(paths) and records == expected(), stats
+    stats, records = run()
+    assert stats["skipped"] == len(paths) and records == expected(), stats
+
+    os.utime(paths[0], (time.time() + 60, time.time() + 60))
+    with open(paths[1], "a", encoding="utf-8") as f:
+        f.write("<!-- changed -->")
+    os.remove(paths.pop())
+    stats, records = run()
+    assert (stats["skipped"], stats["removed"], stats["total"]) == (len(paths) - 1, 1, len(paths)), stats
+    assert records == expected()
+
+    config["PARSER"]["backend"] = "bs4"
+    stats, _ = run()
+    assert stats["skipped"] == 0, "results from another parser backend were reused: {}".format(stats)
+
+
+def check_langlinks_batches(args):
+    """
+    LanglinksClient.query一次查询50个词条、结果需要多次continue时，与逐个词条查询的结果相同；
+    带下划线的词条名按规范化后的词条返回，不存在的词条不在结果中
+    """
+    from spider.langlinks import MAX_TITLES, LanglinksClient
+    from spider.local_server import LocalWikiServer
+    from spider.session import SpiderSession
+    client = LanglinksClient(SpiderSession())
+    titles = sorted(f[:-len(".html")] for f in os.listdir(WIKI_PAGE_DIR) if f.endswith(".html"))[:MAX_TITLES - 2]
+    spaced = next(f[:-len(".html")] for f in sorted(os.listdir(WIKI_PAGE_DIR)) if " " in f)
+    with LocalWikiServer(WIKI_PAGE_DIR, latency=args.latency) as server:
+        expected = {}
+        for title in titles:
+            expected.update(client.query(server.api_url, [title]))
+        spaced_links = client.query(server.api_url, [spaced]).get(spaced)
+        requests = server.request_count
+        result = client.query(server.api_url, titles + ["不存在的词条", spaced.replace(" ", "_")])
+        batch_requests = server.request_count - requests
+    assert expected and spaced_links, "no page in {} has langlinks".format(WIKI_PAGE_DIR)
+    assert sum(len(links) for links in expected.values()) > 500, "too few links to need a continue"
+    assert batch_requests > 1, "the batch did not need a continue"
+    assert {t: result[t] for t in titles if t in result} == expected, "batched results differ"
+    assert result.get(spaced.replace(" ", "_")) == spaced_links, "a normalized title lost its links"
+    assert "不存在的词条" not in result
+
+def check_multi_align(args):
+    """
+    main.get_multi_align_item合并日语、韩语对齐文件：同一个中文词条的不同写法合并为一个实体，
+    每个网页只抓取一次，每个实体输出一条包含所有语言的记录，某种语言没有对齐链接时该语言为None
+    """
+    from urllib.parse import unquote
+    import main
+    from spider.output import iter_records, open_writer
+    fetched = []
+
+    def get_web_content(self, url, is_from_file=False):
+        fetched.append(url)
+        return {url.rsplit("/", 1)[1]: {"url": url}}
+
+    zh = "https://zh.wikipedia.org/zh-cn/"
+    align_files = {"ja": ("ja.txt", "中文", "日本語"), "ko": ("ko.txt", "chinese", "ko")}
+    pairs = {
+        "ja": [{"中文": zh + "步枪", "日本語": "https://ja.wikipedia.org/wiki/小銃"},
+               {"中文": zh + "坦克", "日本語": "https://ja.wikipedia.org/wiki/戦車"}],
+        "ko": [{"chinese": "https://zh.m.wikipedia.org/wiki/步枪#历史", "ko": "https://ko.wikipedia.org/wiki/소총"},
+               {"chinese": zh + "火炮", "ko": "https://ko.wikipedia.org/wiki/화포"}],
+    }
+    for lang, (file_name, _, _) in align_files.items():
+        with open_writer(file_name) as writer:
+            for pair in pairs[lang]:
+                writer.write(pair)
+
+    get_web_content_orig, align_url_files = main.WikiSpider.get_web_content, main.align_url_files
+    main.WikiSpider.get_web_content, main.align_url_files = get_web_content, align_files
+    try:
+        main.get_multi_align_item(load_config(), ("ja", "ko"), output_file="multi.txt")
+    finally:
+        main.WikiSpider.get_web_content, main.align_url_files = get_web_content_orig, align_url_files
+    # 输出的url是规范化后的/zh-cn/形式
+    records = {unquote(r["url"])[len(zh):]: r for r in iter_records("multi.txt")}
+    assert len(fetched) == len(set(fetched)) == 7, "fetched {}".format(fetched)
+    assert set(records) == {"步枪", "坦克", "火炮"}, "entities: {}".format(list(records))
+    assert all(records["步枪"][k] is not None for k in ("chinese", "ja", "ko")), records["步枪"]
+    assert records["坦克"]["ko"] is None and records["火炮"]["ja"] is None
+
+
+def check_metrics(args):
+    """
+    Metrics的计数、gauge与直方图分位数；MetricsReporter写出的json与/metrics、/stats提供的统计一致，
+    port为0时自动选择端口，dump_file所在的目录不存在时自动创建；registry关闭时不记录任何统计
+    """
+    import urllib.request
+    from spider.metrics import Metrics, MetricsReporter
+    registry = Metrics(buckets=(0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        registry.observe("spider_stage_seconds", value, stage="fetch")
+    registry.inc("spider_requests_total", host="a", status=200)
+    registry.inc("spider_requests_total", 2, host="a", status=200)
+    registry.add("spider_inflight", 3, pool="thread")
+    registry.add("spider_inflight", -1, pool="thread")
+    try:
+        with registry.stage("parse"):
+            raise ValueError
+    except ValueError:
+        pass
+    histogram = registry.histograms[("spider_stage_seconds", (("stage", "fetch"),))]
+    assert (histogram.quantile(0.5), histogram.quantile(0.75), histogram.quantile(1.0)) == (0.1, 1.0, float("inf"))
+
+    reporter = MetricsReporter(registry, dump_file=os.path.join("metrics", "stats.json"), dump_interval=0, port=0)
+    with reporter:
+        with urllib.request.urlopen(reporter.url + "/metrics") as r:
+            prometheus = r.read().decode("utf-8")
+        with urllib.request.urlopen(reporter.url + "/stats") as r:
+            stats = json.loads(r.read().decode("utf-8"))
+    for line in ('spider_requests_total{host="a",status="200"} 3', 'spider_inflight{pool="thread"} 2',
+                 'spider_errors_total{error="ValueError",stage="parse"} 1',
+                 'spider_stage_seconds_bucket{stage="fetch",le="1.0"} 3',
+                 'spider_stage_seconds_bucket{stage="fetch",le="+Inf"} 4',
+                 'spider_stage_seconds_count{stage="fetch"} 4'):
+        assert line in prometheus.splitlines(), "missing from /metrics: {}".format(line)
+    with open(os.path.join("metrics", "stats.json"), encoding="utf-8") as f:
+        dumped = json.load(f)
+    for snapshot in (stats, dumped):
+        assert snapshot["counters"]["spider_requests_total"][0]["value"] == 3
+        fetch = [h for h in snapshot["histograms"]["spider_stage_seconds"] if h["labels"] == {"stage": "fetch"}]
+        assert fetch[0]["count"] == 4 and fetch[0]["p50"] == 0.1, fetch
+
+    registry.reset()
+    registry.enabled = False
+    registry.inc("spider_requests_total")
+    with registry.stage("parse"):
+        pass
+    assert not registry.counters and not registry.histograms, "a disabled registry recorded metrics"
+
+
+def _strip_info_value_multipass(info: str) -> str:
+    """
+    以前WikiSpider.strip_info_value逐个replace的实现，用作Normalizer的参照
+    """
+    for noise in (".mw-parser-output", ".geo-default", ".geo-dms", ".geo-nondefault", ".longitude", ".latitude",
+                  ".geo-dec", ".geo-multi-punct", "{display:inline}", "{display:none}", "{white-space:nowrap}"):
+        info = info.replace(noise, "")
+    return re.sub(r"\[(\d)*\]", "", info).replace(" ,", "").strip().lstrip(",")
+
+
+def check_normalize(args):
+    """
+    Normalizer对data/wikiPages中所有infobox值的结果与以前逐个replace的实现相同；
+    繁简转换的结果按字符串缓存，同一个值只转换一次；baidu profile只去掉首尾换行符；
+    normalize_record转换嵌套记录中的所有字符串
+    """
+    from spider.normalize import BAIDU, Normalizer
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(load_config(), "zh")
+    values = []
+    for body in read_wiki_pages():
+        doc = s.parser.parse(body)
+        for table in s.parser.find_all(doc, "table", cls="infobox"):
+            values.extend(s.parser.text(td) for td in s.parser.find_all(table, "td"))
+    values += [" ,.geo-default.geo-dms[1]30°N{display:none}[] ", ".mw-parser-output .longitude{white-space:nowrap}"]
+    assert len(values) > 100, "too few infobox values in {}".format(WIKI_PAGE_DIR)
+    normalizer = Normalizer()
+    for value in values:
+        expected = _strip_info_value_multipass(value)
+        assert normalizer.normalize_value(value) == expected, "{!r} -> {!r}".format(value, expected)
+
+    converted = []
+
+    def converter(text):
+        converted.append(text)
+        return text.replace("國", "国").replace("槍", "枪")
+
+    normalizer = Normalizer(to_simplified=True, converter=converter)
+    for _ in range(3):
+        assert normalizer.normalize_value(" 美國[2] ") == "美国"
+        assert normalizer.normalize_key("\n步槍 ") == "步枪"
+    assert converted == ["美國", "步槍"], "cached conversions were repeated: {}".format(converted)
+    record = {"步槍": {"國家": ["美國[1]", 1], "summary": None}}
+    assert normalizer.normalize_record(record) == {"步枪": {"国家": ["美国", 1], "summary": None}}
+
+    normalizer = Normalizer(profile=BAIDU)
+    assert normalizer.normalize_value("\n 5.56毫米[1] \n") == " 5.56毫米[1] "
+    assert normalizer.normalize_key("\n口径\n") == "口径"
+
+
+def check_work_queue(args):
+    """
+    SqliteWorkQueue与通过WorkQueueServer访问的HttpWorkQueue：每个租约只含一个host的url，同一个url不会同时在两个租约中；
+    租约到期后重新分配，旧租约的complete、renew、fail都被拒绝，merge_queue_output只保留新租约的结果；
+    失败或到期超过max_attempts次的url标记为失败；参数错误时客户端抛出RuntimeError
+    """
+    import main
+    from spider.workqueue import DONE, FAILED, HttpWorkQueue, SqliteWorkQueue, WorkQueueServer
+
+    def check(queue, name):
+        urls = ["https://{}.example.org/item/{}".format(host, i) for host in ("a", "b") for i in range(50)]
+        assert queue.add(urls) == len(urls) and queue.add(urls[:10]) == 0
+        leased = []
+
+        def lease_all():
+            while True:
+                lease = queue.lease(7)
+                if lease is None:
+                    return
+                leased.append(lease)
+
+        threads = [threading.Thread(target=lease_all) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        items = [url for lease in leased for url, _ in lease.items]
+        assert sorted(items) == sorted(urls), "{} urls leased, {} added".format(len(items), len(urls))
+        assert all(len({url.split("/")[2] for url, _ in lease.items}) == 1 for lease in leased), "mixed hosts"
+        for lease in leased:
+            assert queue.complete(lease.id, [url for url, _ in lease.items]) == [url for url, _ in lease.items]
+
+        queue.add(["https://c.example.org/item/0", "https://c.example.org/item/1"])
+        old = queue.lease(10, lease_seconds=0.05)
+        time.sleep(0.1)
+        new = queue.lease(10)
+        assert sorted(new.items) == sorted(old.items) and new.id != old.id, "an expired lease was not reassigned"
+        assert not queue.renew(old.id), "an expired lease was renewed"
+        queue.fail(old.id, "https://c.example.org/item/1", "stale")
+        assert queue.complete(old.id, ["https://c.example.org/item/0"]) == [], "an expired lease completed a url"
+        assert queue.complete(new.id, ["https://c.example.org/item/0", "https://c.example.org/item/1"]) == \
+            ["https://c.example.org/item/0", "https://c.example.org/item/1"]
+        committed = queue.committed()
+        assert committed["https://c.example.org/item/0"] == new.id and len(committed) == len(urls) + 2
+
+        os.makedirs(name + "_shards")
+        with open(os.path.join(name + "_shards", "worker.jsonl"), "w", encoding="utf-8") as f:
+            for lease, title in ((old, "stale"), (new, "fresh")):
+                f.write(json.dumps({"url": "https://c.example.org/item/0", "lease": lease.id,
+                                    "record": {title: {}}}) + "\n")
+        queue_spec = queue.url if isinstance(queue, HttpWorkQueue) else queue.path
+        assert main.merge_queue_output(queue_spec, name + "_shards", name + "_merged.txt") == 1
+        with open(name + "_merged.txt", encoding="utf-8") as f:
+            assert json.loads(f.read()) == {"fresh": {}}, "the result of an expired lease was merged"
+
+        queue.add(["https://d.example.org/item/0", "https://d.example.org/item/1"])
+        for _ in range(3):
+            lease = queue.lease(10)
+            queue.fail(lease.id, "https://d.example.org/item/0", "error")
+            queue.renew(lease.id, lease_seconds=0)
+        time.sleep(0.01)
+        assert queue.lease(10) is None, "a url was leased more than max_attempts times"
+        counts = queue.counts()
+        assert (counts.get(DONE), counts.get(FAILED)) == (len(urls) + 2, 2), counts
+
+    queue = SqliteWorkQueue("queue.sqlite", max_attempts=3)
+    check(queue, "sqlite")
+    queue.close()
+    with WorkQueueServer(SqliteWorkQueue("served.sqlite", max_attempts=3)) as server:
+        queue = HttpWorkQueue(server.url)
+        check(queue, "http")
+        try:
+            queue._call("/complete", lease_id="x")
+            raise AssertionError("a request without items was accepted")
+        except RuntimeError:
+            pass
+        queue.close()
+
+
+def check_canonical(args):
+    """
+    canonicalize对各种写法的规则，keep_variant只做基本的统一；
+    CanonicalIndex从<link rel="canonical">学习重定向并保存到sqlite，下次运行时重定向在抓取前就能去重，
+    重定向到本次已处理词条的网页不再处理，不同host之间的重定向与重定向环被忽略
+    """
+    from spider.canonical import CanonicalIndex, canonicalize, find_canonical_link
+    wiki = "https://zh.wikipedia.org/wiki/M16%E7%AA%81%E5%87%BB%E6%AD%A5%E6%9E%AA"
+    for url in ("https://zh.wikipedia.org/wiki/M16突击步枪", "HTTPS://ZH.WIKIPEDIA.ORG/wiki/M16突击步枪#历史",
+                "https://zh.m.wikipedia.org/zh-cn/M16突击步枪", wiki.replace("/wiki/", "/zh-tw/"),
+                "https://zh.wikipedia.org/w/index.php?title=M16突击步枪", "https://zh.wikipedia.org/wiki/M16突击步枪?oldid=1"):
+        assert canonicalize(url) == wiki, "{} -> {}".format(url, canonicalize(url))
+    assert canonicalize("https://en.wikipedia.org/wiki/M16 rifle") == "https://en.wikipedia.org/wiki/M16_rifle"
+    assert canonicalize("https://baike.baidu.com/item/步枪?fromModule=lemma_search-box") == \
+        "https://baike.baidu.com/item/%E6%AD%A5%E6%9E%AA"
+    assert canonicalize("https://example.org/search?q=1") == "https://example.org/search?q=1"
+    assert canonicalize("https://zh.m.wikipedia.org/zh-cn/步枪?x=1#a", keep_variant=True) == \
+        "https://zh.m.wikipedia.org/zh-cn/%E6%AD%A5%E6%9E%AA?x=1"
+
+    def page(href):
+        return '<html><head><link rel="canonical" href="{}"></head><body></body></html>'.format(href)
+
+    assert find_canonical_link("https://zh.wikipedia.org/wiki/A", page("/wiki/B")) == "https://zh.wikipedia.org/wiki/B"
+    assert find_canonical_link("https://zh.wikipedia.org/wiki/A", "<html><head></head></html>") is None
+
+    path = os.path.join("index", "canonical.db")
+    index = CanonicalIndex(path)
+    assert [index.claim(u) for u in ("https://zh.wikipedia.org/wiki/A", "https://zh.m.wikipedia.org/zh-cn/A")] == \
+        ["https://zh.wikipedia.org/wiki/A", None]
+    assert index.learn("https://zh.wikipedia.org/wiki/A", page("/wiki/A")), "a self-canonical page was skipped"
+    assert index.claim("https://zh.wikipedia.org/wiki/AR") is not None
+    assert not index.learn("https://zh.wikipedia.org/wiki/AR", page("/wiki/A")), "a redirect to A was processed"
+    assert index.learn("https://zh.wikipedia.org/wiki/C", page("https://evil.example.org/wiki/A"))
+    assert index.learn("https://zh.wikipedia.org/wiki/X", page("/wiki/Y"))
+    assert index.learn("https://zh.wikipedia.org/wiki/Y", page("/wiki/X"))
+    assert index.stats()["redirect_duplicates"] == 1 and index.stats()["duplicates"] == 1
+    index.close()
+
+    index = CanonicalIndex(path)
+    assert index.resolve("https://zh.m.wikipedia.org/zh-cn/AR") == "https://zh.wikipedia.org/wiki/A"
+    assert index.resolve("https://zh.wikipedia.org/wiki/C") == "https://zh.wikipedia.org/wiki/C"
+    assert index.resolve("https://zh.wikipedia.org/wiki/X") in ("https://zh.wikipedia.org/wiki/X",
+                                                                "https://zh.wikipedia.org/wiki/Y")
+    assert list(index.unique(["https://zh.wikipedia.org/wiki/AR", "https://zh.wikipedia.org/wiki/A"])) == \
+        ["https://zh.wikipedia.org/wiki/A"], "a known redirect was not deduplicated before fetching"
+    index.close()
+
+
+def check_entity_names(args):
+    """
+    BaiduSpider.check_entity_names在本地模拟的百科上查询关键词：重复的关键词只查询一次，
+    第二次查询与重新构造spider后都从缓存返回、不发请求；查询失败的关键词不缓存；
+    缓存的sqlite文件在第一次查询时才创建，超过ttl的结果重新查询
+    """
+    from spider.baidu_spider import BaiduSpider
+    from spider.local_server import LocalWikiServer
+    os.mkdir("pages")
+    titles = make_baidu_pages("pages", 20)
+    keywords = titles + titles[:5] + ["不存在的词条"]
+    cache_file = os.path.abspath(os.path.join("names", "entity_names.db"))
+    with LocalWikiServer("pages", latency=args.latency, prefix="/item/") as server:
+        config = load_config(server.base_url + "/")
+        config["ENTITY"]["cache_file"] = cache_file
+        s = BaiduSpider(config)
+        assert not os.path.exists(cache_file), "the entity name cache was opened before the first query"
+        results = s.check_entity_names(keywords)
+        assert list(results) == list(dict.fromkeys(keywords))
+        assert all(results[title] == title for title in titles) and results["不存在的词条"] is None, results
+        assert server.request_count == len(titles) + 1
+
+        requests = server.request_count
+        assert s.check_entity_names(titles) == {title: title for title in titles}
+        assert server.request_count == requests, "cached names were queried again"
+        s.entity_names.close()
+
+        s = BaiduSpider(config)
+        assert s.check_entity_name(titles[0]) == titles[0] and server.request_count == requests, \
+            "names were not persisted"
+        assert s.check_entity_names(["不存在的词条"]) == {"不存在的词条": None}
+        assert server.request_count == requests + 1, "a failed lookup was cached"
+        s.entity_names.close()
+
+        config["ENTITY"]["ttl"] = "0"
+        s = BaiduSpider(config)
+        assert s.check_entity_name(titles[0]) == titles[0] and server.request_count == requests + 2, \
+            "an expired name was not queried again"
+        s.entity_names.close()
+
+
+def check_recrawl(args):
+    """
+    RecrawlState的重访间隔：第一次为initial_interval，内容变化时减半、未变化或304时加倍，限制在[min, max]内；
+    main.recrawl_web_content在本地模拟的百科上：未到期的url不请求，304与只改了内联脚本的网页不提取，
+    内容变化的网页写入delta文件
+    """
+    import main
+    from spider.canonical import canonicalize
+    from spider.local_server import LocalWikiServer
+    from spider.output import iter_records
+    from spider.recrawl import CHANGED, NOT_MODIFIED, UNCHANGED, RecrawlState, content_hash, get_revision_id
+    state = RecrawlState(os.path.join("state", "unit.state"), min_interval=10, max_interval=100, initial_interval=40)
+    intervals = []
+    for result in (CHANGED, CHANGED, CHANGED, CHANGED, UNCHANGED, NOT_MODIFIED, NOT_MODIFIED, NOT_MODIFIED):
+        state.update("u", result, etag='"1"' if not intervals else None, digest="h" if not intervals else None)
+        intervals.append(state.get("u").interval)
+    assert intervals == [40, 20, 10, 10, 20, 40, 80, 100], intervals
+    meta = state.get("u")
+    assert (meta.etag, meta.content_hash, meta.checks, meta.changes) == ('"1"', "h", 8, 4)
+    assert list(state.due(["u", "v"], now=meta.next_fetch_at - 1)) == ["v"]
+    assert list(state.due(["u", "v"], now=meta.next_fetch_at)) == ["u", "v"]
+    state.close()
+    assert content_hash("<p>a</p><script>id=1</script>") == content_hash("<p>a</p><SCRIPT type=x>id=2</SCRIPT>")
+    assert content_hash("<p>a</p>") != content_hash("<p>b</p>")
+    assert get_revision_id('"wgRevisionId":123,') == 123 and get_revision_id("<html>") is None
+
+    os.mkdir("pages")
+    titles = make_baidu_pages("pages", 10)
+    with LocalWikiServer("pages", latency=args.latency, prefix="/item/") as server:
+        config = load_config(server.base_url + "/")
+        with open("urls.txt", "w", encoding="utf-8") as f:
+            f.writelines(server.url_for(title) + "\n" for title in titles)
+
+        def recrawl(force):
+            requests = server.request_count
+            main.recrawl_web_content(config, "urls.txt", "delta.txt", state_file="recrawl.state", force=force)
+            return server.request_count - requests, [next(iter(r)) for r in iter_records("delta.txt")]
+
+        requests, extracted = recrawl(False)
+        assert requests == len(titles) and sorted(extracted) == titles, "first run: {}".format(extracted)
+        assert recrawl(False)[0] == 0, "urls that were not due were fetched"
+        assert recrawl(True) == (len(titles), []), "304 responses were extracted again"
+
+        def edit(title, old, new):
+            path = os.path.join("pages", title + ".html")
+            with open(path, encoding="utf-8") as f:
+                body = f.read()
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(body.replace(old, new))
+
+        edit(titles[0], "</body>", "<script>var requestId = 1;</script></body>")
+        edit(titles[1], "属性值1-0", "新的属性值")
+        assert recrawl(True) == (len(titles), [titles[1]]), "only the page whose content changed should be extracted"
+    state = RecrawlState("recrawl.state")
+    changes = [state.get(canonicalize(server.url_for(title))).changes for title in titles[:3]]
+    assert changes == [1, 2, 1], changes
+    state.close()
+
+
+def check_list_discovery(args):
+    """
+    main.get_web_list在模拟的英文lists of lists上：只从标题符合list命名的链接进入list页面，
+    被多个页面链接的list页面只抓取一次，max_depth为2时继续抓取子list页面，
+    单个页面失败只记为失败，不影响其他页面的结果
+    """
+    import main
+    from spider.crawl_state import FAILED, CrawlState
+    base = "https://en.wikipedia.org/wiki/"
+
+    def list_link(name):
+        return '<a href="/wiki/{0}" title="{1}">{1}</a>'.format(name, name.replace("_", " "))
+
+    def page(*links):
+        return '<html><body><div class="mw-parser-output">{}</div></body></html>'.format("".join(links))
+
+    pages = {
+        "Lists_of_weapons": page(list_link("List_of_rifles"), list_link("List_of_tanks"),
+                                 list_link("List_of_missing_pages"), list_link("Weapon")),
+        "List_of_rifles": page(list_link("M16_rifle"), list_link("AK-47"), list_link("List_of_carbines"),
+                               list_link("Help:Contents")),
+        "List_of_tanks": page(list_link("M1_Abrams"), list_link("AK-47"), list_link("List_of_carbines")),
+        "List_of_carbines": page(list_link("M4_carbine")),
+    }
+    fetched = []
+
+    def get_list_page(self, url):
+        fetched.append(url)
+        name = url[len(base):]
+        if name not in pages:
+            raise ValueError("failed to fetch list page: {}".format(url))
+        return pages[name]
+
+    def discover(max_depth):
+        del fetched[:]
+        main.get_web_list(load_config(), [base + "Lists_of_weapons"], "en", "links.txt", max_depth=max_depth)
+        with open("links.txt", encoding="utf-8") as f:
+            return sorted(line[len(base):] for line in f.read().split())
+
+    get_list_page_orig = main.WikiSpider.get_list_page
+    main.WikiSpider.get_list_page = get_list_page
+    try:
+        assert discover(1) == ["AK-47", "M16_rifle", "M1_Abrams"]
+        assert len(fetched) == len(set(fetched)) == 4, "fetched {}".format(fetched)
+        assert discover(2) == ["AK-47", "M16_rifle", "M1_Abrams", "M4_carbine"]
+        assert len(fetched) == len(set(fetched)) == 5, "fetched {}".format(fetched)
+        state = CrawlState("links.txt.state")
+        assert state.count(status=FAILED) == 1, "the missing list page was not recorded as failed"
+        state.close()
+    finally:
+        main.WikiSpider.get_list_page = get_list_page_orig
+
+
+def check_archive(args):
+    """
+    PageArchive导入data/wikiPages后每个网页按title、url与<归档文件>#<title>读出的内容与文件相同，非html文件跳过；
+    再次导入时内容没变的网页不重复写入，变化的网页追加新记录，流式读取只返回最新的记录；
+    .idx丢失时只读打开在内存中重建索引，.pack末尾不完整的记录被忽略
+    """
+    from spider.archive import PageArchive, close_archives, import_dir, read_local_page
+    os.mkdir("pages")
+    names = sorted(f for f in os.listdir(WIKI_PAGE_DIR) if f.endswith(".html"))
+    for name in names:
+        shutil.copy(os.path.join(WIKI_PAGE_DIR, name), "pages")
+    with open(os.path.join("pages", "results.json"), "w", encoding="utf-8") as f:
+        f.write("{}")
+    pages = {}
+    for name in names:
+        with open(os.path.join("pages", name), encoding="utf-8") as f:
+            pages[name[:-len(".html")]] = f.read()
+
+    path = os.path.join("archive", "pages.pack")
+    os.mkdir("archive")
+    with PageArchive(path) as archive:
+        assert import_dir(archive, "pages") == (len(pages), 0)
+        assert import_dir(archive, "pages") == (0, len(pages)), "unchanged pages were written again"
+        title = names[0][:-len(".html")]
+        pages[title] += "<!-- changed -->"
+        with open(os.path.join("pages", names[0]), "w", encoding="utf-8") as f:
+            f.write(pages[title])
+        assert import_dir(archive, "pages") == (1, len(pages) - 1)
+        assert len(archive) == len(pages) and "results" not in archive
+        assert all(archive.get(t) == text for t, text in pages.items()), "random reads differ from the files"
+        url = archive.conn.execute("SELECT url FROM records WHERE title = ?", (title,)).fetchone()[0]
+        assert url and archive.get(url) == pages[title], "a page could not be read by its url"
+        assert {t: text for t, _, text in archive} == pages, "the streaming read differs from the files"
+        stats = archive.stats()
+        assert stats["pages"] == len(pages) and stats["archive_size"] < stats["raw_size"]
+    assert read_local_page(path + "#" + title) == pages[title]
+    close_archives()
+
+    with open(path, "ab") as f:
+        f.write(b"WPK1\x00\x00")
+    os.remove(path + ".idx")
+    archive = PageArchive(path, readonly=True)
+    assert not os.path.exists(path + ".idx"), "a read-only open created an index file"
+    assert len(archive) == len(pages) and all(archive.get(t) == text for t, text in pages.items())
+    archive.close()
+
+
+def check_align_store(args):
+    """
+    AlignStore导入不同语言、不同写法的对齐链接与对齐内容后，同一个中文词条合并为一条记录，
+    按中文url的任意写法、其他语言的url或任意语言的词条名都能查到；重复导入不产生重复记录，关闭后重新打开数据不丢失
+    """
+    from spider.align_store import AlignStore
+    zh = "https://zh.wikipedia.org/wiki/M16%E7%AA%81%E5%87%BB%E6%AD%A5%E6%9E%AA"
+    ja = "https://ja.wikipedia.org/wiki/M16%E8%87%AA%E5%8B%95%E5%B0%8F%E9%8A%83"
+    ko = "https://ko.wikipedia.org/wiki/M16_%EC%86%8C%EC%B4%9D"
+    links = [
+        {"日本語": "https://ja.wikipedia.org/wiki/M16自動小銃", "中文": "https://zh.wikipedia.org/zh-cn/M16突击步枪"},
+        {"chinese": "https://zh.m.wikipedia.org/wiki/M16突击步枪#历史", "ko": "https://ko.wikipedia.org/wiki/M16 소총"},
+        {"日本語": "https://ja.wikipedia.org/wiki/小銃"},
+    ]
+    items = [
+        {"url": "https://zh.wikipedia.org/zh-cn/M16突击步枪", "chinese": {"M16突击步枪": {"口径": "5.56毫米"}},
+         "ja": {"M16自動小銃": {"口径": "5.56mm"}}, "ko": None},
+        {"url": "https://zh.wikipedia.org/zh-cn/坦克", "chinese": {"坦克": {}}, "ja": None},
+    ]
+    path = os.path.join("align", "align.db")
+    for _ in range(2):
+        with AlignStore(path, commit_every=2) as store:
+            assert store.import_links(links) == 2 and store.import_items(items) == 2
+    store = AlignStore(path)
+    assert store.stats() == {"links": {"ja": 1, "ko": 1}, "items": {"zh": {"total": 2, "with_content": 2},
+                                                                      "ja": {"total": 2, "with_content": 1},
+                                                                      "ko": {"total": 1, "with_content": 0}}}
+    record = store.get("https://zh.m.wikipedia.org/zh-cn/M16突击步枪")
+    assert record == {"url": zh, "links": {"ja": ja, "ko": ko}, "chinese": {"M16突击步枪": {"口径": "5.56毫米"}},
+                      "ja": {"M16自動小銃": {"口径": "5.56mm"}}, "ko": None}, record
+    assert store.find_by_url("https://ja.wikipedia.org/wiki/M16自動小銃") == record
+    assert store.find_by_url(ko) == record and store.find_by_url("https://ja.wikipedia.org/wiki/小銃") is None
+    assert store.find_by_title("M16自動小銃") == [record] and store.find_by_title("M16自動小銃", "ja") == [record]
+    assert store.find_by_title("M16自動小銃", "zh") == []
+    assert store.get("https://zh.wikipedia.org/wiki/坦克")["links"] == {}
+    store.close()
+
+
+CHECKS = {
+    "lazy_imports": check_lazy_imports,
+    "async_engine": check_async_engine,
+    "rate_limit": check_rate_limit,
+    "langlinks": check_langlinks,
+    "response_cache": check_response_cache,
+    "jsonl_output": check_jsonl_output,
+    "binary_output": check_binary_output,
+    "crawl_resume": check_crawl_resume,
+    "frontier": check_frontier,
+    "offline_extract": check_offline_extract,
+    "langlinks_batches": check_langlinks_batches,
+    "multi_align": check_multi_align,
+    "metrics": check_metrics,
+    "normalize": check_normalize,
+    "work_queue": check_work_queue,
+    "canonical": check_canonical,
+    "entity_names": check_entity_names,
+    "recrawl": check_recrawl,
+    "list_discovery": check_list_discovery,
+    "archive": check_archive,
+    "align_store": check_align_store,
+}
+
+
+BENCHMARKS = {
+    "parse_wiki_page": bench_parse_wiki_page,
+    "parse_wiki_corpus": bench_parse_wiki_corpus,
+    "strip_info_value": bench_strip_info_value,
+    "parse_baidu_page": bench_parse_baidu_page,
+    "job_get_web_content_json": bench_job_get_web_content_json,
+    "job_get_extra_links": bench_job_get_extra_links,
+    "cli_startup": bench_cli_startup,
+    "spider_import": bench_spider_import,
+}
+
+
+def run_worker(name, args):
+    """
+    在子进程中运行一个benchmark的所有轮次，结果以json输出到stdout
+    """
+    sys.path.insert(0, ROOT)
+    if name in CHECKS:
+        CHECKS[name](args)
+        return
+    rounds = []
+    latencies = []
+    for _ in range(args.rounds):
+        r = BENCHMARKS[name](args)
+        rounds.append(r)
+        latencies.extend(r.pop("latencies", []))
+    seconds = statistics.median(r["seconds"] for r in rounds)
+    items = rounds[0]["items"]
+    result = {
+        "items": items,
+        "seconds": seconds,
+        "pages_per_sec": items / seconds if seconds > 0 else None,
+        "p50_ms": None if not latencies else percentile(latencies, 50) * 1000,
+        "p95_ms": None if not latencies else percentile(latencies, 95) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    for key in ("errors", "requests"):
+        if key in rounds[0]:
+            result[key] = rounds[0][key]
+    sys.stdout.write("\n" + json.dumps(result) + "\n")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_checks(names, args) -> bool:
+    """
+    每个检查在各自的临时目录中的单独子进程中运行，不受其他检查留下的文件影响
+    :return: 是否全部通过
+    """
+    passed = True
+    for name in names:
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", name, "--latency", str(args.latency)]
+        with tempfile.TemporaryDirectory() as work_dir:
+            p = subprocess.run(cmd, cwd=work_dir, capture_output=True, text=True)
+        if p.returncode == 0:
+            print("{:<28}ok".format(name))
+        else:
+            passed = False
+            print("{:<28}FAILED\n{}".format(name, p.stderr), file=sys.stderr)
+    return passed
+
+
+def compare(old: dict, new: dict, threshold: float) -> bool:
+    """
+    打印两次结果的对比
+    :return: 是否有指标退化超过threshold
+    """
+    regressed = False
+    print("{:<28}{:<14}{:>12}{:>12}{:>9}".format("benchmark", "metric", "old", "new", "change"))
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        for metric, higher_is_better in _higher_is_better.items():
+            a, b = old["results"][name].get(metric), result.get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            bad = change < -threshold if higher_is_better else change > threshold
+            regressed = regressed or bad
+            print("{:<28}{:<14}{:>12.2f}{:>12.2f}{:>+8.1%}{}".format(name, metric, a, b, change,
+                                                                     "  REGRESSION" if bad else ""))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wiki_spider benchmark")
+    parser.add_argument("names", nargs="*", help="要运行的benchmark，默认全部：" + ", ".join(BENCHMARKS))
+    parser.add_argument("--check", action="store_true", help="运行检查而不是benchmark，names为检查名，默认全部："
+                                                             + ", ".join(CHECKS))
+    parser.add_argument("--rounds", type=int, default=3, help="每个benchmark运行的轮数，结果取中位数")
+    parser.add_argument("--latency", type=float, default=0.02, help="本地模拟服务器每个请求的延迟（秒）")
+    parser.add_argument("--baidu-pages", type=int, default=300, help="生成的百科网页数")
+    parser.add_argument("--output", help="结果文件，默认为data/benchmarks/<commit>.json")
+    parser.add_argument("--compare", help="与该结果文件比较")
+    parser.add_argument("--threshold", type=float, default=0.1, help="视为退化的变化比例")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args)
+        return 0
+
+    if args.check:
+        names = args.names or list(CHECKS)
+        for name in names:
+            if name not in CHECKS:
+                parser.error("unknown check: {}".format(name))
+        return 0 if run_checks(names, args) else 1
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: {}".format(name))
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "params": {"rounds": args.rounds, "latency": args.latency, "baidu_pages": args.baidu_pages},
+        "results": {},
+    }
+    failed = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names:
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker", name, "--rounds", str(args.rounds),
+                   "--latency", str(args.latency), "--baidu-pages", str(args.baidu_pages)]
+            # 在临时目录中运行，spider.log等文件不会写到仓库中
+            p = subprocess.run(cmd, cwd=work_dir, capture_output=True, text=True)
+            if p.returncode != 0:
+                print("{} failed:\n{}".format(name, p.stderr), file=sys.stderr)
+                failed.append(name)
+                continue
+            result = json.loads(p.stdout.strip().splitlines()[-1])
+            report["results"][name] = result
+            print("{:<28}{:>10.1f} pages/s  p95 {:>8} ms  rss {:>8} MB".format(
+                name, result["pages_per_sec"] or 0,
+                "-" if result["p95_ms"] is None else "{:.3f}".format(result["p95_ms"]),
+                "-" if result["peak_rss_mb"] is None else "{:.1f}".format(result["peak_rss_mb"])))
+
+    output = args.output or os.path.join(RESULT_DIR, commit + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("results written to {}".format(output))
+    if failed:
+        print("failed benchmarks: {}".format(", ".join(failed)), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print("compare with {} ({})".format(old.get("commit"), args.compare))
+        if compare(old, report, args.threshold):
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""
+命令行入口，每个任务一个子命令：
+
+    python cli.py content data/baidu_baike_urls_extra.txt data/baidu_baike_data_with_summary_extra.txt
+    python cli.py expand-links data/baidu_baike_urls.txt data/baidu_baike_urls_extra.txt --resume
+    python cli.py recrawl data/baidu_baike_urls_extra.txt data/baidu_baike_delta.txt
+    python cli.py list-discovery ja data/ja_wiki_urls.txt
+    python cli.py align links data/ja_wiki_urls.txt --src 日本語 --tgt 中文 --api
+    python cli.py align import --links data/日本語-中文-align-urls.txt --items data/zh-ja-item-simplified.txt
+    python cli.py align query --title 紀元前142年
+    python cli.py pictures data/eid_url.txt
+    python cli.py offline-extract
+    python cli.py archive import data/wikiPages -o data/wikiPages.pack
+    python cli.py offline-extract --archive data/wikiPages.pack
+    python cli.py entity mq-9
+    python cli.py normalize data/繁体/zh-jp-item.txt data/zh-jp-item.txt --fields chinese
+    python cli.py queue add data/queue.db data/baidu_baike_urls_extra.txt
+    python cli.py queue work data/queue.db content data/shards
+    python cli.py queue merge data/queue.db data/shards data/baidu_baike_data_with_summary_extra.txt
+
+本模块只导入标准库，main.py与spider中较重的依赖在子命令真正运行时才导入，
+因此--help与简单的子命令启动很快
+"""
+import argparse
+import configparser
+import sys
+
+
+def cmd_content(config, args):
+    import main
+    main.get_web_content_json(config, args.language, args.url_list_file, args.output_file,
+                              is_from_file=args.from_file, use_async=args.use_async,
+                              parse_processes=args.parse_processes)
+
+
+def cmd_recrawl(config, args):
+    import main
+    main.recrawl_web_content(config, args.url_list_file, args.delta_file, language=args.wiki,
+                             state_file=args.state_file, force=args.force)
+
+
+def cmd_expand_links(config, args):
+    import main
+    main.get_extra_links(config, args.url_list_file, args.output_file, max_iter_times=args.max_iter,
+                         is_from_file=args.from_file, use_async=args.use_async, state_file=args.state_file,
+                         resume=args.resume)
+
+
+def cmd_list_discovery(config, args):
+    import main
+    if args.urls_file is not None:
+        from spider.output import iter_lines
+        list_of_list_urls = list(iter_lines(args.urls_file))
+    else:
+        list_of_list_urls = {
+            "en": main.military_list_of_lists_url_list_en,
+            "ja": main.military_list_of_lists_url_list_jp,
+        }[args.language]
+    main.get_web_list(config, list_of_list_urls, args.language, args.output_file, state_file=args.state_file,
+                      resume=args.resume, max_depth=args.max_depth)
+
+
+def open_align_store(config):
+    from spider.align_store import AlignStore
+    return AlignStore.from_config(config)
+
+
+def close_align_store(store):
+    if store is not None:
+        store.close()
+
+
+def cmd_align_links(config, args):
+    from spider.canonical import CanonicalIndex
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(config, args.language)
+    index = CanonicalIndex.from_config(config)
+    store = open_align_store(config)
+    s.align_language(args.urls_file, args.src, args.tgt, use_async=args.use_async, use_api=args.api, index=index,
+                     store=store)
+    index.close()
+    close_align_store(store)
+
+
+def cmd_align_chinese(config, args):
+    from spider.canonical import CanonicalIndex
+    from spider.wikipedia_spider import WikiSpider
+    s = WikiSpider(config, "zh")
+    index = CanonicalIndex.from_config(config)
+    store = open_align_store(config)
+    s.align_chinese(args.title_file, use_async=args.use_async, use_api=args.api, index=index, store=store)
+    index.close()
+    close_align_store(store)
+
+
+def cmd_align_items(config, args):
+    import main
+    store = open_align_store(config)
+    main.get_align_item(config, args.align_url_file, parse_processes=args.parse_processes,
+                        output_file=args.output_file, store=store)
+    close_align_store(store)
+
+
+def cmd_align_multi(config, args):
+    import main
+    store = open_align_store(config)
+    main.get_multi_align_item(config, tuple(args.langs), output_file=args.output_file,
+                              parse_processes=args.parse_processes, store=store)
+    close_align_store(store)
+
+
+def cmd_align_import(config, args):
+    from spider.align_store import AlignStore
+    from spider.output import iter_records
+    with AlignStore(args.store or config.get("ALIGN", "store_file", fallback="data/align.db")) as store:
+        for file_name in args.link_files or []:
+            print("{}: {} links".format(file_name, store.import_links(iter_records(file_name))))
+        for file_name in args.item_files or []:
+            print("{}: {} items".format(file_name, store.import_items(iter_records(file_name))))
+        print(store.stats())
+
+
+def cmd_align_query(config, args):
+    import json
+    from spider.align_store import AlignStore
+    with AlignStore(args.store or config.get("ALIGN", "store_file", fallback="data/align.db")) as store:
+        if args.title is not None:
+            records = store.find_by_title(args.title, args.lang)
+        else:
+            record = store.find_by_url(args.url)
+            records = [] if record is None else [record]
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False))
+
+
+def cmd_pictures(config, args):
+    import main
+    main.get_pic(config, args.url_file, parse_processes=args.parse_processes, output_file=args.output_file)
+
+
+def cmd_offline_extract(config, args):
+    import main
+    main.offline_extract(config, language=args.language, output_file=args.output_file,
+                         manifest_file=args.manifest, processes=args.processes, archive_file=args.archive)
+
+
+def cmd_archive_import(config, args):
+    from spider.archive import PageArchive, import_dir
+    with PageArchive.from_config(config, args.output) as archive:
+        for directory in args.dirs:
+            added, skipped = import_dir(archive, directory)
+            print("{}: {} files added, {} unchanged".format(directory, added, skipped))
+        print(archive.stats())
+
+
+def cmd_archive_list(config, args):
+    from spider.archive import PageArchive
+    with PageArchive.from_config(config, args.archive, readonly=True) as archive, \
+            open(args.output_file, "w", encoding="utf-8") as f:
+        for locator in archive.locators():
+            f.write(locator + "\n")
+
+
+def cmd_archive_get(config, args):
+    from spider.archive import PageArchive
+    with PageArchive.from_config(config, args.archive, readonly=True) as archive:
+        text = archive.get(args.key)
+    if text is None:
+        print("not found: {}".format(args.key), file=sys.stderr)
+        return
+    sys.stdout.write(text)
+
+
+def cmd_archive_stats(config, args):
+    from spider.archive import PageArchive
+    with PageArchive.from_config(config, args.archive, readonly=not args.rebuild_index) as archive:
+        if args.rebuild_index:
+            archive.rebuild_index()
+        print(archive.stats())
+
+
+def cmd_entity(config, args):
+    from spider.baidu_spider import BaiduSpider
+    from spider.output import iter_lines
+    s = BaiduSpider(config)
+    keywords = list(args.keywords)
+    if args.file is not None:
+        keywords.extend(iter_lines(args.file))
+    for keyword, name in s.check_entity_names(keywords).items():
+        print("{}\t{}".format(keyword, name))
+    s.entity_names.close()
+
+
+def cmd_normalize(config, args):
+    from spider.normalize import Normalizer
+    from spider.output import iter_records, open_writer
+    normalizer = Normalizer(to_simplified=True)
+    with open_writer(args.output_file) as writer:
+        for record in iter_records(args.input_file):
+            if args.fields:
+                # 对齐结果中只转换中文列，日语等其他语言的汉字不能做繁简转换
+                record = {k: normalizer.normalize_record(v) if k in args.fields else v for k, v in record.items()}
+            else:
+                record = normalizer.normalize_record(record)
+            writer.write(record)
+
+
+def cmd_select(config, args):
+    from spider.output import iter_records, open_writer
+    # Parquet输入只读取这些字段所在的列
+    with open_writer(args.output_file) as writer:
+        for record in iter_records(args.input_file, fields=args.fields):
+            writer.write(record)
+
+
+def cmd_queue_add(config, args):
+    from spider.canonical import canonicalize
+    from spider.output import iter_lines
+    from spider.workqueue import open_work_queue
+    queue = open_work_queue(args.queue)
+    # 同一个网页的不同写法在队列中只有一条
+    print("{} urls added".format(queue.add(canonicalize(url) for url in iter_lines(args.url_list_file))))
+    queue.close()
+
+
+def cmd_queue_serve(config, args):
+    from spider.workqueue import SqliteWorkQueue, WorkQueueServer
+    queue = SqliteWorkQueue(args.queue_file, config.getint("QUEUE", "max_attempts", fallback=3))
+    server = WorkQueueServer(queue, args.host, args.port)
+    print("work queue: {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        queue.close()
+
+
+def cmd_queue_work(config, args):
+    import main
+    main.run_queue_worker(config, args.queue, args.job, args.shard_dir, worker_id=args.worker_id, shard=args.shard,
+                          language=args.language, lang_src=args.src, lang_tgt=args.tgt, max_iter_times=args.max_iter)
+
+
+def cmd_queue_merge(config, args):
+    import main
+    print("{} records merged".format(main.merge_queue_output(args.queue, args.shard_dir, args.output_file,
+                                                             url_list=args.url_list)))
+
+
+def cmd_queue_stats(config, args):
+    from spider.workqueue import open_work_queue
+    queue = open_work_queue(args.queue)
+    for status, count in sorted(queue.counts().items()):
+        print("{}\t{}".format(status, count))
+    queue.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="wiki_spider")
+    parser.add_argument("-c", "--config", default="config.ini", help="配置文件，默认为config.ini")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    def add_fetch_options(p, from_file=True):
+        if from_file:
+            p.add_argument("--from-file", action="store_true",
+                           help="输入中是本地网页文件路径或<归档文件>#<title>，而不是url")
+        p.add_argument("--async", dest="use_async", action="store_true", help="使用asyncio引擎代替线程池")
+
+    def add_parse_processes(p):
+        p.add_argument("--parse-processes", type=int, default=0, metavar="N",
+                       help="大于0时，抓取线程只负责下载，网页交给N个进程解析")
+
+    p = subparsers.add_parser("content", help="抓取百科词条的属性、摘要与图片")
+    p.add_argument("url_list_file", help="每行一个url")
+    p.add_argument("output_file", help="扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines")
+    p.add_argument("--language", default="zh")
+    add_fetch_options(p)
+    add_parse_processes(p)
+    p.set_defaults(func=cmd_content)
+
+    p = subparsers.add_parser("recrawl", help="刷新已爬的词条，只提取有变化的网页")
+    p.add_argument("url_list_file", help="每行一个url")
+    p.add_argument("delta_file", help="第一次抓取或内容变化的词条写入该文件，扩展名为.parquet或.msgpack时以对应格式输出")
+    p.add_argument("--wiki", metavar="LANGUAGE", help="刷新该语言的Wikipedia词条，默认为百度百科")
+    p.add_argument("--state-file", help="保存每个url抓取记录的sqlite文件，默认为[RECRAWL]中的state_file")
+    p.add_argument("--force", action="store_true", help="忽略重访时间，检查所有url")
+    p.set_defaults(func=cmd_recrawl)
+
+    p = subparsers.add_parser("expand-links", help="沿百科属性表格中的超链接逐层扩展url")
+    p.add_argument("url_list_file", help="初始url，每行一个")
+    p.add_argument("output_file", help="所有url写入该文件")
+    p.add_argument("--max-iter", type=int, default=30, help="最多扩展的层数")
+    p.add_argument("--state-file", help="保存爬取状态的sqlite文件，默认为output_file.state")
+    p.add_argument("--resume", action="store_true", help="从上次中断的状态继续")
+    add_fetch_options(p)
+    p.set_defaults(func=cmd_expand_links)
+
+    p = subparsers.add_parser("list-discovery", help="从Wikipedia的lists of lists页面获取所有词条链接")
+    p.add_argument("language", choices=("en", "ja"))
+    p.add_argument("output_file")
+    p.add_argument("--urls-file", help="lists of lists页面的url，每行一个，默认使用main.py中的军事类列表")
+    p.add_argument("--max-depth", type=int, default=1,
+                   help="list页面的最大层数，大于1时继续抓取list页面中的子list页面")
+    p.add_argument("--state-file", help="保存爬取状态的sqlite文件，默认为output_file.state")
+    p.add_argument("--resume", action="store_true", help="从上次中断的状态继续")
+    p.set_defaults(func=cmd_list_discovery)
+
+    p = subparsers.add_parser("align", help="跨语言对齐")
+    align = p.add_subparsers(dest="align_command", metavar="mode")
+    align.required = True
+    q = align.add_parser("links", help="获取词条在另一种语言中的链接")
+    q.add_argument("urls_file", help="每行一个词条url")
+    q.add_argument("--src", required=True, help="词条所在语言在p-lang中的名称，如日本語")
+    q.add_argument("--tgt", required=True, help="目标语言在p-lang中的名称，如中文")
+    q.add_argument("--language", default="en", help="用于下载网页的WikiSpider的语言")
+    q.add_argument("--api", action="store_true", help="通过MediaWiki api批量查询，不下载词条网页")
+    add_fetch_options(q, from_file=False)
+    q.set_defaults(func=cmd_align_links)
+    q = align.add_parser("chinese", help="获取中文词条的韩语、俄语链接")
+    q.add_argument("title_file", help="每行一个中文词条名")
+    q.add_argument("--api", action="store_true", help="通过MediaWiki api批量查询，不下载词条网页")
+    add_fetch_options(q, from_file=False)
+    q.set_defaults(func=cmd_align_chinese)
+    q = align.add_parser("items", help="抓取对齐的中日词条内容")
+    q.add_argument("align_url_file")
+    q.add_argument("-o", "--output-file", default="data/zh-ja-item-simplified.txt")
+    add_parse_processes(q)
+    q.set_defaults(func=cmd_align_items)
+    q = align.add_parser("multi", help="一次抓取中文与多种语言对齐的词条内容")
+    q.add_argument("--langs", nargs="+", default=["ja", "ko", "ru"], choices=("ja", "ko", "ru"))
+    q.add_argument("-o", "--output-file", default="data/zh-multi-item-simplified.txt")
+    add_parse_processes(q)
+    q.set_defaults(func=cmd_align_multi)
+    store_help = "对齐结果的sqlite文件，默认为config.ini中[ALIGN]的store_file"
+    q = align.add_parser("import", help="把已有的对齐链接与对齐内容文件导入对齐结果库")
+    q.add_argument("--links", dest="link_files", nargs="+", help="如data/日本語-中文-align-urls.txt")
+    q.add_argument("--items", dest="item_files", nargs="+", help="如data/zh-ja-item-simplified.txt")
+    q.add_argument("--store", help=store_help)
+    q.set_defaults(func=cmd_align_import)
+    q = align.add_parser("query", help="按词条名或url查询对齐结果")
+    g = q.add_mutually_exclusive_group(required=True)
+    g.add_argument("--title", help="任意语言的词条名")
+    g.add_argument("--url", help="中文或其他语言的词条url")
+    q.add_argument("--lang", help="词条名所在的语言，如zh、ja，默认不限")
+    q.add_argument("--store", help=store_help)
+    q.set_defaults(func=cmd_align_query)
+
+    p = subparsers.add_parser("pictures", help="获取实体对应百科词条的图片")
+    p.add_argument("url_file")
+    p.add_argument("-o", "--output-file", default="data/eid_url_with_pic.txt")
+    add_parse_processes(p)
+    p.set_defaults(func=cmd_pictures)
+
+    p = subparsers.add_parser("offline-extract", help="增量提取data/wikiPages中的网页")
+    p.add_argument("-o", "--output-file", default="data/wiki_page_url_tmp.json")
+    p.add_argument("--language", default="zh")
+    p.add_argument("--manifest", help="记录提取状态的sqlite文件，默认为output_file.manifest")
+    p.add_argument("--processes", type=int, help="解析进程数，默认为cpu核数")
+    p.add_argument("--archive", help="提取该归档中的网页，而不是data/wikiPages中的文件")
+    p.set_defaults(func=cmd_offline_extract)
+
+    p = subparsers.add_parser("archive", help="把本地网页打包为带索引的压缩归档")
+    archive = p.add_subparsers(dest="archive_command", metavar="action")
+    archive.required = True
+    archive_help = "归档文件，默认为config.ini中[ARCHIVE]的file"
+    q = archive.add_parser("import", help="导入目录中的网页文件，文件名作为title，内容没变的文件跳过")
+    q.add_argument("dirs", nargs="+", help="网页文件所在的目录，如data/wikiPages，只导入.html文件")
+    q.add_argument("-o", "--output", help=archive_help)
+    q.set_defaults(func=cmd_archive_import)
+    q = archive.add_parser("list", help="输出归档中所有网页的<归档文件>#<title>，可作为--from-file的输入")
+    q.add_argument("output_file")
+    q.add_argument("--archive", help=archive_help)
+    q.set_defaults(func=cmd_archive_list)
+    q = archive.add_parser("get", help="按title或url输出一个网页")
+    q.add_argument("key")
+    q.add_argument("--archive", help=archive_help)
+    q.set_defaults(func=cmd_archive_get)
+    q = archive.add_parser("stats", help="网页数、原始大小与归档大小")
+    q.add_argument("--archive", help=archive_help)
+    q.add_argument("--rebuild-index", action="store_true", help="扫描归档重建索引")
+    q.set_defaults(func=cmd_archive_stats)
+
+    p = subparsers.add_parser("entity", help="查询关键词在百度百科中的词条名")
+    p.add_argument("keywords", nargs="*")
+    p.add_argument("-f", "--file", help="每行一个关键词")
+    p.set_defaults(func=cmd_entity)
+
+    p = subparsers.add_parser("normalize", help="把已有结果中的繁体中文转换为简体并去掉引用标记")
+    p.add_argument("input_file")
+    p.add_argument("output_file", help="扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines")
+    p.add_argument("--fields", nargs="+", help="只转换记录中的这些字段，如对齐结果中的chinese，默认转换所有字段")
+    p.set_defaults(func=cmd_normalize)
+
+    p = subparsers.add_parser("select", help="只保留已有结果中实体记录的部分字段，Parquet输入只读取需要的列")
+    p.add_argument("input_file")
+    p.add_argument("output_file", help="扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines")
+    p.add_argument("fields", nargs="+", help="infobox的属性名或paragraph_text、summary、imgs")
+    p.set_defaults(func=cmd_select)
+
+    p = subparsers.add_parser("queue", help="多进程、多机器共享url队列的分布式爬取")
+    queue = p.add_subparsers(dest="queue_command", metavar="action")
+    queue.required = True
+    queue_help = "sqlite队列文件，或queue serve提供的地址http://host:port"
+    q = queue.add_parser("add", help="把url加入队列，已有的url被忽略")
+    q.add_argument("queue", help=queue_help)
+    q.add_argument("url_list_file", help="每行一个url")
+    q.set_defaults(func=cmd_queue_add)
+    q = queue.add_parser("serve", help="通过http提供sqlite队列，供其他机器上的worker使用")
+    q.add_argument("queue_file")
+    q.add_argument("--host", default="127.0.0.1", help="接口没有鉴权，需要其他机器访问时才改为0.0.0.0等地址")
+    q.add_argument("--port", type=int, default=8765)
+    q.set_defaults(func=cmd_queue_serve)
+    q = queue.add_parser("work", help="从队列中租用url并处理，可同时运行多个")
+    q.add_argument("queue", help=queue_help)
+    q.add_argument("job", choices=("content", "expand-links", "align"))
+    q.add_argument("shard_dir", help="每个worker的结果写入该目录下的<worker_id>.jsonl")
+    q.add_argument("--worker-id", help="默认为主机名-进程号")
+    q.add_argument("--shard", help="只处理该host的url")
+    q.add_argument("--max-iter", type=int, default=30, help="expand-links任务最多扩展的层数")
+    q.add_argument("--language", default="en", help="align任务中用于下载网页的WikiSpider的语言")
+    q.add_argument("--src", help="align任务中词条所在语言在p-lang中的名称，如日本語")
+    q.add_argument("--tgt", help="align任务中目标语言在p-lang中的名称，如中文")
+    q.set_defaults(func=cmd_queue_work)
+    q = queue.add_parser("merge", help="合并各worker的结果，每个url只保留一份")
+    q.add_argument("queue", help=queue_help)
+    q.add_argument("shard_dir")
+    q.add_argument("output_file", help="扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines")
+    q.add_argument("--url-list", action="store_true", help="输出所有url与链接，每行一个，用于expand-links任务")
+    q.set_defaults(func=cmd_queue_merge)
+    q = queue.add_parser("stats", help="按状态统计队列中的url数")
+    q.add_argument("queue", help=queue_help)
+    q.set_defaults(func=cmd_queue_stats)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    # 一些配置信息写在了config.ini中，主要是爬Wikipedia时用到的proxy信息
+    config = configparser.ConfigParser()
+    if not config.read(args.config, encoding="utf-8"):
+        print("config file not found: {}".format(args.config), file=sys.stderr)
+        return 1
+
+    from spider.metrics import MetricsReporter
+    # 各阶段的统计定期写入[METRICS]中的dump_file
+    with MetricsReporter.from_config(config):
+        args.func(config, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,22 @@
-import concurrent.futures
-import configparser
 import json
 import logging
+import time
 import traceback
-from typing import List
+from functools import partial
+from typing import Dict, List, Tuple
 
+from spider.align_store import AlignStore
+from spider.archive import close_archives, open_archive
 from spider.baidu_spider import BaiduSpider
+from spider.canonical import CanonicalIndex, canonicalize
+from spider.crawl_state import CrawlState, DONE
+from spider.frontier import Frontier
+from spider.executor import imap_unordered
+from spider.offline import OfflineExtractor
+from spider.output import iter_lines, iter_records, open_writer
+from spider.pipeline import FetchParsePipeline, config_to_dict, get_worker_spider, init_worker
+from spider.recrawl import CHANGED, NOT_MODIFIED, UNCHANGED, RecrawlState, content_hash, get_revision_id
+from spider.session import get_pool_size
 from spider.wikipedia_spider import WikiSpider
 from util import generate_wiki_file_list
 
@@ -56,62 +67,123 @@ def get_web_content_wrapper(wiki_spider: WikiSpider, url: str, loggers: logging.
         return None
 
 
-def get_extra_links_wrapper(wiki_spider: BaiduSpider, url: str, loggers: logging.Logger, is_from_file=False):
+def get_extra_links_wrapper(wiki_spider: BaiduSpider, url: str, loggers: logging.Logger, is_from_file=False,
+                            index: CanonicalIndex = None):
     try:
-        return wiki_spider.get_extra_links(url, is_from_file)
+        body = wiki_spider.get_web_body_text(url, is_from_file)
+        if index is not None and not index.learn(url, body):
+            # 重定向到已经爬过的词条，链接已经在目标词条中获取
+            return []
+        return wiki_spider.get_extra_links_from_body(body)
     except Exception as e:
         loggers.warning("failed to get extra links: {}".format(url))
         return None
 
 
-def get_extra_links(configure, url_list_file, output_file, max_iter_times=30, is_from_file=False):
+def crawl_extra_links(configure, s: BaiduSpider, urls, handle, loggers: logging.Logger, is_from_file=False,
+                      use_async=False, index: CanonicalIndex = None):
+    """
+    获取urls中每个页面的属性表格超链接，每完成一个页面调用一次handle(url, links)，失败时links为None
+    :param use_async: 是否使用asyncio引擎代替线程池
+    :param index: 从网页中学习重定向，重定向到已爬过词条的页面不再提取
+    """
+    if use_async and not is_from_file:
+        # asyncio引擎只回调成功的页面，失败的页面由调用方按未完成处理
+        s.async_fetcher.fetch_all(
+            urls, lambda url, body: s.get_extra_links_from_body(body) if index is None or index.learn(url, body) else [],
+            handle)
+        return
+    for url, r in imap_unordered(lambda url: (url, get_extra_links_wrapper(s, url, loggers, is_from_file, index)), urls,
+                                 get_pool_size(configure)):
+        handle(url, r)
+
+
+def get_extra_links(configure, url_list_file, output_file, max_iter_times=30, is_from_file=False, use_async=False,
+                    state_file=None, resume=False):
+    """
+    从url_list_file中的百科页面出发，沿属性表格中的超链接逐层扩展，得到的所有url写入output_file
+    :param max_iter_times: 最多扩展的层数
+    :param state_file: 保存爬取状态的sqlite文件，默认为output_file + '.state'
+    :param resume: 是否从state_file中记录的状态继续上次中断的爬取
+    """
     logging.basicConfig(filename='spider.log', format="%(asctime)s  %(filename)s : %(levelname)s  %(message)s",
                         datefmt='%Y-%m-%d: %H:%M:%S',
                         level=logging.DEBUG)
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
-    url_list = set()
     s = BaiduSpider(configure)
-    with open(url_list_file, "r", encoding='utf-8') as f:
-        for line in f:
-            url_list.add(line[:-1])
+    index = CanonicalIndex.from_config(configure)
+    state = CrawlState(state_file or output_file + ".state")
+    frontier = Frontier(state, index)
+    if not resume:
+        state.reset()
+        frontier.seed(iter_lines(url_list_file))
+    else:
+        state.retry_failed()
+        frontier.restore()
+        logger.info("resume from level {}, {} urls done".format(state.current_level(), state.count(status=DONE)))
 
     logger.info("spider start")
-    new_links = set()
-    new_new_links = set()
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(get_extra_links_wrapper, s, url, logger, is_from_file) for url in url_list]
 
-        for future in concurrent.futures.as_completed(futures):
-            r = future.result()
-            if r is not None:
-                extra_links_set = set(r)
-                new_links |= extra_links_set - set(url_list)
-                url_list |= new_links
-
-    for i in range(max_iter_times):
-        print("iter: {}".format(i))
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(get_extra_links_wrapper, s, url, logger, is_from_file) for url in new_links]
-            for future in concurrent.futures.as_completed(futures):
-                r = future.result()
-                if r is not None:
-                    extra_links_set = set(r)
-                    new_new_links |= extra_links_set - set(new_links)
+    def handle(url, r):
+        if r is None:
+            frontier.fail(url, "failed to get extra links")
+        else:
+            frontier.complete(url, r)
 
-                    if len(new_new_links) == 0:
-                        break
-                    url_list |= new_new_links
-        print("new links: {}".format(len(new_new_links)))
-        new_links = new_new_links
+    # 每个url只会被爬取一次，某一层没有产生新链接时自然结束
+    level, urls = frontier.pop_level(max_iter_times)
+    while urls:
+        print("iter: {}".format(level))
+        crawl_extra_links(configure, s, urls, handle, logger, is_from_file, use_async, index)
+        state.fail_pending(level)
+        print("new links: {}".format(frontier.count(level + 1)))
 
         with open(output_file, "w", encoding="utf-8") as f:
-            for url in url_list:
+            for url in frontier:
                 f.write(url + "\n")
+        level, urls = frontier.pop_level(max_iter_times)
+    state.close()
+    logger.info(index.report())
+    print(index.report())
+    index.close()
+
+
+def get_unique_body_text(s, index: CanonicalIndex, url: str, is_from_file=False):
+    """
+    下载网页，网页是本次已经处理过的词条的重定向时返回None
+    """
+    body = s.get_web_body_text(url, is_from_file)
+    if is_from_file or index.learn(url, body):
+        return body
+    return None
+
+
+def get_unique_web_content_wrapper(s, index: CanonicalIndex, url: str, loggers: logging.Logger, is_from_file=False):
+    try:
+        body = s.get_web_body_text(url, is_from_file)
+        if body is None:
+            return {}
+        if not is_from_file and not index.learn(url, body):
+            return None
+        return s.process_body(body)
+    except Exception as e:
+        loggers.warning("failed to get content: {}, err:{}".format(url, e))
+        traceback.print_exc()
+        return None
+
 
+def parse_web_content(body: str):
+    return get_worker_spider('content').extract_body(body)
 
-def get_web_content_json(configure, language, url_list_file, output_file, is_from_file=False):
+
+def get_web_content_json(configure, language, url_list_file, output_file, is_from_file=False, use_async=False,
+                         parse_processes=0):
+    """
+    :param output_file: 扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    :param use_async: 是否使用asyncio引擎代替线程池
+    :param parse_processes: 大于0时，抓取线程只负责下载，网页交给该数量的进程解析
+    """
     logging.basicConfig(filename='spider.log', format="%(asctime)s  %(filename)s : %(levelname)s  %(message)s",
                         datefmt='%Y-%m-%d: %H:%M:%S',
                         level=logging.DEBUG)
@@ -119,63 +191,189 @@ def get_web_content_json(configure, language, url_list_file, output_file, is_fro
     logger.setLevel(logging.DEBUG)
     # s = WikiSpider(configure, language)
     s = BaiduSpider(configure)
-    url_list = []
-    with open(url_list_file, "r", encoding='utf-8') as f:
-        for line in f:
-            url_list.append(line[:-1])
+    # 输入中同一个词条的不同写法与重定向只抓取一次
+    index = CanonicalIndex.from_config(configure)
+    urls = iter_lines(url_list_file) if is_from_file else index.unique(iter_lines(url_list_file))
 
-    result_list = []
     logger.info("spider start")
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(get_web_content_wrapper, s, url, logger, is_from_file) for url in url_list]
-        for future in concurrent.futures.as_completed(futures):
-            r = future.result()
+    logger.info("writing result to file: {}".format(output_file))
+    with open_writer(output_file) as writer:
+        def write(url, r):
             if r is not None:
-                result_list.append(r)
+                writer.write(r)
+
+        if use_async and not is_from_file:
+            s.async_fetcher.fetch_all(urls, lambda url, body: s.process_body(body) if index.learn(url, body) else None,
+                                      write)
+        elif parse_processes > 0:
+            pipeline = FetchParsePipeline(partial(get_unique_body_text, s, index, is_from_file=is_from_file),
+                                          parse_web_content, get_pool_size(configure), parse_processes, init_worker,
+                                          (config_to_dict(configure), {'content': (BaiduSpider, ())}))
+            # 解析进程只解析网页，图片页面的请求在本进程中作为单独的一级并发完成
+            parsed = (r for url, r in pipeline.run(urls) if r is not None)
+            for r in imap_unordered(s.resolve_images, parsed, get_pool_size(configure)):
+                if r is not None:
+                    writer.write(r)
+        else:
+            for r in imap_unordered(partial(get_unique_web_content_wrapper, s, index, loggers=logger,
+                                            is_from_file=is_from_file),
+                                    urls, get_pool_size(configure)):
+                if r is not None:
+                    writer.write(r)
     logger.info("spider finished")
-    logger.info("writing result to file: {}".format(output_file))
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for result in result_list:
-            j = json.dumps(result, ensure_ascii=False)
-            f.write(j + '\n')
-    logger.info("writing finished")
-    logger.info("{} line writen".format(len(result_list)))
+    logger.info("{} line writen".format(writer.count))
+    logger.info(index.report())
+    print(index.report())
+    index.close()
+
+
+def check_page(s, state: RecrawlState, url: str):
+    """
+    带ETag/Last-Modified重新请求网页，只有内容hash或Wikipedia版本号变化时才重新提取
+    :return: (结果, record, 记录到state中的字段)，结果为CHANGED、UNCHANGED或NOT_MODIFIED，失败时为None
+    """
+    meta = state.get(url)
+    r = s.session.get(url, headers=meta.conditional_headers() if meta is not None else None)
+    fields = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    if r.status_code == 304 and meta is not None:
+        if s.session.cache is not None:
+            s.session.cache.refresh(url)
+        return NOT_MODIFIED, None, fields
+    if r.status_code != 200:
+        return None, None, fields
+    body = r.text
+    if s.session.cache is not None:
+        s.session.cache.store(url, body, fields["etag"], fields["last_modified"])
+    fields["digest"] = content_hash(body)
+    fields["revision_id"] = get_revision_id(body)
+    if meta is not None and (fields["digest"] == meta.content_hash or
+                             fields["revision_id"] is not None and fields["revision_id"] == meta.revision_id):
+        return UNCHANGED, None, fields
+    return CHANGED, s.process_body(body), fields
+
+
+def check_page_wrapper(s, state: RecrawlState, url: str, loggers: logging.Logger):
+    try:
+        return (url,) + check_page(s, state, url)
+    except Exception as e:
+        loggers.warning("failed to recrawl: {}, err:{}".format(url, e))
+        return url, None, None, None
 
 
-def get_web_list(configure, list_of_list_url_list, language, output_path):
+def recrawl_web_content(configure, url_list_file, delta_file, language=None, state_file=None, force=False):
+    """
+    定期刷新语料：只重访到期的url，服务端返回304或内容没有变化的网页不再提取，
+    第一次抓取或内容变化的网页的提取结果写入delta_file
+    :param delta_file: 扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    :param language: 为None时刷新百度百科，否则为WikiSpider的语言
+    :param state_file: 保存每个url抓取记录的sqlite文件，默认为[RECRAWL]中的state_file
+    :param force: 忽略重访时间，检查所有url
+    """
     logging.basicConfig(filename='spider.log', format="%(asctime)s  %(filename)s : %(levelname)s  %(message)s",
                         datefmt='%Y-%m-%d: %H:%M:%S',
                         level=logging.DEBUG)
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
+    s = BaiduSpider(configure) if language is None else WikiSpider(configure, language)
+    state = RecrawlState.from_config(configure, state_file)
+    index = CanonicalIndex()
+    urls = list(index.unique(iter_lines(url_list_file)))
+    due_urls = urls if force else list(state.due(urls))
+    stats = {CHANGED: 0, UNCHANGED: 0, NOT_MODIFIED: 0, "failed": 0}
+
+    logger.info("recrawl start: {} urls, {} due".format(len(urls), len(due_urls)))
+    with open_writer(delta_file) as writer:
+        for url, result, record, fields in imap_unordered(partial(check_page_wrapper, s, state, loggers=logger),
+                                                          due_urls, get_pool_size(configure)):
+            if result is None:
+                stats["failed"] += 1
+                continue
+            if record is not None:
+                writer.write(record)
+            # 记录写入后才更新state，中途退出时变化的网页下次还会被重新提取
+            state.update(url, result, **fields)
+            stats[result] += 1
+    report = "recrawl: {} urls, {} not due, {} not modified, {} unchanged, {} changed, {} failed".format(
+        len(urls), len(urls) - len(due_urls), stats[NOT_MODIFIED], stats[UNCHANGED], stats[CHANGED], stats["failed"])
+    logger.info(report)
+    print(report)
+    state.close()
+
+
+def discover_list_page(s: WikiSpider, url: str, level: int, max_depth: int):
+    """
+    :return: (下一层的list页面, 词条链接)，lists_of_lists页面（level 0）只取list页面，
+             list页面取词条链接，未达到max_depth时同时取其中的子list页面
+    """
+    doc = s.parser.parse(s.get_list_page(url))
+    lists = s.get_lists_from_doc(doc) if level < max_depth else set()
+    links = s.get_links_from_list_doc(doc) if level > 0 else set()
+    return lists, links
 
-    s = WikiSpider(configure, language)
-
-    # for idx, url in enumerate(url_list):
-    #     s.get_web_content(url)
-    #     if idx % 10 == 0:
-    #         logger.debug("{} urls processed".format(idx))
-    #         # print(idx)
 
-    link_set = set()
+def discover_list_page_wrapper(s: WikiSpider, item, max_depth: int):
+    url, level = item
     try:
-        for list_url in list_of_list_url_list:
-            list_list = s.get_lists(list_url)
-            for list_page in list_list:
-                new_url = s.get_links_from_list(list_page)
-
-                link_set |= new_url
+        return url, level, discover_list_page(s, url, level, max_depth), None
     except Exception as e:
-        with open(output_path, "w", encoding="utf-8") as f:
-            for u in link_set:
-                f.write(u + "\n")
-        print(e)
+        return url, level, None, "{}: {}".format(type(e).__name__, e)
+
+
+def get_web_list(configure, list_of_list_url_list, language, output_path, state_file=None, resume=False,
+                 max_depth=1):
+    """
+    从lists_of_lists页面出发，获取其中所有list页面中的词条链接，写入output_path。
+    每一层的页面并发抓取，从多个页面链接到的list页面只抓取一次，单个页面失败不影响其他页面
+    :param state_file: 保存爬取状态的sqlite文件，默认为output_path + '.state'
+    :param resume: 是否从state_file中记录的状态继续上次中断的爬取
+    :param max_depth: list页面的最大层数，为1时只抓取lists_of_lists页面直接链接的list页面，
+                      大于1时继续抓取list页面中的子list页面
+    """
+    logging.basicConfig(filename='spider.log', format="%(asctime)s  %(filename)s : %(levelname)s  %(message)s",
+                        datefmt='%Y-%m-%d: %H:%M:%S',
+                        level=logging.DEBUG)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+
+    s = WikiSpider(configure, language)
+
+    # level 0: lists_of_lists页面，level 1到max_depth: list页面，level max_depth + 1: 词条页面（只记录，不爬取）
+    link_level = max_depth + 1
+    index = CanonicalIndex.from_config(configure)
+    state = CrawlState(state_file or output_path + ".state")
+    frontier = Frontier(state, index)
+    if not resume:
+        state.reset()
+        frontier.seed(list_of_list_url_list)
     else:
+        state.retry_failed()
+        frontier.restore()
+
+    failed = 0
+    level, urls = frontier.pop_level(max_depth)
+    while urls:
+        for url, page_level, r, error in imap_unordered(partial(discover_list_page_wrapper, s, max_depth=max_depth),
+                                                        [(url, level) for url in urls], get_pool_size(configure)):
+            if error is not None:
+                failed += 1
+                logger.warning("failed to discover list page: {}, err:{}".format(url, error))
+                frontier.fail(url, error)
+                continue
+            lists, links = r
+            frontier.seed(lists, page_level + 1)
+            frontier.complete(url, links, link_level)
+        new_lists = frontier.count(level + 1) if level < max_depth else 0
+        print("level {}: {} pages, {} new list pages, {} links".format(level, len(urls), new_lists,
+                                                                       state.count(link_level)))
         with open(output_path, "w", encoding="utf-8") as f:
-            for u in link_set:
+            for u in state.urls(link_level):
                 f.write(u + "\n")
-    print(len(link_set))
+        level, urls = frontier.pop_level(max_depth)
+    print("{} links, {} pages failed".format(state.count(link_level), failed))
+    state.close()
+    logger.info(index.report())
+    print(index.report())
+    index.close()
 
 
 def test_baidu(config):
@@ -205,92 +403,404 @@ def get_align_web_content_wrapper(wiki_spider_zh: WikiSpider, wiki_spider_tgt: W
         return None
 
 
-def get_align_item(configure, align_url_file: str):
-    with open(align_url_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    json_obj = json.loads(content)
+def fetch_align_bodies(wiki_spider_zh: WikiSpider, wiki_spider_tgt: WikiSpider, url_zh: str, url_tgt: str,
+                       is_from_file=False):
+    url_zh = url_zh.replace('/wiki/', '/zh-cn/')
+    body_zh = wiki_spider_zh.get_web_body_text(url_zh, is_from_file)
+    body_tgt = wiki_spider_tgt.get_web_body_text(url_tgt, is_from_file)
+    return url_zh, body_zh, body_tgt
+
+
+def parse_align_bodies(payload):
+    url_zh, body_zh, body_tgt = payload
+    content_zh = None if body_zh is None else get_worker_spider('zh').process_body(body_zh)
+    content_tgt = None if body_tgt is None else get_worker_spider('ja').process_body(body_tgt)
+    return {'url': url_zh, 'chinese': content_zh, 'ja': content_tgt}
+
+
+def get_align_item(configure, align_url_file: str, parse_processes=0, output_file='data/zh-ja-item-simplified.txt',
+                   store: AlignStore = None):
+    """
+    :param parse_processes: 大于0时，抓取线程只负责下载，网页交给该数量的进程解析
+    :param output_file: 扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    :param store: 不为None时对齐结果同时写入该AlignStore
+    """
     s_zh = WikiSpider(configure, 'zh')
     s_ja = WikiSpider(configure, 'ja')
-    result_list = []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(get_align_web_content_wrapper, s_zh, s_ja, url_pair['中文'], url_pair['日本語'], 'ja')
-                   for
-                   url_pair
-                   in json_obj]
-        for future in concurrent.futures.as_completed(futures):
-            r = future.result()
+    # 对齐文件中同一个中文词条的不同写法只抓取一次
+    index = CanonicalIndex.from_config(configure)
+    url_pairs = index.unique(iter_records(align_url_file), key=lambda url_pair: url_pair['中文'])
+    with open_writer(output_file) as writer:
+        if parse_processes > 0:
+            pipeline = FetchParsePipeline(
+                lambda url_pair: fetch_align_bodies(s_zh, s_ja, index.resolve(url_pair['中文']), url_pair['日本語']),
+                parse_align_bodies, get_pool_size(configure), parse_processes, init_worker,
+                (config_to_dict(configure), {'zh': (WikiSpider, ('zh',)), 'ja': (WikiSpider, ('ja',))}))
+            results = (r for url_pair, r in pipeline.run(url_pairs))
+        else:
+            results = imap_unordered(
+                lambda url_pair: get_align_web_content_wrapper(s_zh, s_ja, index.resolve(url_pair['中文']),
+                                                               url_pair['日本語'], 'ja'),
+                url_pairs, get_pool_size(configure))
+        for r in results:
             if r is not None:
-                result_list.append(r)
-    with open('data/zh-ja-item-simplified.txt', 'w', encoding='utf-8') as f:
-        f.write(json.dumps(result_list, ensure_ascii=False))
+                writer.write(r)
+                if store is not None:
+                    store.add_record(r)
+    if store is not None:
+        store.commit()
+    print(index.report())
+    index.close()
+
+
+# 多语言对齐使用的对齐文件：语言代码 -> (文件, 中文url的key, 目标语言url的key)
+align_url_files = {
+    'ja': ('data/日本語-中文-align-urls.txt', '中文', '日本語'),
+    'ko': ('data/chinese-ko-align-urls.txt', 'chinese', 'ko'),
+    'ru': ('data/chinese-ru-align-urls.txt', 'chinese', 'ru'),
+}
+
+
+def merge_align_urls(align_files: Dict[str, Tuple[str, str, str]], index: CanonicalIndex = None) \
+        -> Dict[str, Dict[str, str]]:
+    """
+    把各语言的对齐文件按中文词条合并，中文url的不同写法与已知的重定向合并为同一个词条
+    :param align_files: 格式同align_url_files
+    :param index: 规范化url与重定向的索引，为None时只做规范化
+    :return: key为中文词条url（/zh-cn/），value为{语言代码: 目标语言词条url}
+    """
+    index = index if index is not None else CanonicalIndex()
+    entities = {}
+    for lang, (file_name, key_zh, key_tgt) in align_files.items():
+        for url_pair in iter_records(file_name):
+            url_zh = index.resolve(url_pair[key_zh]).replace('/wiki/', '/zh-cn/', 1)
+            entities.setdefault(url_zh, {})[lang] = canonicalize(url_pair[key_tgt])
+    return entities
+
+
+def get_multi_align_tasks(entities: Dict[str, Dict[str, str]]):
+    for url_zh, tgt_urls in entities.items():
+        yield url_zh, 'zh', url_zh
+        for lang, url_tgt in tgt_urls.items():
+            yield url_zh, lang, url_tgt
+
+
+def get_multi_align_content_wrapper(spiders: Dict[str, WikiSpider], task, is_from_file=False):
+    url_zh, lang, url = task
+    try:
+        return task, spiders[lang].get_web_content(url, is_from_file=is_from_file)
+    except Exception as e:
+        traceback.print_exc()
+        return task, None
+
+
+def fetch_multi_align_body(spiders: Dict[str, WikiSpider], task, is_from_file=False):
+    url_zh, lang, url = task
+    body = spiders[lang].get_web_body_text(url, is_from_file)
+    return None if body is None else (lang, body)
+
+
+def parse_multi_align_body(payload):
+    lang, body = payload
+    return get_worker_spider(lang).process_body(body)
+
+
+def get_multi_align_item(configure, langs=('ja', 'ko', 'ru'), output_file='data/zh-multi-item-simplified.txt',
+                         parse_processes=0, store: AlignStore = None):
+    """
+    一次生成中文与多种语言对齐的词条，每个中文网页只抓取一次，各语言的网页同时抓取，
+    每个实体输出一条记录：{'url': 中文url, 'chinese': 中文内容, 语言代码: 该语言的内容, ...}
+    :param langs: 目标语言代码，对齐文件见align_url_files
+    :param output_file: 扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    :param parse_processes: 大于0时，抓取线程只负责下载，网页交给该数量的进程解析
+    :param store: 不为None时对齐结果与对齐链接同时写入该AlignStore
+    """
+    index = CanonicalIndex.from_config(configure)
+    entities = merge_align_urls({lang: align_url_files[lang] for lang in langs}, index)
+    index.close()
+    spiders = {lang: WikiSpider(configure, lang) for lang in ('zh',) + tuple(langs)}
+    tasks = get_multi_align_tasks(entities)
+    if parse_processes > 0:
+        pipeline = FetchParsePipeline(
+            partial(fetch_multi_align_body, spiders), parse_multi_align_body, get_pool_size(configure),
+            parse_processes, init_worker,
+            (config_to_dict(configure), {lang: (WikiSpider, (lang,)) for lang in spiders}))
+        results = pipeline.run(tasks)
+    else:
+        results = imap_unordered(partial(get_multi_align_content_wrapper, spiders), tasks, get_pool_size(configure))
+
+    # 一个实体的所有网页都处理完后才输出
+    pending = {}
+    with open_writer(output_file) as writer:
+        for (url_zh, lang, url), content in results:
+            if url_zh not in pending:
+                record = {'url': url_zh, 'chinese': None}
+                record.update({tgt: None for tgt in langs})
+                pending[url_zh] = [len(entities[url_zh]) + 1, record]
+            entry = pending[url_zh]
+            entry[1]['chinese' if lang == 'zh' else lang] = content
+            entry[0] -= 1
+            if entry[0] == 0:
+                record = pending.pop(url_zh)[1]
+                writer.write(record)
+                if store is not None:
+                    for tgt, url_tgt in entities[url_zh].items():
+                        store.add_link(url_zh, tgt, url_tgt)
+                    store.add_record(record)
+    if store is not None:
+        store.commit()
+
+
+def get_baike_url(item: List) -> str:
+    baike_url = ''
+    for url in item[2:]:
+        if 'baike.baidu.com' in url:
+            baike_url = url
+            break
+    return baike_url
 
 
 def get_pic_wrapper(spider: BaiduSpider, item: List):
     try:
         item_id = item[0]
         item_name = item[1]
-        baike_url = ''
-        for url in item[2:]:
-            if 'baike.baidu.com' in url:
-                baike_url = url
-                break
+        baike_url = get_baike_url(item)
         item_info = spider.get_web_content(baike_url)
         for v in item_info.values():
             item.append(v['imgs'])
         return item
     except:
-        return item.append([])
+        item.append([])
+        return item
+
+
+def parse_pic(payload):
+    item, body = payload
+    if body is None:
+        return item, None
+    try:
+        return item, get_worker_spider('baidu').extract_body(body)
+    except:
+        item.append([])
+        return item, None
 
 
-def get_pic(configure, url_file: str):
-    with open(url_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-        json_obj = json.loads(content)
-    # json_obj = json_obj[0:10]
+def resolve_pic(spider: BaiduSpider, parsed):
+    item, extracted = parsed
+    if extracted is None:
+        return item
+    try:
+        item_info = spider.resolve_images(extracted)
+        for v in item_info.values():
+            item.append(v['imgs'])
+        return item
+    except:
+        item.append([])
+        return item
+
+
+def get_pic(configure, url_file: str, parse_processes=0, output_file='data/eid_url_with_pic.txt'):
+    """
+    :param parse_processes: 大于0时，抓取线程只负责下载，网页交给该数量的进程解析
+    :param output_file: 扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    """
     s = BaiduSpider(configure)
-    result_list = []
     # get_pic_wrapper(s, json_obj)
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(get_pic_wrapper, s, item) for item in json_obj]
-        for future in concurrent.futures.as_completed(futures):
-            r = future.result()
-            result_list.append(r)
-        with open('data/eid_url_with_pic.txt', 'w', encoding='utf-8') as f:
-            f.write(json.dumps(result_list, ensure_ascii=False))
+    with open_writer(output_file) as writer:
+        if parse_processes > 0:
+            pipeline = FetchParsePipeline(lambda item: (item, s.get_web_body_text(get_baike_url(item))), parse_pic,
+                                          get_pool_size(configure), parse_processes, init_worker,
+                                          (config_to_dict(configure), {'baidu': (BaiduSpider, ())}))
+            # 解析进程只解析网页，图片页面的请求在本进程中作为单独的一级并发完成
+            parsed = (r for item, r in pipeline.run(iter_records(url_file)) if r is not None)
+            results = imap_unordered(partial(resolve_pic, s), parsed, get_pool_size(configure))
+        else:
+            results = imap_unordered(partial(get_pic_wrapper, s), iter_records(url_file), get_pool_size(configure))
+        for r in results:
+            writer.write(r)
+
+
+def offline_extract(configure, language='zh', output_file='data/wiki_page_url_tmp.json', manifest_file=None,
+                    processes=None, archive_file=None):
+    """
+    增量提取data/wikiPages中的网页，只重新解析新增或变化的文件，结果写入output_file，
+    扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    :param manifest_file: 记录每个文件提取状态的sqlite文件，默认为output_file + '.manifest'
+    :param processes: 解析进程数，默认为cpu核数
+    :param archive_file: 不为None时提取该归档中的网页，而不是data/wikiPages中的文件
+    """
+    logging.basicConfig(filename='spider.log', format="%(asctime)s  %(filename)s : %(levelname)s  %(message)s",
+                        datefmt='%Y-%m-%d: %H:%M:%S',
+                        level=logging.DEBUG)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    # 归档不存在时在创建manifest之前就抛出FileNotFoundError
+    paths = list(open_archive(archive_file).locators()) if archive_file else generate_wiki_file_list()
+    extractor = OfflineExtractor(configure, WikiSpider, (language,), manifest_file or output_file + ".manifest")
+    try:
+        stats = extractor.run(paths, processes)
+        logger.info("offline extraction: {}".format(stats))
+        for path, error in extractor.failures():
+            logger.warning("failed to extract: {}, err:{}".format(path, error))
+        extractor.write(output_file)
+    finally:
+        extractor.close()
+        close_archives()
+    print(stats)
+
+
+def get_queue_job(configure, job: str, language='en', lang_src=None, lang_tgt=None, max_iter_times=30):
+    """
+    分布式模式下每个url的处理函数，返回(record, new_urls)，record为None时不输出，new_urls加入队列的下一层。
+    失败时直接抛出异常，由队列重新分配
+    :param job: content、expand-links或align，与get_web_content_json、get_extra_links、align_language对应
+    """
+    if job == "content":
+        s = BaiduSpider(configure)
+
+        def process(url, level):
+            return s.get_web_content(url) or None, None
+    elif job == "expand-links":
+        s = BaiduSpider(configure)
+
+        def process(url, level):
+            links = s.get_extra_links(url)
+            return {"url": url, "links": links}, links if level < max_iter_times else None
+    elif job == "align":
+        s = WikiSpider(configure, language)
+
+        def process(url, level):
+            return s.align_language_wrapper(url, lang_src, lang_tgt), None
+    else:
+        raise ValueError("unknown job: {}".format(job))
+    return process
 
 
-if __name__ == '__main__':
-    # url_list = []
-    # 一些配置信息写在了config.ini中，主要是爬Wikipedia时用到的proxy信息
-    config = configparser.ConfigParser()
-    config.read("config.ini")
-    # get_web_list(config, military_list_of_lists_url_list_jp, "ja", "data/ja_wiki_urls.txt")
-    # get_web_content_json(config, 'zh', "data/baidu_baike_urls_extra.txt",
-    #                      "data/baidu_baike_data_with_summary_extra.txt",
-    #                      is_from_file=False)
-    # s = BaiduSpider(config)
-    # entity_name = s.check_entity_name('mq-9')
-    # print(entity_name)
-    # r = s.get_extra_links("https://baike.baidu.com/item/%E6%AD%BC-20")
-    # print(r)
-    # get_extra_links(config, "data/baidu_baike_urls.txt", "data/baidu_baike_urls_extra.txt")
-    # test_baidu(config)
-
-    # s = WikiSpider(config, 'en')
-    # s.align_language('data/ja_wiki_urls.txt', '日本語', '中文')
-    # s.align_chinese('data/title.txt')
-    # get_align_item(config, 'data/日本語-中文-align-urls.txt')
-    # get_pic(config, 'data/eid_url.txt')
-
-    s = WikiSpider(config, 'zh')
-    path_list = generate_wiki_file_list()
-    result_list = []
-    for path in path_list:
+def run_queue_worker(configure, queue_spec: str, job: str, shard_dir: str, worker_id=None, shard=None, **job_kwargs):
+    """
+    从共享队列中按批租用url并处理，结果写入shard_dir/<worker_id>.jsonl，全部完成后用merge_queue_output合并。
+    可以在多个进程或多台机器上同时运行，总吞吐随worker数增加
+    :param queue_spec: sqlite队列文件路径，或WorkQueueServer的地址http://host:port
+    :param worker_id: 默认为主机名-进程号
+    :param shard: 只处理该host的url，为None时处理所有host
+    """
+    import os
+    import socket
+    import threading
+    from spider.workqueue import LEASED, open_work_queue
+
+    logging.basicConfig(filename='spider.log', format="%(asctime)s  %(filename)s : %(levelname)s  %(message)s",
+                        datefmt='%Y-%m-%d: %H:%M:%S',
+                        level=logging.DEBUG)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    batch_size = configure.getint("QUEUE", "batch_size", fallback=50)
+    lease_seconds = configure.getfloat("QUEUE", "lease_seconds", fallback=300)
+    poll_interval = configure.getfloat("QUEUE", "poll_interval", fallback=5)
+    worker_id = worker_id or "{}-{}".format(socket.gethostname(), os.getpid())
+    process = get_queue_job(configure, job, **job_kwargs)
+    queue = open_work_queue(queue_spec, configure.getint("QUEUE", "max_attempts", fallback=3))
+    os.makedirs(shard_dir, exist_ok=True)
+    logger.info("queue worker {} start".format(worker_id))
+
+    def process_item(item):
+        url, level = item
         try:
-            result_list.append(s.get_web_content(path, True))
-        except:
-            continue
-    json_obj = json.dumps(result_list, ensure_ascii=False)
-    with open('data/wiki_page_url_tmp.json','w', encoding='utf-8') as f:
-        f.write(json_obj)
-    # s.get_web_content("https://zh.wikipedia.org/wiki/%E6%AD%BC-16")
\ No newline at end of file
+            return url, level, process(url, level), None
+        except Exception as e:
+            return url, level, None, "{}: {}".format(type(e).__name__, e)
+
+    # 每个结果带上url与租约id，合并时只保留队列确认完成的那一份
+    with open_writer(os.path.join(shard_dir, worker_id + ".jsonl"), append=True) as writer:
+        while True:
+            lease = queue.lease(batch_size, lease_seconds, shard)
+            if lease is None:
+                # 其他worker租用的url可能超时重新分配，或者产生新的链接
+                if not queue.counts().get(LEASED):
+                    break
+                time.sleep(poll_interval)
+                continue
+            stop_renew = threading.Event()
+
+            def renew(lease_id=lease.id, stop=stop_renew):
+                while not stop.wait(lease_seconds / 3):
+                    queue.renew(lease_id, lease_seconds)
+
+            renewer = threading.Thread(target=renew, daemon=True)
+            renewer.start()
+            done = []
+            new_urls = {}
+            try:
+                for url, level, r, error in imap_unordered(process_item, lease.items, get_pool_size(configure)):
+                    if error is not None:
+                        logger.warning("failed to process: {}, err:{}".format(url, error))
+                        queue.fail(lease.id, url, error)
+                        continue
+                    record, links = r
+                    if record is not None:
+                        writer.write({"url": url, "lease": lease.id, "record": record})
+                    if links:
+                        new_urls.setdefault(level + 1, []).extend(canonicalize(link) for link in links)
+                    done.append(url)
+                # 结果先落盘再确认完成，确认前崩溃的url会重新分配
+                writer.flush()
+                for level, urls in new_urls.items():
+                    queue.add(urls, level)
+                accepted = queue.complete(lease.id, done)
+            finally:
+                stop_renew.set()
+                renewer.join()
+            if len(accepted) < len(done):
+                logger.warning("lease {} expired, {} results discarded".format(lease.id, len(done) - len(accepted)))
+            logger.info("worker {}: {} urls done, queue: {}".format(worker_id, len(accepted), queue.counts()))
+    logger.info("queue worker {} finished".format(worker_id))
+    queue.close()
+
+
+def merge_queue_output(queue_spec: str, shard_dir: str, output_file: str, url_list=False):
+    """
+    合并各worker的输出，每个url只保留完成时租约对应的结果
+    :param output_file: 扩展名为.parquet或.msgpack时以对应格式输出，否则为JSON Lines
+    :param url_list: 为True时输出所有url与链接，每行一个，用于expand-links任务
+    :return: 写入的记录数
+    """
+    import os
+    from spider.workqueue import open_work_queue
+
+    queue = open_work_queue(queue_spec)
+    committed = queue.committed()
+    queue.close()
+    shard_files = sorted(os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith(".jsonl"))
+    seen = set()
+    count = 0
+    if url_list:
+        with open(output_file, "w", encoding="utf-8") as f:
+            for url in committed:
+                seen.add(url)
+                f.write(url + "\n")
+            for path in shard_files:
+                for r in iter_records(path):
+                    if committed.get(r["url"]) != r["lease"]:
+                        continue
+                    # 队列中的url已经规范化，链接也要规范化后才能与之去重
+                    for link in map(canonicalize, r["record"]["links"]):
+                        if link not in seen:
+                            seen.add(link)
+                            f.write(link + "\n")
+        return len(seen)
+    with open_writer(output_file) as writer:
+        for path in shard_files:
+            for r in iter_records(path):
+                if committed.get(r["url"]) != r["lease"] or r["url"] in seen:
+                    continue
+                seen.add(r["url"])
+                writer.write(r["record"])
+                count += 1
+    return count
+
+
+if __name__ == '__main__':
+    # 各任务通过cli.py的子命令运行，例如python cli.py offline-extract，见python cli.py --help
+    import cli
+
+    raise SystemExit(cli.main())
@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+
+from spider.canonical import canonicalize
+
+DEFAULT_COMMIT_EVERY = 1000
+
+# 已有对齐文件中语言的写法 -> 语言代码，其余的key本身就是语言代码
+_file_key_lang = {
+    "中文": "zh",
+    "chinese": "zh",
+    "日本語": "ja",
+    "jp": "ja",
+    "한국어": "ko",
+    "Русский": "ru",
+    "English": "en",
+}
+
+
+def lang_of_key(key: str) -> str:
+    """
+    :return: 对齐文件中的key（如chinese、日本語）对应的语言代码
+    """
+    return _file_key_lang.get(key, key)
+
+
+def record_key(lang: str) -> str:
+    """
+    :return: 对齐记录中该语言内容的key，中文为chinese，其他语言为语言代码
+    """
+    return "chinese" if lang == "zh" else lang
+
+
+class AlignStore:
+    """
+    以中文词条为中心的跨语言对齐结果：
+    links表记录中文词条url -> 各语言词条url，items表记录每个中文词条在各语言中的内容（{词条名: 属性}）。
+    url统一为canonicalize后的形式，/zh-cn/与/wiki/的写法是同一个词条，
+    中文url、各语言url与各语言词条名都有索引，按任意一个查询对齐记录都只需要一次索引查找
+    """
+
+    def __init__(self, path, commit_every=DEFAULT_COMMIT_EVERY):
+        """
+        :param path: sqlite文件路径，所在目录不存在时自动创建
+        :param commit_every: 每写入多少条提交一次，close时提交剩余的
+        """
+        self.path = path
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS links (
+                zh_url TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (zh_url, lang)
+            );
+            CREATE INDEX IF NOT EXISTS links_url ON links (url);
+            CREATE TABLE IF NOT EXISTS items (
+                zh_url TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                title TEXT,
+                content TEXT,
+                PRIMARY KEY (zh_url, lang)
+            );
+            CREATE INDEX IF NOT EXISTS items_title ON items (title, lang);
+        """)
+
+    @classmethod
+    def from_config(cls, config) -> Optional["AlignStore"]:
+        """
+        根据config.ini中的[ALIGN]构造，没有配置store_file时返回None
+        """
+        path = config.get("ALIGN", "store_file", fallback=None)
+        if not path:
+            return None
+        return cls(path, commit_every=config.getint("ALIGN", "commit_every", fallback=DEFAULT_COMMIT_EVERY))
+
+    def add_link(self, zh_url: str, lang: str, url: str):
+        """
+        记录中文词条在lang语言中对应的词条url
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO links (zh_url, lang, url) VALUES (?, ?, ?)",
+                              (canonicalize(zh_url), lang, canonicalize(url)))
+            self._written()
+
+    def add_links(self, record: dict) -> int:
+        """
+        记录一条align_language、align_chinese输出的对齐链接，如{'日本語': url, '中文': url}、{'chinese': url, 'ko': url}，
+        不含中文url的记录忽略
+        :return: 记录的链接数
+        """
+        urls = {lang_of_key(key): url for key, url in record.items()}
+        zh_url = urls.pop("zh", None)
+        if not zh_url:
+            return 0
+        count = 0
+        for lang, url in urls.items():
+            if url:
+                self.add_link(zh_url, lang, url)
+                count += 1
+        return count
+
+    def add_item(self, zh_url: str, lang: str, content: Optional[dict]):
+        """
+        记录中文词条在lang语言中的内容
+        :param content: WikiSpider.process_body的结果{词条名: 属性}，没有内容时为None
+        """
+        title = next(iter(content), None) if content else None
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO items (zh_url, lang, title, content) VALUES (?, ?, ?, ?)",
+                              (canonicalize(zh_url), lang, title,
+                               None if content is None else json.dumps(content, ensure_ascii=False)))
+            self._written()
+
+    def add_record(self, record: dict):
+        """
+        记录一条对齐结果，格式同get_align_item的输出：{'url': 中文url, 'chinese': 中文内容, 语言: 该语言的内容, ...}
+        """
+        for key, content in record.items():
+            if key != "url":
+                self.add_item(record["url"], lang_of_key(key), content)
+
+    def _written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def get(self, zh_url: str) -> Optional[dict]:
+        """
+        :return: 中文词条的对齐记录{'url': 中文url, 'links': {语言: url}, 'chinese': 中文内容, 语言: 该语言的内容, ...}，
+                 没有时返回None
+        """
+        zh_url = canonicalize(zh_url)
+        with self.lock:
+            links = self.conn.execute("SELECT lang, url FROM links WHERE zh_url = ?", (zh_url,)).fetchall()
+            items = self.conn.execute("SELECT lang, content FROM items WHERE zh_url = ?", (zh_url,)).fetchall()
+        if not links and not items:
+            return None
+        record = {"url": zh_url, "links": dict(links)}
+        for lang, content in items:
+            record[record_key(lang)] = None if content is None else json.loads(content)
+        return record
+
+    def find_by_url(self, url: str) -> Optional[dict]:
+        """
+        :param url: 中文或其他语言的词条url
+        """
+        record = self.get(url)
+        if record is not None:
+            return record
+        with self.lock:
+            row = self.conn.execute("SELECT zh_url FROM links WHERE url = ?", (canonicalize(url),)).fetchone()
+        return None if row is None else self.get(row[0])
+
+    def find_by_title(self, title: str, lang: Optional[str] = None) -> List[dict]:
+        """
+        :param title: 词条名
+        :param lang: 词条名所在的语言，如zh、ja，为None时不限语言
+        :return: 所有词条名为title的对齐记录
+        """
+        with self.lock:
+            if lang is None:
+                rows = self.conn.execute("SELECT DISTINCT zh_url FROM items WHERE title = ?", (title,)).fetchall()
+            else:
+                rows = self.conn.execute("SELECT DISTINCT zh_url FROM items WHERE title = ? AND lang = ?",
+                                         (title, lang)).fetchall()
+        return [self.get(row[0]) for row in rows]
+
+    def import_links(self, records: Iterable[dict]) -> int:
+        """
+        导入align_language、align_chinese输出的对齐链接文件
+        :return: 导入的条数
+        """
+        return sum(self.add_links(record) for record in records)
+
+    def import_items(self, records: Iterable[dict]) -> int:
+        """
+        导入get_align_item等输出的对齐内容
+        :return: 导入的条数
+        """
+        count = 0
+        for record in records:
+            self.add_record(record)
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        with self.lock:
+            links = self.conn.execute("SELECT lang, COUNT(*) FROM links GROUP BY lang").fetchall()
+            items = self.conn.execute("SELECT lang, COUNT(*), COUNT(content) FROM items GROUP BY lang").fetchall()
+        return {"links": dict(links), "items": {lang: {"total": total, "with_content": with_content}
+                                                for lang, total, with_content in items}}
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
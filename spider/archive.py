@@ -0,0 +1,303 @@
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from typing import Iterable, Iterator, Optional, Tuple
+
+from spider.canonical import canonicalize, find_canonical_link
+
+# 每条记录：magic、header长度、压缩后内容长度，之后是json格式的header与zlib压缩的内容
+_RECORD_MAGIC = b"WPK1"
+_RECORD_HEADER = struct.Struct(">4sII")
+
+ARCHIVE_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+# 本地网页文件路径中指向归档内网页的写法：<归档文件>#<title>
+LOCATOR_SEPARATOR = "#"
+
+
+class PageArchive:
+    """
+    打包存放本地网页的归档文件，类似WARC：所有网页依次追加到一个.pack文件中，每条记录单独用zlib压缩，
+    旁边的.idx（sqlite）按title与url记录每条记录的偏移量，随机读取时通过mmap只解压需要的那一条，
+    顺序读取时按写入顺序流式读取整个文件。
+    同一个title再次写入时追加新记录并更新索引，内容没变时不重复写入。
+    .idx丢失或损坏时可以用rebuild_index从.pack中重建
+    """
+
+    def __init__(self, path, compress_level=6, readonly=False):
+        """
+        :param path: .pack文件路径，索引为path + '.idx'
+        :param compress_level: zlib压缩级别
+        :param readonly: 只读打开，归档不存在时抛出FileNotFoundError，不会创建任何文件；
+                         .idx不存在时在内存中重建索引
+        """
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.compress_level = compress_level
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        if readonly and not os.path.exists(path):
+            raise FileNotFoundError("archive not found: {}".format(path))
+        rebuild = os.path.exists(path) and not os.path.exists(self.index_path)
+        if not readonly:
+            self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        elif rebuild:
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect("file:{}?mode=ro".format(self.index_path), uri=True, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                title TEXT PRIMARY KEY,
+                url TEXT,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS records_url ON records (url);
+        """)
+        self.file = None if readonly else open(path, "ab")
+        self.mm = None
+        if rebuild:
+            self.rebuild_index()
+
+    @classmethod
+    def from_config(cls, config, path=None, readonly=False) -> "PageArchive":
+        """
+        根据config.ini中的[ARCHIVE]构造
+        :param path: 为None时使用[ARCHIVE]中的file
+        """
+        return cls(path or config.get("ARCHIVE", "file", fallback="data/wikiPages.pack"),
+                   compress_level=config.getint("ARCHIVE", "compress_level", fallback=6), readonly=readonly)
+
+    def add(self, title: str, text: str, url: Optional[str] = None) -> bool:
+        """
+        写入一个网页
+        :param url: 网页的url，为None时取网页中的<link rel="canonical">
+        :return: 是否写入，内容与已有记录相同时为False
+        """
+        if self.readonly:
+            raise ValueError("archive is opened read-only: {}".format(self.path))
+        data = text.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+        if url is None:
+            url = find_canonical_link("", text)
+        if url:
+            url = canonicalize(url)
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM records WHERE title = ?", (title,)).fetchone()
+            if row is not None and row[0] == digest:
+                return False
+            header = json.dumps({"title": title, "url": url, "size": len(data), "digest": digest},
+                                ensure_ascii=False).encode("utf-8")
+            body = zlib.compress(data, self.compress_level)
+            offset = self.file.tell()
+            self.file.write(_RECORD_HEADER.pack(_RECORD_MAGIC, len(header), len(body)))
+            self.file.write(header)
+            self.file.write(body)
+            self.file.flush()
+            self.conn.execute("INSERT OR REPLACE INTO records (title, url, offset, length, size, digest) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (title, url, offset + _RECORD_HEADER.size + len(header), len(body), len(data), digest))
+            self.conn.commit()
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        :param key: title或url
+        :return: 网页的html，不存在时返回None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT offset, length FROM records WHERE title = ?", (key,)).fetchone()
+            if row is None:
+                row = self.conn.execute("SELECT offset, length FROM records WHERE url = ?",
+                                        (canonicalize(key),)).fetchone()
+            if row is None:
+                return None
+            offset, length = row
+            if self.mm is None or offset + length > len(self.mm):
+                self._remap()
+            data = self.mm[offset:offset + length]
+        return zlib.decompress(data).decode("utf-8")
+
+    def digest(self, title: str) -> Optional[str]:
+        """
+        :return: 网页内容的sha1，不存在时返回None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM records WHERE title = ?", (title,)).fetchone()
+        return None if row is None else row[0]
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM records WHERE title = ? OR url = ?",
+                                    (key, canonicalize(key))).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def titles(self) -> Iterator[str]:
+        """
+        所有网页的title，按写入顺序排列
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT title FROM records ORDER BY offset").fetchall()
+        return (row[0] for row in rows)
+
+    def locators(self) -> Iterator[str]:
+        """
+        所有网页的<归档文件>#<title>，可以代替本地网页文件路径传给spider
+        """
+        return (self.path + LOCATOR_SEPARATOR + title for title in self.titles())
+
+    def __iter__(self) -> Iterator[Tuple[str, Optional[str], str]]:
+        """
+        按写入顺序流式读取所有网页，被覆盖的旧记录跳过
+        :return: (title, url, html)
+        """
+        with self.lock:
+            current = {row[0] for row in self.conn.execute("SELECT offset FROM records")}
+        for offset, header, body in self._scan():
+            if offset in current:
+                yield header["title"], header["url"], zlib.decompress(body).decode("utf-8")
+
+    def _scan(self) -> Iterator[Tuple[int, dict, bytes]]:
+        """
+        :return: (内容的偏移量, header, 压缩后的内容)，文件末尾不完整的记录忽略
+        """
+        with open(self.path, "rb") as f:
+            while True:
+                prefix = f.read(_RECORD_HEADER.size)
+                if len(prefix) < _RECORD_HEADER.size:
+                    return
+                magic, header_length, body_length = _RECORD_HEADER.unpack(prefix)
+                if magic != _RECORD_MAGIC:
+                    raise ValueError("corrupted archive: {}, offset {}".format(self.path, f.tell() - len(prefix)))
+                header = f.read(header_length)
+                offset = f.tell()
+                body = f.read(body_length)
+                if len(header) < header_length or len(body) < body_length:
+                    return
+                yield offset, json.loads(header.decode("utf-8")), body
+
+    def rebuild_index(self) -> int:
+        """
+        扫描.pack文件重建索引，同一个title以最后一条记录为准
+        :return: 网页数
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM records")
+            for offset, header, body in self._scan():
+                self.conn.execute("INSERT OR REPLACE INTO records (title, url, offset, length, size, digest) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  (header["title"], header["url"], offset, len(body), header["size"],
+                                   header["digest"]))
+            self.conn.commit()
+        return len(self)
+
+    def stats(self) -> dict:
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM records").fetchone()
+        return {"pages": count, "raw_size": size, "archive_size": os.path.getsize(self.path)}
+
+    def _remap(self):
+        if self.mm is not None:
+            self.mm.close()
+        with open(self.path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        with self.lock:
+            if self.mm is not None:
+                self.mm.close()
+                self.mm = None
+            if self.file is not None:
+                self.file.close()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def import_files(archive: PageArchive, paths: Iterable[str]) -> Tuple[int, int]:
+    """
+    把本地网页文件导入归档，文件名（去掉扩展名）作为title
+    :return: (写入的文件数, 内容没有变化而跳过的文件数)
+    """
+    added, skipped = 0, 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        if archive.add(os.path.splitext(os.path.basename(path))[0], text):
+            added += 1
+        else:
+            skipped += 1
+    return added, skipped
+
+
+def import_dir(archive: PageArchive, directory: str, suffixes=(".html", ".htm")) -> Tuple[int, int]:
+    """
+    导入目录中的网页文件，如data/wikiPages。
+    只导入扩展名在suffixes中的文件，data/繁体等目录中的json结果文件不是网页，会被跳过
+    """
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(suffixes))
+    return import_files(archive, (p for p in paths if os.path.isfile(p)))
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def split_locator(path: str) -> Optional[Tuple[str, str]]:
+    """
+    :return: <归档文件>#<title>形式的路径拆分为(归档文件, title)，不是这种形式时返回None
+    """
+    archive_path, sep, title = path.partition(ARCHIVE_SUFFIX + LOCATOR_SEPARATOR)
+    if not sep:
+        return None
+    return archive_path + ARCHIVE_SUFFIX, title
+
+
+def open_archive(path: str) -> PageArchive:
+    """
+    以只读方式打开归档，同一个归档文件在进程内只打开一次，供多个spider与线程共享；
+    fork出的解析进程不能沿用父进程的sqlite连接，按进程号区分。归档不存在时抛出FileNotFoundError
+    """
+    key = (os.getpid(), path)
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            archive = _archives[key] = PageArchive(path, readonly=True)
+        return archive
+
+
+def close_archives():
+    """
+    关闭本进程中open_archive打开的所有归档
+    """
+    pid = os.getpid()
+    with _archives_lock:
+        for key in [key for key in _archives if key[0] == pid]:
+            _archives.pop(key).close()
+
+
+def read_local_page(path: str) -> Optional[str]:
+    """
+    读取本地网页：<归档文件>#<title>从归档中读取，否则作为普通文件读取
+    """
+    locator = split_locator(path)
+    if locator is None:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    archive_path, title = locator
+    return open_archive(archive_path).get(title)
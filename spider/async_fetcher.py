@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from spider.cache import ResponseCache
+from spider.metrics import metrics
+from spider.ratelimit import RateLimiter, RetryPolicy, parse_retry_after
+from spider.session import DEFAULT_TIMEOUT
+
+if TYPE_CHECKING:
+    import aiohttp
+
+DEFAULT_CONCURRENCY = 200
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFetcher:
+    """
+    基于asyncio/aiohttp的抓取引擎，用于替代ThreadPoolExecutor的一个url一个future的方式。
+    同时在途的请求数由concurrency控制，所有请求在同一个线程的事件循环中完成；
+    解析网页与读写sqlite缓存会阻塞，放到事件循环的默认线程池中执行，不会卡住其他在途的请求
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, proxy_url=None, headers=None,
+                 cache: Optional[ResponseCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry: Optional[RetryPolicy] = None):
+        """
+        :param concurrency: 同时在途的最大请求数
+        :param timeout: 单个请求的超时时间（秒）
+        :param proxy_url: 代理地址，socks代理需要安装aiohttp_socks
+        :param headers: 每个请求都附带的header
+        :param cache: 响应缓存，为None时不缓存
+        :param rate_limiter: 按host的限流器，为None时不限流
+        :param retry: 重试策略，为None时不重试
+        """
+        self.concurrency = concurrency
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry or RetryPolicy(max_retries=0)
+        self.timeout = timeout
+        self.proxy_url = proxy_url
+        self.headers = headers
+
+    @classmethod
+    def from_config(cls, config, use_proxy=False, headers=None, cache: Optional[ResponseCache] = None,
+                    rate_limiter: Optional[RateLimiter] = None):
+        """
+        cache与rate_limiter一般传入同一个spider中SpiderSession的对象，使两种抓取方式共享缓存与限流状态
+        """
+        proxy_url = None
+        if use_proxy and config.has_section("PROXY"):
+            proxy_url = config["PROXY"].get("url") or None
+        return cls(concurrency=config.getint("HTTP", "async_concurrency", fallback=DEFAULT_CONCURRENCY),
+                   timeout=config.getfloat("HTTP", "timeout", fallback=DEFAULT_TIMEOUT),
+                   proxy_url=proxy_url,
+                   headers=headers,
+                   cache=cache,
+                   rate_limiter=rate_limiter,
+                   retry=RetryPolicy.from_config(config))
+
+    def fetch_all(self, urls: Iterable[str], process: Callable[[str, str], object],
+                  callback: Optional[Callable[[str, object], None]] = None) -> List:
+        """
+        并发抓取所有url，并用process解析网页
+        :param urls: url列表
+        :param process: 解析函数，参数为(url, html文本)，例如lambda url, body: spider.process_body(body)，
+                        在线程池中调用，需要是线程安全的
+        :param callback: 每得到一个结果时调用，参数为(url, 结果)；为None时结果以list形式返回
+        :return: callback为None时返回非None结果组成的list，否则返回空list
+        """
+        return asyncio.run(self.fetch_all_async(urls, process, callback))
+
+    async def fetch_all_async(self, urls: Iterable[str], process: Callable[[str, str], object],
+                              callback: Optional[Callable[[str, object], None]] = None) -> List:
+        result_list = []
+        loop = asyncio.get_running_loop()
+        # concurrency个worker从同一个迭代器中取url，url可以是惰性生成的，内存占用与url总数无关
+        url_iter = iter(urls)
+
+        async def worker(session):
+            for url in url_iter:
+                metrics.add("spider_inflight", 1, pool="async")
+                try:
+                    body = await self.fetch(session, url)
+                finally:
+                    metrics.add("spider_inflight", -1, pool="async")
+                if body is None:
+                    continue
+                try:
+                    r = await loop.run_in_executor(None, process, url, body)
+                except Exception as e:
+                    logger.warning("failed to process: {}, err:{}".format(url, e))
+                    continue
+                if r is None:
+                    continue
+                if callback is None:
+                    result_list.append(r)
+                else:
+                    callback(url, r)
+
+        async with self.create_session() as session:
+            await asyncio.gather(*[worker(session) for _ in range(self.concurrency)])
+        return result_list
+
+    def create_session(self) -> "aiohttp.ClientSession":
+        # aiohttp导入较慢，只在真正使用asyncio引擎时导入
+        import aiohttp
+        connector = None
+        if self.proxy_url is not None and self.proxy_url.startswith("socks"):
+            from aiohttp_socks import ProxyConnector
+            connector = ProxyConnector.from_url(self.proxy_url, limit=self.concurrency)
+        else:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+        return aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def fetch(self, session: "aiohttp.ClientSession", url: str) -> Optional[str]:
+        """
+        获取网页的html文本，失败或状态码不为200时返回None
+        """
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        entry = None
+        headers = None
+        host = urlsplit(url).netloc
+        if self.cache is not None:
+            entry = await loop.run_in_executor(None, self.cache.lookup, url)
+            if entry is not None and entry.is_fresh():
+                metrics.inc("spider_cache_total", result="hit")
+                return entry.text
+            if entry is not None:
+                headers = entry.conditional_headers()
+        proxy = None
+        if self.proxy_url is not None and not self.proxy_url.startswith("socks"):
+            proxy = self.proxy_url
+        attempt = 0
+        while True:
+            limiter = None
+            if self.rate_limiter is not None:
+                limiter = self.rate_limiter.host(url)
+                wait = limiter.try_acquire()
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = limiter.try_acquire()
+            start = time.monotonic()
+            status = None
+            retry_after = None
+            try:
+                async with session.get(url, proxy=proxy, headers=headers) as r:
+                    status = r.status
+                    metrics.observe("spider_stage_seconds", time.monotonic() - start, stage="ttfb", host=host)
+                    metrics.inc("spider_requests_total", host=host, status=status)
+                    retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                    if r.status == 304 and entry is not None:
+                        metrics.inc("spider_cache_total", result="revalidated")
+                        await loop.run_in_executor(None, self.cache.refresh, url)
+                        return entry.text
+                    if r.status == 200:
+                        metrics.inc("spider_bytes_total", len(await r.read()), host=host)
+                        text = await r.text()
+                        if self.cache is not None:
+                            metrics.inc("spider_cache_total", result="miss")
+                            await loop.run_in_executor(None, self.cache.store, url, text, r.headers.get("ETag"),
+                                                       r.headers.get("Last-Modified"))
+                        return text
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc("spider_errors_total", stage="fetch", host=host, error=type(e).__name__)
+                logger.debug("failed to fetch: {}, err:{}".format(url, e))
+            finally:
+                metrics.observe("spider_stage_seconds", time.monotonic() - start, stage="fetch", host=host)
+                if limiter is not None:
+                    limiter.release(status, time.monotonic() - start, retry_after)
+            if not self.retry.should_retry(attempt, status):
+                if status is None:
+                    logger.warning("failed to fetch: {}".format(url))
+                return None
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
@@ -1,18 +1,38 @@
-import re
+import logging
 from urllib.parse import unquote
-from typing import List, Union
+from typing import Dict, Iterable, List, Tuple, Union
 
-import requests
-from bs4 import BeautifulSoup
+from spider.archive import read_local_page
+from spider.async_fetcher import AsyncFetcher
+from spider.entity_names import MISSING, EntityNameStore
+from spider.executor import imap_unordered
+from spider.images import ImageResolver
+from spider.metrics import metrics
+from spider.normalize import BAIDU, Normalizer
+from spider.parser import get_parser
+from spider.session import SpiderSession
+
+logger = logging.getLogger(__name__)
 
 
 class BaiduSpider:
+    # process_body的提取逻辑或输出格式变化时加1，离线提取会据此重新解析所有网页
+    extractor_version = 3
+
     def __init__(self, config):
-        self.baidu_item_base_url = "https://baike.baidu.com/item/"
-        self.baidu_base_url = "https://baike.baidu.com/"
+        # 可在config.ini的[BAIDU]中改为本地模拟的百科地址
+        self.baidu_base_url = config.get("BAIDU", "base_url", fallback="https://baike.baidu.com/")
+        self.baidu_item_base_url = self.baidu_base_url + "item/"
         self.headers = {
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:88.0) Gecko/20100101 Firefox/88.0"
         }
+        self.session = SpiderSession.from_config(config, headers=self.headers)
+        self.async_fetcher = AsyncFetcher.from_config(config, headers=self.headers, cache=self.session.cache,
+                                                      rate_limiter=self.session.rate_limiter)
+        self.parser = get_parser(config)
+        self.normalizer = Normalizer.from_config(config, profile=BAIDU)
+        self.image_resolver = ImageResolver(self.session, self.extract_image_url, workers=self.session.pool_size)
+        self.entity_names = EntityNameStore.from_config(config)
         return
 
     def check_entity_name(self, key_word) -> Union[str, dict, None]:
@@ -23,25 +43,60 @@ class BaiduSpider:
                     词条存在多个释义是返回词典，key为词条名，value为str类型的数组
                     词条不存在歧义时返回百科中的名称
         """
+        result = self.entity_names.get(key_word)
+        if result is MISSING:
+            result = self.resolve_entity_name(key_word)
+            self.entity_names.put(key_word, result)
+        return result
+
+    def check_entity_names(self, key_words: Iterable[str]) -> Dict[str, Union[str, dict, None]]:
+        """
+        批量查询关键词在百科词条中的名称，缓存中没有的关键词并发查询
+        :return: 关键词 -> check_entity_name的结果，按key_words的顺序排列
+        """
+        results = {}
+        to_resolve = []
+        for key_word in key_words:
+            if key_word in results:
+                continue
+            results[key_word] = self.entity_names.get(key_word)
+            if results[key_word] is MISSING:
+                to_resolve.append(key_word)
+        for key_word, result in imap_unordered(self._try_resolve_entity_name, to_resolve, self.session.pool_size):
+            if result is MISSING:
+                # 查询失败的关键词不缓存，下次重新查询
+                results[key_word] = None
+                continue
+            self.entity_names.put(key_word, result)
+            results[key_word] = result
+        return results
+
+    def _try_resolve_entity_name(self, key_word):
+        try:
+            return key_word, self.resolve_entity_name(key_word)
+        except Exception as e:
+            logger.warning("failed to resolve entity name: {}, err:{}".format(key_word, e))
+            return key_word, MISSING
+
+    def resolve_entity_name(self, key_word) -> Union[str, dict, None]:
+        """
+        不经过缓存查询key_word在百科词条中的名称，返回值同check_entity_name。
+        跟随重定向只需要一次请求：重定向到error.html说明词条不存在，否则直接解析最终的页面
+        """
         url = self.baidu_item_base_url + key_word
-        r = requests.get(url, headers=self.headers, allow_redirects=False)
-        if r.status_code == 200:  # 消歧义页面
-            body = r.text
-            soup = BeautifulSoup(body, features="lxml")
-            title = self.get_title(soup)
-            if title is not None:
-                return title
-            list_items = soup.findAll('li', {'class': 'list-dot list-dot-paddingleft'})
-            title_list = [item.text for item in list_items]
-            return {key_word: title_list}
-        location = r.headers['Location']
-        if 'error.html' in location:
+        r = self.session.get(url)
+        if 'error.html' in r.url or any('error.html' in h.headers.get('Location', '') for h in r.history):
             return None
-        else:
-            body = self.get_web_body_text(url)
-            soup = BeautifulSoup(body, features="lxml")
-            title = self.get_title(soup)
+        if r.status_code != 200:
+            raise ValueError("failed to resolve entity name: {}, status:{}".format(key_word, r.status_code))
+        doc = self.parser.parse(r.text)
+        title = self.get_title(doc)
+        if title is not None or r.history:
             return title
+        # 没有重定向且没有词条名的是消歧义页面
+        list_items = self.parser.find_all(doc, 'li', cls='list-dot list-dot-paddingleft')
+        title_list = [self.parser.text(item) for item in list_items]
+        return {key_word: title_list}
 
     def get_web_content_by_keyword(self, key, is_from_file=False) -> dict:
         """
@@ -69,28 +124,35 @@ class BaiduSpider:
         从url对应百科页面的属性表格中获取超链接
         :rtype: 包含链接文本的list
         """
-        extra_links = []
-
         body_text = self.get_web_body_text(url, is_from_file)
-        soup = BeautifulSoup(body_text, features="lxml")
-        left_form = soup.find("dl", {"class": "basicInfo-block basicInfo-left"})
-        right_form = soup.find("dl", {"class": "basicInfo-block basicInfo-right"})
+        return self.get_extra_links_from_body(body_text)
+
+    def get_extra_links_from_body(self, body_text: str) -> List[str]:
+        """
+        从百科页面的html文本中获取属性表格中的超链接
+        :param body_text: html文本
+        :return: 包含链接文本的list
+        """
+        extra_links = []
+        doc = self.parser.parse(body_text)
+        left_form = self.parser.find(doc, "dl", cls="basicInfo-block basicInfo-left")
+        right_form = self.parser.find(doc, "dl", cls="basicInfo-block basicInfo-right")
         if left_form is not None:
-            left_keys = left_form.findChildren("dt")
-            left_values = left_form.findChildren("dd")
+            left_keys = self.parser.find_all(left_form, "dt")
+            left_values = self.parser.find_all(left_form, "dd")
             for i in range(len(left_keys)):
-                hyper_link_tag = left_values[i].find("a")
+                hyper_link_tag = self.parser.find(left_values[i], "a")
                 if hyper_link_tag is not None:
-                    link = hyper_link_tag["href"]
+                    link = self.parser.get(hyper_link_tag, "href")
                     extra_links.append(unquote(self.baidu_base_url[:-1] + link))
 
         if right_form is not None:
-            right_keys = right_form.findChildren("dt")
-            right_values = right_form.findChildren("dd")
+            right_keys = self.parser.find_all(right_form, "dt")
+            right_values = self.parser.find_all(right_form, "dd")
             for i in range(len(right_keys)):
-                hyper_link_tag = right_values[i].find("a")
+                hyper_link_tag = self.parser.find(right_values[i], "a")
                 if hyper_link_tag is not None:
-                    link = hyper_link_tag["href"]
+                    link = self.parser.get(hyper_link_tag, "href")
                     extra_links.append(unquote(self.baidu_base_url[:-1] + link))
         return extra_links
 
@@ -102,101 +164,123 @@ class BaiduSpider:
         :return:
         """
         if not is_from_file:
-            r = requests.get(url, headers=self.headers, timeout=5)
-            if not r.status_code == 200:
-                return None
-            return r.text
+            return self.session.get_text(url, timeout=5)
         else:
-            text = ""
-            with open(url, 'r', encoding='utf-8') as f:
-                text = f.read()
-            return text
+            return read_local_page(url)
 
     def process_body(self, body: str) -> dict:
-        r = {}
-        soup = BeautifulSoup(body, features="lxml")
-        title = self.get_title(soup)
-        if title is None:
-            return None
-        info = self.get_info(soup)
-        if info == {}:
-            return None
-        img_urls = self.get_image(soup)
-        summary = self.get_summary(soup)
-        info["summary"] = summary
-        info["imgs"] = img_urls
+        return self.resolve_images(self.extract_body(body))
 
+    def extract_body(self, body: str) -> Tuple[Union[dict, None], List[Tuple[str, None]]]:
+        """
+        只解析网页，不发请求，可以在解析进程中调用
+        :return: (词条记录, 图片页面)，图片页面交给resolve_images解析为图片地址；不是词条页面时记录为None
+        """
+        r = {}
+        with metrics.stage("parse"):
+            doc = self.parser.parse(body)
+        with metrics.stage("extract"):
+            title = self.get_title(doc)
+            if title is None:
+                return None, []
+            info = self.get_info(doc)
+            if info == {}:
+                return None, []
+            image_refs = self.get_image_refs(doc)
+            info["summary"] = self.get_summary(doc)
         r[title] = info
+        return r, image_refs
+
+    def resolve_images(self, extracted) -> Union[dict, None]:
+        """
+        把extract_body得到的图片页面并发解析为图片地址，写入记录的imgs
+        :param extracted: extract_body的返回值
+        """
+        r, image_refs = extracted
+        if r is None:
+            return None
+        img_urls = self.image_resolver.resolve(image_refs)
+        for info in r.values():
+            info["imgs"] = img_urls
         return r
 
-    def get_title(self, soup: BeautifulSoup) -> Union[str, None]:
+    def get_title(self, doc) -> Union[str, None]:
         """
         获取网页的title，即百科的词条名称
         :rtype: object
         """
-        head = soup.find("dd", {"class": "lemmaWgt-lemmaTitle-title"}).findChild('h1')
-
+        title_dd = self.parser.find(doc, "dd", cls="lemmaWgt-lemmaTitle-title")
+        # 消歧义页面没有词条名
+        if title_dd is None:
+            return None
+        head = self.parser.find(title_dd, 'h1')
         if head is None:
             return None
-        return head.text
+        return self.normalizer.convert(self.parser.text(head))
 
-    def get_info(self, soup: BeautifulSoup) -> dict:
+    def get_info(self, doc) -> dict:
         """
         提取百科页面属性表格的信息，以dict方式返回
         :param body: html content
         :return: dictionary contains property retrieved from wikipedia infobox
         """
         info_dict = {}
-        left_form = soup.find("dl", {"class": "basicInfo-block basicInfo-left"})
-        right_form = soup.find("dl", {"class": "basicInfo-block basicInfo-right"})
+        left_form = self.parser.find(doc, "dl", cls="basicInfo-block basicInfo-left")
+        right_form = self.parser.find(doc, "dl", cls="basicInfo-block basicInfo-right")
         if left_form is not None:
-            left_keys = left_form.findChildren("dt")
-            left_values = left_form.findChildren("dd")
+            left_keys = self.parser.find_all(left_form, "dt")
+            left_values = self.parser.find_all(left_form, "dd")
             for i in range(len(left_keys)):
-                info_dict[left_keys[i].text] = self.strip_info_value(left_values[i].text)
+                info_dict[self.strip_info_key(self.parser.text(left_keys[i]))] = \
+                    self.strip_info_value(self.parser.text(left_values[i]))
         if right_form is not None:
-            right_keys = right_form.findChildren("dt")
-            right_values = right_form.findChildren("dd")
+            right_keys = self.parser.find_all(right_form, "dt")
+            right_values = self.parser.find_all(right_form, "dd")
             for i in range(len(right_keys)):
-                info_dict[right_keys[i].text] = self.strip_info_value(right_values[i].text)
+                info_dict[self.strip_info_key(self.parser.text(right_keys[i]))] = \
+                    self.strip_info_value(self.parser.text(right_values[i]))
 
         return info_dict
 
-    def get_summary(self, soup: BeautifulSoup):
+    def get_summary(self, doc):
         """
         获取百科词条页面的描述文本
-        :param soup:
+        :param doc:
         :return:
         """
-        s = soup.find("div", {"class": "lemma-summary"}).text
-        s = re.sub(r'\[(\d)*\]', "", s.replace("\n", ""))
-        return s
+        s = self.parser.text(self.parser.find(doc, "div", cls="lemma-summary"))
+        return self.normalizer.normalize_text(s.replace("\n", ""))
 
-    def get_image(self, soup: BeautifulSoup) -> List[str]:
+    def get_image_refs(self, doc) -> List[Tuple[str, None]]:
         """
-        获取百科页面的所有图片链接
-        :param soup:
-        :return:
+        获取百科页面中所有图片的图片页面链接
+        :param doc:
+        :return: ImageResolver.resolve的输入，百度百科的图片地址无法由缩略图推出，缩略图地址为None
         """
-        image_urls = []
-        image_tags = soup.findAll("div", {"class": "lemma-picture"})
+        refs = []
+        image_tags = self.parser.find_all(doc, "div", cls="lemma-picture")
         for tag in image_tags:
-            image_href = tag.find("a", {"class": "image-link"})["href"]
-            r = requests.get(self.baidu_base_url + image_href[1:], headers=self.headers)
-            s = BeautifulSoup(r.text, features="lxml")
-            if s.find("img", {"id": "imgPicture"}) is None:
-                continue
-            image_urls.append(s.find("img", {"id": "imgPicture"})["src"])
-        return image_urls
+            image_href = self.parser.get(self.parser.find(tag, "a", cls="image-link"), "href")
+            refs.append((self.baidu_base_url + image_href[1:], None))
+        return refs
+
+    def extract_image_url(self, body: str) -> Union[str, None]:
+        """
+        从图片页面中提取图片地址，图片地址带有每张图片不同的水印参数，无法由缩略图推出
+        :param body: 图片页面的html
+        :return: 图片地址，页面中没有图片时返回None
+        """
+        s = self.parser.parse(body)
+        img = self.parser.find(s, "img", id="imgPicture")
+        if img is None:
+            return None
+        return self.parser.get(img, "src")
 
     def get_proxy(self) -> dict:
-        return {
-            'http': self.proxy_config["url"],
-            'https': self.proxy_config["url"],
-        }
+        return self.session.proxies
 
     def strip_info_key(self, key: str):
-        return key.strip("\n")
+        return self.normalizer.normalize_key(key)
 
     def strip_info_value(self, value: str):
-        return value.strip("\n")
+        return self.normalizer.normalize_value(value)
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+from spider.canonical import canonicalize
+
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_SIZE_MB = 2048
+
+
+class CacheEntry:
+    def __init__(self, text, etag, last_modified, fetched_at, ttl):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.fetched_at < self.ttl
+
+    def conditional_headers(self) -> dict:
+        """
+        过期后重新验证时附带的header
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    磁盘上的http响应缓存。
+    网页内容以zlib压缩后按内容的sha1存放在objects/目录中（内容相同的页面只存一份），
+    sqlite索引记录规范化url到内容的映射以及ETag/Last-Modified等信息。
+    超过max_size后按最近访问时间淘汰
+    """
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE_MB * 1024 * 1024):
+        """
+        :param cache_dir: 缓存目录
+        :param ttl: 缓存有效期（秒），过期后用ETag/Last-Modified重新验证
+        :param max_size: 压缩后内容的总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+            CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            );
+        """)
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ResponseCache"]:
+        """
+        根据config.ini中的[CACHE]构造缓存，没有该section或enabled为false时返回None
+        """
+        if not config.has_section("CACHE") or not config.getboolean("CACHE", "enabled", fallback=True):
+            return None
+        return cls(config.get("CACHE", "dir"),
+                   ttl=config.getint("CACHE", "ttl", fallback=DEFAULT_TTL),
+                   max_size=config.getint("CACHE", "max_size_mb", fallback=DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+
+    def lookup(self, url) -> Optional[CacheEntry]:
+        key = canonicalize(url, keep_variant=True)
+        with self.lock:
+            row = self.conn.execute("SELECT digest, etag, last_modified, fetched_at FROM entries WHERE url = ?",
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), key))
+            self.conn.commit()
+        digest, etag, last_modified, fetched_at = row
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error):
+            return None
+        return CacheEntry(text, etag, last_modified, fetched_at, self.ttl)
+
+    def store(self, url, text: str, etag=None, last_modified=None):
+        key = canonicalize(url, keep_variant=True)
+        data = text.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+        now = time.time()
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is None:
+                compressed = zlib.compress(data)
+                path = self._blob_path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(compressed)
+                os.replace(tmp_path, path)
+                self.conn.execute("INSERT INTO blobs (digest, size) VALUES (?, ?)", (digest, len(compressed)))
+                self.total_size += len(compressed)
+            row = self.conn.execute("SELECT digest FROM entries WHERE url = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO entries (url, digest, etag, last_modified, fetched_at, accessed_at)"
+                              " VALUES (?, ?, ?, ?, ?, ?)", (key, digest, etag, last_modified, now, now))
+            if row is not None and row[0] != digest:
+                self._drop_blob_if_unused(row[0])
+            if self.total_size > self.max_size:
+                self._evict()
+            self.conn.commit()
+
+    def refresh(self, url):
+        """
+        重新验证返回304时调用，重置该条目的有效期
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                              (now, now, canonicalize(url, keep_variant=True)))
+            self.conn.commit()
+
+    def _evict(self):
+        # 淘汰到上限的90%，避免每次store都触发淘汰
+        target = self.max_size * 0.9
+        rows = self.conn.execute("SELECT url, digest FROM entries ORDER BY accessed_at").fetchall()
+        for url, digest in rows:
+            if self.total_size <= target:
+                break
+            self.conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self._drop_blob_if_unused(digest)
+
+    def _drop_blob_if_unused(self, digest):
+        if self.conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None:
+            return
+        row = self.conn.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return
+        self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        self.total_size -= row[0]
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest[2:])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,175 @@
+import html
+import os
+import re
+import sqlite3
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import parse_qs, quote, unquote, urljoin, urlsplit, urlunsplit
+
+# 中文Wikipedia的地区变体路径，与/wiki/是同一个词条
+_wiki_variant_regex = re.compile(r"^/zh(?:-(?:cn|hans|hant|tw|hk|mo|my|sg))?/")
+_canonical_link_regex = re.compile(r'<link[^>]+rel="canonical"[^>]*>')
+_href_regex = re.compile(r'href="([^"]+)"')
+
+# path中不做percent-encoding的字符
+_PATH_SAFE = "/:@!$&'()*+,;=-._~"
+# 重定向链的最大长度，防止错误的索引形成环
+_MAX_REDIRECTS = 10
+
+
+def canonicalize(url: str, keep_variant=False) -> str:
+    """
+    同一个网页的各种写法统一为一个url：
+    scheme与host转小写，去掉#fragment，path统一为percent-encoding形式；
+    Wikipedia的移动版host、/zh-cn/等变体路径与index.php?title=统一为/wiki/<title>，title中的空格换为下划线；
+    词条页面去掉query（百度百科的fromModule、fr等统计参数）
+    :param keep_variant: 只做前一步的统一，保留host、路径与query，用于http缓存的key：
+                         /zh-cn/与/wiki/返回的网页内容不同（地区变体的字形），不能共用缓存
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    path = unquote(parts.path)
+    query = parts.query
+    if keep_variant:
+        return urlunsplit((scheme, host, quote(path, safe=_PATH_SAFE) or "/", query, ""))
+    if host.endswith(".wikipedia.org"):
+        host = host.replace(".m.wikipedia.org", ".wikipedia.org")
+        if path in ("/w/index.php", "/index.php") and "title" in parse_qs(query):
+            path = "/wiki/" + parse_qs(query)["title"][0]
+        path = _wiki_variant_regex.sub("/wiki/", path)
+        if path.startswith("/wiki/"):
+            path = path.replace(" ", "_")
+            query = ""
+    elif path.startswith("/item/"):
+        query = ""
+    return urlunsplit((scheme, host, quote(path, safe=_PATH_SAFE) or "/", query, ""))
+
+
+def find_canonical_link(url: str, body: str) -> Optional[str]:
+    """
+    :return: 网页中<link rel="canonical">指向的url，重定向页面中为重定向的目标；没有时返回None
+    """
+    head_end = body.find("</head>")
+    m = _canonical_link_regex.search(body, 0, head_end if head_end != -1 else len(body))
+    if m is None:
+        return None
+    href = _href_regex.search(m.group(0))
+    if href is None:
+        return None
+    return urljoin(url, html.unescape(href.group(1)))
+
+
+class CanonicalIndex:
+    """
+    规范化url与重定向的索引，用于保证一次运行中每个网页只抓取、提取一次：
+    输入与新发现的链接先经canonicalize统一写法，再沿已知的重定向找到目标词条，只有第一次出现的词条才会被处理；
+    抓取后从网页的<link rel="canonical">学习新的重定向，保存在sqlite中，下次运行时在抓取前就能去重
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: 保存重定向的sqlite文件，为None时只保存在内存中，所在目录不存在时自动创建
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS redirects (url TEXT PRIMARY KEY, target TEXT NOT NULL)")
+        self.redirects = dict(self.conn.execute("SELECT url, target FROM redirects").fetchall())
+        # 本次运行已经处理过的词条
+        self.claimed = set()
+        self.inputs = 0
+        self.duplicates = 0
+        self.redirect_duplicates = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        根据config.ini中的[CANONICAL]构造
+        """
+        return cls(config.get("CANONICAL", "index_file", fallback=None) or None)
+
+    def resolve(self, url: str) -> str:
+        """
+        :return: url规范化并沿已知重定向得到的目标url
+        """
+        url = canonicalize(url)
+        for _ in range(_MAX_REDIRECTS):
+            target = self.redirects.get(url)
+            if target is None:
+                break
+            url = target
+        return url
+
+    def claim(self, url: str) -> Optional[str]:
+        """
+        :return: url对应的词条第一次出现时返回规范化的url，否则返回None
+        """
+        url = self.resolve(url)
+        with self.lock:
+            self.inputs += 1
+            if url in self.claimed:
+                self.duplicates += 1
+                return None
+            self.claimed.add(url)
+        return url
+
+    def unique(self, items: Iterable, key: Optional[Callable] = None) -> Iterator:
+        """
+        过滤重复的词条
+        :param key: 从item中取url的函数，为None时item本身是url，返回规范化的url
+        """
+        for item in items:
+            url = self.claim(item if key is None else key(item))
+            if url is not None:
+                yield url if key is None else item
+
+    def learn(self, url: str, body: Optional[str]) -> bool:
+        """
+        从抓取到的网页中学习重定向：网页的canonical url与请求的url不同时记录url -> canonical url
+        :return: 该网页是否需要处理，是本次已经处理过的词条的重定向时返回False
+        """
+        if not body:
+            return True
+        link = find_canonical_link(url, body)
+        if link is None:
+            return True
+        source = self.resolve(url)
+        target = canonicalize(link)
+        # 只接受同一个host内的重定向，避免镜像或本地测试网页把url指向外部网站
+        if target == source or urlsplit(target).netloc != urlsplit(source).netloc:
+            return True
+        with self.lock:
+            self.redirects[source] = target
+            self.conn.execute("INSERT OR REPLACE INTO redirects (url, target) VALUES (?, ?)", (source, target))
+            self.conn.commit()
+            if target in self.claimed:
+                self.redirect_duplicates += 1
+                return False
+            self.claimed.add(target)
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            skipped = self.duplicates + self.redirect_duplicates
+            return {
+                "inputs": self.inputs,
+                "unique": self.inputs - skipped,
+                "duplicates": self.duplicates,
+                "redirect_duplicates": self.redirect_duplicates,
+                "dedup_ratio": skipped / self.inputs if self.inputs else 0.0,
+                "known_redirects": len(self.redirects),
+            }
+
+    def report(self) -> str:
+        s = self.stats()
+        return ("dedup: {inputs} urls, {unique} unique, {duplicates} duplicate spellings, "
+                "{redirect_duplicates} redirects to pages already processed, dedup ratio {dedup_ratio:.1%}, "
+                "{known_redirects} known redirects").format(**s)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+from typing import Iterable, Iterator, Optional
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlState:
+    """
+    保存在sqlite中的爬取状态：待爬的frontier、已爬的url、失败的url以及每个url所在的层数（BFS的迭代次数）。
+    每完成一个url就提交一次事务（标记完成与加入新链接在同一个事务中），
+    进程被杀掉后用同一个文件恢复即可从中断处继续，已完成的url不会被重复爬取
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                level INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS urls_level_status ON urls (level, status);
+        """)
+
+    def reset(self):
+        """
+        清空之前的状态，重新开始
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM urls")
+            self.conn.commit()
+
+    def add(self, urls: Iterable[str], level: int, status=PENDING) -> int:
+        """
+        把新发现的url加入frontier，已经存在的url（无论在哪一层、是否已完成）会被忽略
+        :return: 新加入的url数
+        """
+        with self.lock:
+            n = self._add(urls, level, status)
+            self.conn.commit()
+        return n
+
+    def complete(self, url: str, new_urls: Optional[Iterable[str]] = None, new_level: Optional[int] = None) -> int:
+        """
+        标记url已完成，并在同一个事务中把从该页面发现的链接加入下一层
+        :return: 新加入的url数
+        """
+        with self.lock:
+            self.conn.execute("UPDATE urls SET status = ?, error = NULL WHERE url = ?", (DONE, url))
+            n = 0
+            if new_urls is not None:
+                n = self._add(new_urls, new_level, PENDING)
+            self.conn.commit()
+        return n
+
+    def fail(self, url: str, error=None):
+        with self.lock:
+            self.conn.execute("UPDATE urls SET status = ?, error = ? WHERE url = ?", (FAILED, error, url))
+            self.conn.commit()
+
+    def _add(self, urls, level, status) -> int:
+        before = self.conn.total_changes
+        self.conn.executemany("INSERT OR IGNORE INTO urls (url, level, status) VALUES (?, ?, ?)",
+                              ((url, level, status) for url in urls))
+        return self.conn.total_changes - before
+
+    def pending(self, level: int) -> Iterator[str]:
+        """
+        某一层中尚未完成的url
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT url FROM urls WHERE level = ? AND status = ?",
+                                     (level, PENDING)).fetchall()
+        return (row[0] for row in rows)
+
+    def fail_pending(self, level: int, error=None):
+        """
+        一层爬完后仍未完成的url标记为失败
+        """
+        with self.lock:
+            self.conn.execute("UPDATE urls SET status = ?, error = ? WHERE level = ? AND status = ?",
+                              (FAILED, error, level, PENDING))
+            self.conn.commit()
+
+    def retry_failed(self):
+        """
+        把失败的url重新放回frontier
+        """
+        with self.lock:
+            self.conn.execute("UPDATE urls SET status = ?, error = NULL WHERE status = ?", (PENDING, FAILED))
+            self.conn.commit()
+
+    def current_level(self, min_level=0) -> Optional[int]:
+        """
+        不小于min_level且还有待爬url的最小层数，全部完成时返回None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(level) FROM urls WHERE status = ? AND level >= ?",
+                                    (PENDING, min_level)).fetchone()
+        return row[0]
+
+    def count(self, level: Optional[int] = None, status: Optional[str] = None) -> int:
+        sql = "SELECT COUNT(*) FROM urls WHERE 1 = 1"
+        args = []
+        if level is not None:
+            sql += " AND level = ?"
+            args.append(level)
+        if status is not None:
+            sql += " AND status = ?"
+            args.append(status)
+        with self.lock:
+            return self.conn.execute(sql, args).fetchone()[0]
+
+    def urls(self, level: Optional[int] = None) -> Iterator[str]:
+        """
+        所有已知的url，level不为None时只返回该层的url
+        """
+        cursor = self.conn.cursor()
+        if level is None:
+            cursor.execute("SELECT url FROM urls")
+        else:
+            cursor.execute("SELECT url FROM urls WHERE level = ?", (level,))
+        for row in cursor:
+            yield row[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,112 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_CACHE_SIZE = 100000
+
+# 与查询结果None（词条不存在）区分
+MISSING = object()
+
+# [ENTITY]中cache_file为相对路径时相对于仓库根目录，在其他目录中运行时使用同一个缓存
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class EntityNameStore:
+    """
+    关键词 -> 百科词条名查询结果的缓存：内存中的LRU加上sqlite中的持久记录。
+    结果可以是词条名、消歧义的{关键词: [释义]}或None（词条不存在），超过ttl后重新查询。
+    内存命中只是一次dict查找，sqlite命中后放入LRU。
+    sqlite文件在第一次查询时才打开，不查询词条名的spider（如解析进程中的）不会打开它
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param path: sqlite文件路径，为None时只缓存在内存中，所在目录不存在时自动创建
+        :param ttl: 查询结果的有效期（秒）
+        :param cache_size: 内存LRU的最大条数
+        """
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.closed = False
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        根据config.ini中的[ENTITY]构造
+        """
+        path = config.get("ENTITY", "cache_file", fallback=None) or None
+        if path is not None:
+            path = os.path.join(_ROOT_DIR, path)
+        return cls(path,
+                   ttl=config.getint("ENTITY", "ttl", fallback=DEFAULT_TTL),
+                   cache_size=config.getint("ENTITY", "cache_size", fallback=DEFAULT_CACHE_SIZE))
+
+    def get(self, keyword: str):
+        """
+        :return: 未过期的查询结果，没有时返回MISSING
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.cache.get(keyword)
+            if entry is not None:
+                result, resolved_at = entry
+                if now - resolved_at < self.ttl:
+                    self.cache.move_to_end(keyword)
+                    return result
+                del self.cache[keyword]
+            conn = self._connect()
+            if conn is None:
+                return MISSING
+            row = conn.execute("SELECT result, resolved_at FROM names WHERE keyword = ?", (keyword,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                return MISSING
+            result = json.loads(row[0])
+            self._put(keyword, result, row[1])
+            return result
+
+    def put(self, keyword: str, result, resolved_at: Optional[float] = None):
+        resolved_at = time.time() if resolved_at is None else resolved_at
+        with self.lock:
+            self._put(keyword, result, resolved_at)
+            conn = self._connect()
+            if conn is not None:
+                conn.execute("INSERT OR REPLACE INTO names (keyword, result, resolved_at) VALUES (?, ?, ?)",
+                             (keyword, json.dumps(result, ensure_ascii=False), resolved_at))
+                conn.commit()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """
+        需要在持有lock时调用
+        :return: sqlite连接，只缓存在内存中或已经close时返回None
+        """
+        if self.conn is None and self.path is not None and not self.closed:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS names (keyword TEXT PRIMARY KEY, result TEXT, "
+                              "resolved_at REAL NOT NULL)")
+        return self.conn
+
+    def _put(self, keyword: str, result, resolved_at: float):
+        self.cache[keyword] = (result, resolved_at)
+        self.cache.move_to_end(keyword)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
@@ -0,0 +1,34 @@
+import concurrent.futures
+from typing import Callable, Iterable, Iterator
+
+from spider.metrics import metrics
+
+
+def imap_unordered(fn: Callable, iterable: Iterable, max_workers: int, max_pending=None) -> Iterator:
+    """
+    用线程池对iterable中的每个元素调用fn，按完成顺序返回结果。
+    与一次性submit所有任务不同，同时存在的future不超过max_pending个，
+    已返回的结果不再被引用，因此内存占用与任务总数无关
+    :param fn: 单参数函数
+    :param max_workers: 线程数
+    :param max_pending: 同时提交的最大任务数，默认为线程数的2倍
+    """
+    if max_pending is None:
+        max_pending = max_workers * 2
+    iterator = iter(iterable)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for item in iterator:
+            pending.add(executor.submit(fn, item))
+            metrics.add("spider_inflight", 1, pool="thread")
+            if len(pending) >= max_pending:
+                break
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            metrics.add("spider_inflight", -len(done), pool="thread")
+            for future in done:
+                for item in iterator:
+                    pending.add(executor.submit(fn, item))
+                    metrics.add("spider_inflight", 1, pool="thread")
+                    break
+                yield future.result()
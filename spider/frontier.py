@@ -0,0 +1,99 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from spider.canonical import CanonicalIndex
+from spider.crawl_state import CrawlState
+
+
+class Frontier:
+    """
+    按层推进的BFS frontier。
+    url先经CanonicalIndex规范化并沿已知重定向找到目标词条，所有见过的url保存在内存的set中，
+    去重是O(1)的，同一个词条的各种写法只会被加入frontier一次；
+    传入CrawlState时，只有去重后新出现的url才会写入sqlite，用于中断后恢复
+    """
+
+    def __init__(self, state: Optional[CrawlState] = None, index: Optional[CanonicalIndex] = None):
+        """
+        :param index: 规范化url与重定向的索引，为None时只做规范化
+        """
+        self.state = state
+        self.index = index if index is not None else CanonicalIndex()
+        self.seen = self.index.claimed
+        self.levels: Dict[int, List[str]] = {}
+        self.level = 0
+        self.lock = threading.Lock()
+
+    def restore(self):
+        """
+        从state中恢复已见过的url与各层尚未完成的url
+        """
+        self.seen.update(self.index.resolve(url) for url in self.state.urls())
+        level = self.state.current_level()
+        while level is not None:
+            self.levels[level] = list(self.state.pending(level))
+            level = self.state.current_level(level + 1)
+
+    def seed(self, urls: Iterable[str], level=0) -> int:
+        """
+        加入初始url
+        :return: 新加入的url数
+        """
+        with self.lock:
+            new_urls = self._dedup(urls)
+            if self.state is not None:
+                self.state.add(new_urls, level)
+            self.levels.setdefault(level, []).extend(new_urls)
+        return len(new_urls)
+
+    def complete(self, url: str, links: Optional[Iterable[str]] = None, level: Optional[int] = None) -> int:
+        """
+        标记url已完成，把其中新出现的链接加入下一层
+        :param level: 链接所在的层数，默认为当前层的下一层
+        :return: 新加入的url数
+        """
+        if level is None:
+            level = self.level + 1
+        with self.lock:
+            new_urls = self._dedup(links or [])
+            if self.state is not None:
+                self.state.complete(url, new_urls, level)
+            if new_urls:
+                self.levels.setdefault(level, []).extend(new_urls)
+        return len(new_urls)
+
+    def fail(self, url: str, error=None):
+        if self.state is not None:
+            self.state.fail(url, error)
+
+    def pop_level(self, max_level=None) -> Tuple[int, List[str]]:
+        """
+        取出下一个非空层的全部url，没有待爬的url（或超过max_level）时返回的list为空
+        """
+        with self.lock:
+            while self.levels:
+                level = min(self.levels)
+                if max_level is not None and level > max_level:
+                    break
+                urls = self.levels.pop(level)
+                if urls:
+                    self.level = level
+                    return level, urls
+            return self.level, []
+
+    def count(self, level: int) -> int:
+        return len(self.levels.get(level, []))
+
+    def _dedup(self, urls: Iterable[str]) -> List[str]:
+        new_urls = []
+        for url in urls:
+            url = self.index.claim(url)
+            if url is not None:
+                new_urls.append(url)
+        return new_urls
+
+    def __len__(self):
+        return len(self.seen)
+
+    def __iter__(self):
+        return iter(self.seen)
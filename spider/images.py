@@ -0,0 +1,132 @@
+import concurrent.futures
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from spider.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_wiki_thumb_regex = re.compile(r"^(//upload\.wikimedia\.org/[^?#]+?)/thumb(/[0-9a-f]/[0-9a-f]{2}/[^/]+)/[^/]+$")
+_wiki_original_regex = re.compile(r"^//upload\.wikimedia\.org/[^?#]+/[0-9a-f]/[0-9a-f]{2}/[^/]+$")
+
+_MISSING = object()
+
+
+def derive_wiki_image_url(thumb_src: str) -> Optional[str]:
+    """
+    由Wikipedia缩略图地址直接得到原图地址，不需要再请求File:页面，例如
+    //upload.wikimedia.org/wikipedia/commons/thumb/6/6b/A.jpg/300px-A.jpg
+    -> https://upload.wikimedia.org/wikipedia/commons/6/6b/A.jpg
+    :param thumb_src: 缩略图img标签的src
+    :return: 原图地址，不能推出时返回None
+    """
+    m = _wiki_thumb_regex.match(thumb_src)
+    if m is not None:
+        return "https:" + m.group(1) + m.group(2)
+    if "/thumb/" not in thumb_src and _wiki_original_regex.match(thumb_src):  # 按原尺寸显示的图片
+        return "https:" + thumb_src
+    return None
+
+
+class ImageResolver:
+    """
+    把词条页面中的图片页面链接批量解析为图片文件地址：
+    能从缩略图地址推出原图地址的不发请求，其余图片页面并发请求，
+    图片页面到图片地址的对应关系在不同词条之间共享缓存。
+    只缓存确定的结果（图片地址或页面中没有图片），请求失败的图片页面不缓存，下次遇到时重新请求
+    """
+
+    def __init__(self, session, extract: Callable[[str], Optional[str]],
+                 derive: Optional[Callable[[str], Optional[str]]] = None, workers=8, max_entries=100000):
+        """
+        :param session: SpiderSession
+        :param extract: 从图片页面的html中提取图片地址，找不到时返回None
+        :param derive: 从缩略图地址推出图片地址，不能推出时返回None
+        :param workers: 并发请求图片页面的线程数
+        :param max_entries: 缓存的最大条数，超过后淘汰最久未使用的
+        """
+        self.session = session
+        self.extract = extract
+        self.derive = derive
+        self.workers = workers
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def resolve(self, refs: List[Tuple[str, Optional[str]]]) -> List[str]:
+        """
+        :param refs: (图片页面url, 缩略图地址)的list，缩略图地址可以为None
+        :return: 按refs顺序排列的图片地址，无法解析的图片被跳过
+        """
+        with metrics.stage("image"):
+            return self._resolve(refs)
+
+    def _resolve(self, refs: List[Tuple[str, Optional[str]]]) -> List[str]:
+        results = [None] * len(refs)
+        to_fetch = {}
+        for i, (page_url, thumb_src) in enumerate(refs):
+            if self.derive is not None and thumb_src:
+                derived = self.derive(thumb_src)
+                if derived is not None:
+                    metrics.inc("spider_images_total", source="derived")
+                    results[i] = derived
+                    continue
+            cached = self._get(page_url)
+            if cached is not _MISSING:
+                metrics.inc("spider_images_total", source="cache")
+                results[i] = cached
+            else:
+                to_fetch.setdefault(page_url, []).append(i)
+
+        if to_fetch:
+            metrics.inc("spider_images_total", len(to_fetch), source="fetched")
+            executor = self._get_executor()
+            futures = {executor.submit(self._fetch, page_url): page_url for page_url in to_fetch}
+            for future in concurrent.futures.as_completed(futures):
+                page_url = futures[future]
+                ok, image_url = future.result()
+                if not ok:
+                    metrics.inc("spider_images_total", source="failed")
+                    continue
+                self._put(page_url, image_url)
+                for i in to_fetch[page_url]:
+                    results[i] = image_url
+        return [r for r in results if r is not None]
+
+    def _fetch(self, page_url: str) -> Tuple[bool, Optional[str]]:
+        """
+        :return: (是否得到了确定的结果, 图片地址)，图片页面下载失败时为(False, None)，
+                 页面中没有图片时为(True, None)
+        """
+        try:
+            body = self.session.get_text(page_url)
+            if body is None:
+                logger.warning("failed to resolve image: {}, err:page not fetched".format(page_url))
+                return False, None
+            return True, self.extract(body)
+        except Exception as e:
+            logger.warning("failed to resolve image: {}, err:{}".format(page_url, e))
+            return False, None
+
+    def _get(self, page_url: str):
+        with self.lock:
+            if page_url not in self.cache:
+                return _MISSING
+            self.cache.move_to_end(page_url)
+            return self.cache[page_url]
+
+    def _put(self, page_url: str, image_url: Optional[str]):
+        with self.lock:
+            self.cache[page_url] = image_url
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            return self.executor
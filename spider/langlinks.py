@@ -0,0 +1,139 @@
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from spider.executor import imap_unordered
+
+logger = logging.getLogger(__name__)
+
+# 非bot账号每次query最多50个titles
+MAX_TITLES = 50
+
+
+def api_url_for(page_url: str) -> str:
+    """
+    词条url所在wiki的api地址，如https://ja.wikipedia.org/wiki/X -> https://ja.wikipedia.org/w/api.php
+    """
+    parts = urlsplit(page_url)
+    return "{}://{}/w/api.php".format(parts.scheme, parts.netloc)
+
+
+def title_from_url(page_url: str) -> str:
+    path = urlsplit(page_url).path
+    if not path.startswith("/wiki/"):
+        raise ValueError("not a wiki page url: {}".format(page_url))
+    return unquote(path[len("/wiki/"):])
+
+
+class LanglinksClient:
+    """
+    通过MediaWiki的action=query&prop=langlinks批量获取词条的跨语言链接，
+    每个请求最多查询batch_size个词条，不需要下载和解析词条网页
+    """
+
+    def __init__(self, session, batch_size=MAX_TITLES):
+        """
+        :param session: SpiderSession
+        :param batch_size: 每个请求查询的词条数，不超过50
+        """
+        self.session = session
+        self.batch_size = min(batch_size, MAX_TITLES)
+
+    def query(self, api_url: str, titles: List[str], lang: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+        """
+        查询一批词条的跨语言链接，会跟随continue取完所有结果
+        :param api_url: wiki的api地址
+        :param titles: 词条名，最多batch_size个
+        :param lang: 只查询该语言代码的链接，为None时查询所有语言
+        :return: key为传入的词条名，value为{语言代码: 链接url}，不存在的词条不在结果中
+        """
+        params = {
+            "action": "query",
+            "prop": "langlinks",
+            "llprop": "url",
+            "lllimit": "max",
+            "redirects": "1",
+            "format": "json",
+            "formatversion": "2",
+            "titles": "|".join(titles),
+        }
+        if lang is not None:
+            params["lllang"] = lang
+        links = {}
+        alias = {}
+        while True:
+            r = self.session.post(api_url, data=params)
+            r.raise_for_status()
+            data = r.json()
+            if "error" in data:
+                raise RuntimeError("api error: {}".format(data["error"]))
+            query = data.get("query", {})
+            for key in ("normalized", "redirects"):
+                for item in query.get(key, []):
+                    alias[item["from"]] = item["to"]
+            for page in query.get("pages", []):
+                if page.get("missing") or page.get("invalid"):
+                    continue
+                page_links = links.setdefault(page["title"], {})
+                for link in page.get("langlinks", []):
+                    page_links[link["lang"]] = link["url"]
+            if "continue" not in data:
+                break
+            params.update(data["continue"])
+
+        result = {}
+        for title in titles:
+            target = title
+            seen = set()
+            while target in alias and target not in seen:  # 先规范化再重定向
+                seen.add(target)
+                target = alias[target]
+            if target in links:
+                result[title] = links[target]
+        return result
+
+    def align(self, urls: Iterable[str], langs: Optional[List[str]] = None, workers=8) \
+            -> Iterator[Tuple[str, Dict[str, str]]]:
+        """
+        查询词条url的跨语言链接，按词条所在wiki分批并发请求。
+        每种语言单独查询一次：不限定语言时每个词条有上百个链接，需要多次continue才能取完
+        :param urls: 词条url，可以来自不同的wiki
+        :param langs: 要查询的语言代码，为None时查询所有语言
+        :param workers: 同时进行的请求数
+        :return: (词条url, {语言代码: 链接url})，顺序与输入不一致，查询失败、不存在的词条与不是词条页面的url被跳过
+        """
+        def run(batch):
+            api_url, batch_items = batch
+            titles = [title for url, title in batch_items]
+            unique_titles = list(dict.fromkeys(titles))
+            links = {}
+            try:
+                for lang in langs or [None]:
+                    for title, title_links in self.query(api_url, unique_titles, lang).items():
+                        links.setdefault(title, {}).update(title_links)
+            except Exception as e:
+                logger.warning("failed to query langlinks from {}, err:{}".format(api_url, e))
+                return []
+            return [(url, links[title]) for url, title in batch_items if title in links]
+
+        for results in imap_unordered(run, self._batches(urls), workers):
+            yield from results
+
+    def _batches(self, urls: Iterable[str]) -> Iterator[Tuple[str, List[Tuple[str, str]]]]:
+        """
+        :return: (api地址, [(词条url, 词条名)])，不是词条页面的url记录日志后跳过
+        """
+        pending = {}
+        for url in urls:
+            try:
+                title = title_from_url(url)
+            except ValueError as e:
+                logger.warning("skip langlinks query: {}".format(e))
+                continue
+            api_url = api_url_for(url)
+            batch = pending.setdefault(api_url, [])
+            batch.append((url, title))
+            if len(batch) == self.batch_size:
+                yield api_url, pending.pop(api_url)
+        for api_url, batch in pending.items():
+            yield api_url, batch
@@ -0,0 +1,242 @@
+import html
+import json
+import os
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from spider.ratelimit import TokenBucket
+
+_langlink_regex = re.compile(r'<a href="([^"]+)" title="([^"]*?) – [^"]*" lang="([^"]+)" hreflang="[^"]+" '
+                             r'class="interlanguage-link-target">')
+
+# MediaWiki api中lllimit的默认值与最大值
+_LANGLINKS_DEFAULT_LIMIT = 10
+_LANGLINKS_MAX_LIMIT = 500
+
+
+class LocalWikiServer:
+    """
+    在本地模拟Wikipedia，把data/wikiPages中的网页以/wiki/<title>的形式提供出来，
+    /w/api.php模拟action=query&prop=langlinks（数据取自网页中的p-lang），
+    用于在不访问外网的情况下测试spider，例如：
+
+        with LocalWikiServer() as server:
+            s.get_web_content(server.url_for("M16突击步枪"))
+    """
+
+    def __init__(self, page_dir="data/wikiPages", host="127.0.0.1", port=0, latency=0.0, rate_limit=None,
+                 retry_after=1, prefix="/wiki/"):
+        """
+        :param page_dir: 网页文件所在目录，文件名为<title>.html
+        :param port: 为0时自动选择空闲端口
+        :param latency: 每个请求的模拟延迟（秒）
+        :param rate_limit: 模拟服务端限流，每秒最多处理的请求数，超过时返回429
+        :param retry_after: 429响应中Retry-After的秒数
+        :param prefix: 网页的路径前缀，模拟百度百科时为/item/
+        """
+        self.page_dir = page_dir
+        self.prefix = prefix
+        self.latency = latency
+        self.bucket = TokenBucket(rate_limit, rate_limit) if rate_limit else None
+        self.retry_after = retry_after
+        self.throttled_count = 0
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+        # 收到的请求数与返回的字节数，用于检查缓存等是否生效
+        self.request_count = 0
+        self.bytes_sent = 0
+        # 同时在处理的请求数及其最大值，用于检查客户端的并发度
+        self.inflight = 0
+        self.max_inflight = 0
+        self.lock = threading.Lock()
+        self.langlinks_cache = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def url_for(self, title: str) -> str:
+        return self.base_url + self.prefix + title
+
+    @property
+    def api_url(self) -> str:
+        return self.base_url + "/w/api.php"
+
+    def page_urls(self):
+        return [self.url_for(f[:-len(".html")]) for f in sorted(os.listdir(self.page_dir)) if f.endswith(".html")]
+
+    def handle_counted(self, handler: BaseHTTPRequestHandler):
+        with self.lock:
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            self.handle(handler)
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        with self.lock:
+            self.request_count += 1
+            throttled = self.bucket is not None and self.bucket.reserve(time.monotonic()) > 0
+            if throttled:
+                self.throttled_count += 1
+        if throttled:
+            handler.send_response(429)
+            handler.send_header("Retry-After", str(self.retry_after))
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        path = unquote(urlsplit(handler.path).path)
+        if path == "/w/api.php":
+            self.handle_api(handler)
+            return
+        if not path.startswith(self.prefix):
+            handler.send_error(404)
+            return
+        file_path = os.path.join(self.page_dir, path[len(self.prefix):] + ".html")
+        if not os.path.isfile(file_path):
+            handler.send_error(404)
+            return
+        stat = os.stat(file_path)
+        etag = '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        if handler.headers.get("If-None-Match") == etag:
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        with open(file_path, "rb") as f:
+            body = f.read()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/html; charset=UTF-8")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("ETag", etag)
+        handler.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self.lock:
+            self.bytes_sent += len(body)
+
+    def handle_api(self, handler: BaseHTTPRequestHandler):
+        query = urlsplit(handler.path).query
+        if handler.command == "POST":
+            length = int(handler.headers.get("Content-Length") or 0)
+            query = handler.rfile.read(length).decode("utf-8")
+        params = {k: v[-1] for k, v in parse_qs(query, keep_blank_values=True).items()}
+        if params.get("action") != "query" or params.get("prop") != "langlinks":
+            result = {"error": {"code": "badparams", "info": "only action=query&prop=langlinks is supported"}}
+        else:
+            result = self.query_langlinks(params)
+        body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self.lock:
+            self.bytes_sent += len(body)
+
+    def query_langlinks(self, params: dict) -> dict:
+        """
+        按MediaWiki formatversion=2的格式返回langlinks，结果超过lllimit时返回llcontinue
+        """
+        limit = params.get("lllimit", str(_LANGLINKS_DEFAULT_LIMIT))
+        limit = _LANGLINKS_MAX_LIMIT if limit == "max" else min(int(limit), _LANGLINKS_MAX_LIMIT)
+        lang = params.get("lllang")
+        start_page, start_link = 0, 0
+        if "llcontinue" in params:
+            start_page, start_link = (int(x) for x in params["llcontinue"].split("|"))
+
+        normalized = []
+        pages = []
+        remaining = limit
+        next_continue = None
+        for page_index, title in enumerate(params.get("titles", "").split("|")):
+            if "_" in title:
+                normalized.append({"fromencoded": False, "from": title, "to": title.replace("_", " ")})
+                title = title.replace("_", " ")
+            links = self._page_langlinks(title)
+            if links is None:
+                pages.append({"ns": 0, "title": title, "missing": True})
+                continue
+            page = {"pageid": page_index + 1, "ns": 0, "title": title}
+            pages.append(page)
+            if page_index < start_page or next_continue is not None:
+                continue
+            links = [link for link in links if lang is None or link["lang"] == lang]
+            offset = start_link if page_index == start_page else 0
+            if links[offset:] and remaining == 0:
+                next_continue = "{}|{}".format(page_index, offset)
+            elif links[offset:]:
+                page["langlinks"] = links[offset:offset + remaining]
+                remaining -= len(page["langlinks"])
+                if offset + len(page["langlinks"]) < len(links):
+                    next_continue = "{}|{}".format(page_index, offset + len(page["langlinks"]))
+
+        result = {"batchcomplete": next_continue is None, "query": {"pages": pages}}
+        if normalized:
+            result["query"]["normalized"] = normalized
+        if next_continue is not None:
+            result["continue"] = {"llcontinue": next_continue, "continue": "||"}
+        return result
+
+    def _page_langlinks(self, title: str):
+        with self.lock:
+            if title in self.langlinks_cache:
+                return self.langlinks_cache[title]
+        file_path = None
+        for name in (title, title.replace(" ", "_")):
+            path = os.path.join(self.page_dir, name + ".html")
+            if os.path.isfile(path):
+                file_path = path
+                break
+        links = None
+        if file_path is not None:
+            with open(file_path, encoding="utf-8") as f:
+                body = f.read()
+            links = [{"lang": lang, "url": html.unescape(href), "title": html.unescape(link_title)}
+                     for href, link_title, lang in _langlink_regex.findall(body)]
+        with self.lock:
+            self.langlinks_cache[title] = links
+        return links
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle_counted(self)
+
+            def do_POST(self):
+                server.handle_counted(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,357 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_help = {
+    "spider_stage_seconds": "time spent in each stage (fetch, ttfb, parse, extract, image, write)",
+    "spider_requests_total": "http responses by host and status",
+    "spider_bytes_total": "response body bytes downloaded by host",
+    "spider_errors_total": "errors by stage and exception class",
+    "spider_cache_total": "response cache lookups by result",
+    "spider_records_total": "records written to output files",
+    "spider_images_total": "image urls resolved by source",
+    "spider_inflight": "submitted tasks that have not completed yet",
+    "spider_queue_depth": "fetched pages waiting to be parsed",
+}
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        按桶估计分位数，返回该分位数所在桶的上界
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for i, c in enumerate(self.counts):
+            total += c
+            if total >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class _Stage:
+    """
+    metrics.stage()返回的计时器，退出时记录耗时，出现异常时按异常类型计数
+    """
+    __slots__ = ("metrics", "labels", "start")
+
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe("spider_stage_seconds", time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            self.metrics.inc("spider_errors_total", error=exc_type.__name__, **self.labels)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class Metrics:
+    """
+    进程内的计数器、gauge与耗时直方图，按(名称, labels)区分。
+    每次记录只是在锁内更新一个dict，相对于网络请求与html解析的耗时可以忽略；
+    enabled为False时所有记录直接返回
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.enabled = True
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+
+    def inc(self, name: str, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name: str, delta, **labels):
+        """
+        gauge加上delta，用于在途任务数等可增可减的值
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def set(self, name: str, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def stage(self, stage: str, **labels):
+        """
+        统计一个阶段的耗时与异常，例如：
+
+            with metrics.stage("parse"):
+                doc = parser.parse(body)
+        """
+        if not self.enabled:
+            return _null_stage
+        labels["stage"] = stage
+        return _Stage(self, labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.start_time = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        :return: 可以json序列化的当前统计
+        """
+        with self.lock:
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+            histograms = [(key, h.count, h.sum, h.quantile(0.5), h.quantile(0.95), list(h.counts))
+                          for key, h in self.histograms.items()]
+        uptime = time.time() - self.start_time
+        r = {"time": time.time(), "uptime": uptime, "counters": {}, "gauges": {}, "histograms": {}}
+        for (name, labels), value in counters:
+            r["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value,
+                                                       "rate": value / uptime if uptime > 0 else None})
+        for (name, labels), value in gauges:
+            r["gauges"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), count, total, p50, p95, counts in histograms:
+            r["histograms"].setdefault(name, []).append({
+                "labels": dict(labels), "count": count, "sum": total,
+                "mean": total / count if count else None, "p50": p50, "p95": p95,
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+            })
+        return r
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Prometheus text exposition格式的统计
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, h.count, h.sum, list(h.counts)) for key, h in self.histograms.items())
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in _help:
+                    lines.append("# HELP {} {}".format(name, _help[name]))
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        for (name, labels), count, total, counts in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, c in zip([repr(b) for b in self.buckets] + ["+Inf"], counts):
+                cumulative += c
+                lines.append("{}_bucket{} {}".format(name, _format_labels(labels + (("le", bound),)), cumulative))
+            lines.append("{}_sum{} {}".format(name, _format_labels(labels), total))
+            lines.append("{}_count{} {}".format(name, _format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for k, v in labels) + "}"
+
+
+# 整个进程共用的统计，各模块直接引用
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """
+    定期把metrics以json写入dump_file并在日志中输出进度，
+    port不为None时同时在http://host:port/metrics提供Prometheus格式、在/stats提供json格式的统计
+    """
+
+    def __init__(self, registry: Metrics = metrics, dump_file=None, dump_interval=30, port=None, host="127.0.0.1"):
+        """
+        :param dump_file: json统计文件，为None时不写文件
+        :param dump_interval: 写文件与输出进度的间隔（秒）
+        :param port: http端口，为None时不提供http接口，为0时自动选择空闲端口
+        """
+        self.registry = registry
+        self.dump_file = dump_file
+        self.dump_interval = dump_interval
+        self.port = port
+        self.host = host
+        self.server = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, config, registry: Metrics = metrics):
+        """
+        根据config.ini中的[METRICS]构造，同时设置registry是否启用
+        """
+        enabled = config.getboolean("METRICS", "enabled", fallback=True)
+        registry.enabled = enabled
+        if not enabled:
+            return cls(registry)
+        # port与构造参数的含义相同：留空为不提供http接口，0为自动选择空闲端口
+        port = config.get("METRICS", "port", fallback="").strip()
+        return cls(registry,
+                   dump_file=config.get("METRICS", "dump_file", fallback=None) or None,
+                   dump_interval=config.getfloat("METRICS", "dump_interval", fallback=30),
+                   port=int(port) if port else None)
+
+    @property
+    def url(self) -> Optional[str]:
+        if self.server is None:
+            return None
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def dump(self):
+        snapshot = self.registry.snapshot()
+        if self.dump_file is not None:
+            tmp_file = self.dump_file + ".tmp"
+            if os.path.dirname(self.dump_file):
+                os.makedirs(os.path.dirname(self.dump_file), exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_file, self.dump_file)
+        logger.info(self._progress(snapshot))
+
+    @staticmethod
+    def _progress(snapshot) -> str:
+        def total(name):
+            return sum(item["value"] for item in snapshot["counters"].get(name, []))
+
+        uptime = snapshot["uptime"]
+        requests = total("spider_requests_total")
+        return "progress: {:.0f}s, {} requests ({:.1f}/s), {:.1f} MB, {} records, {} errors".format(
+            uptime, requests, requests / uptime if uptime > 0 else 0, total("spider_bytes_total") / 1024 / 1024,
+            total("spider_records_total"), total("spider_errors_total"))
+
+    def start(self):
+        if not self.registry.enabled:
+            return self
+        if self.port is not None:
+            self.server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logger.info("metrics endpoint: {}/metrics".format(self.url))
+        if self.dump_interval:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.wait(self.dump_interval):
+            try:
+                self.dump()
+            except Exception as e:
+                logger.warning("failed to dump metrics: {}".format(e))
+
+    def stop(self):
+        if not self.registry.enabled:
+            return
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.dump()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _make_handler(self):
+        reporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body = reporter.registry.to_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path.startswith("/stats"):
+                    body = json.dumps(reporter.registry.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,126 @@
+import re
+from functools import lru_cache
+from typing import Callable, Optional
+
+DEFAULT_CACHE_SIZE = 65536
+
+# 引用标记，如[1]、[12]、[]
+_citation_pattern = r"\[\d*\]"
+
+# Wikipedia infobox中混进文本的样式代码
+_css_noise = (
+    ".mw-parser-output",
+    ".geo-default",
+    ".geo-dms",
+    ".geo-nondefault",
+    ".longitude",
+    ".latitude",
+    ".geo-dec",
+    ".geo-multi-punct",
+    "{display:inline}",
+    "{display:none}",
+    "{white-space:nowrap}",
+)
+
+# 一次匹配所有需要删除的内容，长的在前，保证.geo-default不会只删掉前缀
+_value_regex = re.compile("|".join([re.escape(s) for s in sorted(_css_noise, key=len, reverse=True)] +
+                                   [_citation_pattern]))
+_citation_regex = re.compile(_citation_pattern)
+
+
+def load_converter(config: str = "t2s") -> Callable[[str], str]:
+    """
+    加载opencc的繁简转换，兼容opencc与opencc-python-reimplemented两个包
+    :param config: opencc的转换配置，t2s为繁体到简体
+    """
+    import opencc
+    try:
+        converter = opencc.OpenCC(config)
+    except Exception:
+        converter = opencc.OpenCC(config + ".json")
+    return converter.convert
+
+
+WIKI = "wiki"
+BAIDU = "baidu"
+
+
+class Normalizer:
+    """
+    两个spider共用的文本规范化，需要时转换为简体中文。
+    wiki profile一次正则扫描删除infobox中的引用标记与样式代码，再去掉首尾空白；
+    baidu profile的属性表格中没有这些内容，key与value都只去掉首尾的换行符。
+    infobox中的值大量重复，规范化与繁简转换的结果都按字符串缓存
+    """
+
+    def __init__(self, to_simplified=False, cache_size=DEFAULT_CACHE_SIZE,
+                 converter: Optional[Callable[[str], str]] = None, profile=WIKI):
+        """
+        :param to_simplified: 是否把繁体中文转换为简体，需要安装opencc
+        :param cache_size: 每种缓存的最大条数
+        :param converter: 自定义的繁简转换函数，为None时使用opencc
+        :param profile: WIKI或BAIDU，决定infobox的key与value的清理方式
+        """
+        if profile not in (WIKI, BAIDU):
+            raise ValueError("unknown normalizer profile: {}".format(profile))
+        self.profile = profile
+        if to_simplified and converter is None:
+            converter = load_converter()
+        self.converter = converter if to_simplified else None
+        if self.converter is not None:
+            self.convert = lru_cache(maxsize=cache_size)(self.converter)
+        else:
+            self.convert = _identity
+        self.normalize_key = lru_cache(maxsize=cache_size)(self._normalize_key)
+        self.normalize_value = lru_cache(maxsize=cache_size)(self._normalize_value)
+
+    @classmethod
+    def from_config(cls, config, profile=WIKI):
+        """
+        根据config.ini中的[NORMALIZE]构造
+        """
+        return cls(to_simplified=config.getboolean("NORMALIZE", "to_simplified", fallback=False),
+                   cache_size=config.getint("NORMALIZE", "cache_size", fallback=DEFAULT_CACHE_SIZE),
+                   profile=profile)
+
+    def _normalize_key(self, key: str) -> str:
+        if self.profile == BAIDU:
+            return self.convert(key.strip("\n"))
+        return self.convert(key.strip())
+
+    def _normalize_value(self, value: str) -> str:
+        if self.profile == BAIDU:
+            return self.convert(value.strip("\n"))
+        r = _value_regex.sub("", value)
+        return self.convert(r.replace(" ,", "").strip().lstrip(","))
+
+    def normalize_text(self, text: str) -> str:
+        """
+        正文只删除引用标记并转换繁简，不做缓存
+        """
+        text = _citation_regex.sub("", text)
+        if self.converter is None:
+            return text
+        return self.converter(text)
+
+    def normalize_info(self, info: dict) -> dict:
+        """
+        规范化infobox的所有key与value
+        """
+        return {self.normalize_key(k): self.normalize_value(v) for k, v in info.items()}
+
+    def normalize_record(self, record):
+        """
+        规范化已有结果中的所有字符串，用于转换以前输出的繁体结果
+        """
+        if isinstance(record, str):
+            return self.normalize_text(record)
+        if isinstance(record, list):
+            return [self.normalize_record(x) for x in record]
+        if isinstance(record, dict):
+            return {self.normalize_record(k): self.normalize_record(v) for k, v in record.items()}
+        return record
+
+
+def _identity(s: str) -> str:
+    return s
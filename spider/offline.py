@@ -0,0 +1,186 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from typing import Iterator, List, Optional, Tuple
+
+from spider.archive import open_archive, split_locator
+from spider.output import open_writer
+from spider.parser import LxmlBackend
+from spider.pipeline import config_to_dict, get_worker_spider, init_worker
+
+logger = logging.getLogger(__name__)
+
+
+def extract_file(path: str) -> Tuple[str, str, Optional[str], Optional[str]]:
+    """
+    在解析进程中提取一个本地网页文件
+    :param path: 文件路径，或归档中网页的<归档文件>#<title>
+    :return: (文件路径, 文件内容的sha1, json格式的提取结果, 错误信息)，读取失败时sha1为空字符串
+    """
+    digest = ""
+    try:
+        locator = split_locator(path)
+        if locator is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            text = open_archive(locator[0]).get(locator[1])
+            if text is None:
+                raise ValueError("not in archive: {}".format(locator[1]))
+            data = text.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        r = get_worker_spider('offline').process_body(data.decode('utf-8'))
+    except Exception as e:
+        return path, digest, None, "{}: {}".format(type(e).__name__, e)
+    return path, digest, json.dumps(r, ensure_ascii=False), None
+
+
+def source_of(path: str) -> str:
+    """
+    :return: 文件所在的目录，或归档中网页所在的归档文件
+    """
+    locator = split_locator(path)
+    return os.path.dirname(path) if locator is None else locator[0]
+
+
+def extractor_key(config, spider_cls, spider_args: tuple) -> str:
+    """
+    决定提取结果的所有设置：spider的extractor_version与构造参数（如语言）、html解析后端、是否转换为简体，
+    其中任何一个变化后以前的提取结果都不再有效
+    """
+    return json.dumps({
+        "spider": spider_cls.__name__,
+        "version": spider_cls.extractor_version,
+        "args": list(spider_args),
+        "parser": config.get("PARSER", "backend", fallback=LxmlBackend.name),
+        "to_simplified": config.getboolean("NORMALIZE", "to_simplified", fallback=False),
+    }, ensure_ascii=False, sort_keys=True)
+
+
+class OfflineExtractor:
+    """
+    增量提取本地网页文件（如data/wikiPages）或归档中的网页。
+    manifest记录每个文件的大小、修改时间、sha1、提取时的设置（extractor_key）以及提取结果或错误信息，
+    只有新增或内容变化的文件、以及extractor版本、解析后端或繁简转换等设置变化后才会重新解析，解析按chunk分给多个进程
+    """
+
+    def __init__(self, config, spider_cls, spider_args: tuple, manifest_path: str):
+        """
+        :param spider_cls: 用于解析的spider类，需要有process_body方法与extractor_version属性，
+                           extractor_version或extractor_key中的其他设置变化后所有文件都会重新解析
+        :param spider_args: 除config外的构造参数
+        :param manifest_path: manifest的sqlite文件
+        """
+        self.config = config
+        self.spider_spec = (spider_cls, spider_args)
+        self.extractor_version = extractor_key(config, spider_cls, spider_args)
+        self.conn = sqlite3.connect(manifest_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                digest TEXT NOT NULL,
+                version TEXT NOT NULL,
+                record TEXT,
+                error TEXT
+            );
+        """)
+
+    def run(self, paths: List[str], processes=None, chunk_size=16) -> dict:
+        """
+        :param paths: 网页文件路径
+        :param processes: 解析进程数，默认为cpu核数
+        :return: 统计信息
+        """
+        stats = {'total': len(paths), 'skipped': 0, 'extracted': 0, 'failed': 0, 'removed': 0}
+        stats['removed'] = self._remove_missing(paths)
+        changed = []
+        for path in paths:
+            if self._is_up_to_date(path):
+                stats['skipped'] += 1
+            else:
+                changed.append(path)
+        if not changed:
+            return stats
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                                                    initargs=(config_to_dict(self.config),
+                                                              {'offline': self.spider_spec})) as executor:
+            for path, digest, record, error in executor.map(extract_file, changed, chunksize=chunk_size):
+                size, mtime = self._stat(path)
+                self.conn.execute("INSERT OR REPLACE INTO files (path, size, mtime, digest, version, record, error)"
+                                  " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (path, size, mtime, digest, self.extractor_version, record, error))
+                if error is None:
+                    stats['extracted'] += 1
+                else:
+                    stats['failed'] += 1
+                    logger.warning("failed to extract: {}, err:{}".format(path, error))
+            self.conn.commit()
+        return stats
+
+    def _is_up_to_date(self, path: str) -> bool:
+        row = self.conn.execute("SELECT size, mtime, digest, version FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or row[3] != self.extractor_version:
+            return False
+        locator = split_locator(path)
+        if locator is not None:
+            # 归档的索引中有每个网页的sha1，不需要读取内容
+            return open_archive(locator[0]).digest(locator[1]) == row[2]
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime) == (row[0], row[1]):
+            return True
+        # 修改时间变了但内容可能没变，比较sha1
+        with open(path, 'rb') as f:
+            if hashlib.sha1(f.read()).hexdigest() != row[2]:
+                return False
+        self.conn.execute("UPDATE files SET mtime = ? WHERE path = ?", (stat.st_mtime, path))
+        self.conn.commit()
+        return True
+
+    @staticmethod
+    def _stat(path: str) -> Tuple[int, float]:
+        """
+        :return: (文件大小, 修改时间)，归档中的网页没有修改时间，记为0
+        """
+        if split_locator(path) is not None:
+            return 0, 0.0
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+
+    def _remove_missing(self, paths: List[str]) -> int:
+        """
+        删除manifest中已经不存在的文件，只删除与本次输入来自同一个目录或归档的记录，
+        目录与归档可以共用一个manifest
+        """
+        existing = set(paths)
+        sources = {source_of(p) for p in paths}
+        missing = [row[0] for row in self.conn.execute("SELECT path FROM files")
+                   if row[0] not in existing and source_of(row[0]) in sources]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", ((p,) for p in missing))
+        self.conn.commit()
+        return len(missing)
+
+    def records(self) -> Iterator:
+        """
+        所有文件的提取结果，按文件路径排序，process_body返回None的文件结果为None
+        """
+        for row in self.conn.execute("SELECT record FROM files WHERE error IS NULL ORDER BY path"):
+            yield json.loads(row[0])
+
+    def failures(self) -> Iterator[Tuple[str, str]]:
+        for row in self.conn.execute("SELECT path, error FROM files WHERE error IS NOT NULL ORDER BY path"):
+            yield row[0], row[1]
+
+    def write(self, output_file: str) -> int:
+        with open_writer(output_file) as writer:
+            for record in self.records():
+                writer.write(record)
+        return writer.count
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,390 @@
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+from spider.metrics import metrics
+
+DEFAULT_FLUSH_EVERY = 1000
+DEFAULT_FLUSH_INTERVAL = 30
+DEFAULT_ROW_GROUP_SIZE = 10000
+DEFAULT_PARQUET_COMPRESSION = "zstd"
+
+# 实体记录{title: {...}}中单独成列的字段，其余字符串字段存入info
+_TEXT_COLUMNS = ("summary",)
+_LIST_COLUMNS = ("paragraph_text", "imgs")
+
+
+class JsonlWriter:
+    """
+    以JSON Lines格式边爬边写结果，每行一个record。
+    每写flush_every条或距上次落盘超过flush_interval秒时flush并fsync一次，
+    程序中途崩溃时最多丢失最后一批记录
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY, flush_interval=DEFAULT_FLUSH_INTERVAL, append=False):
+        """
+        :param path: 输出文件路径
+        :param flush_every: 每写多少条落盘一次
+        :param flush_interval: 最长落盘间隔（秒）
+        :param append: 是否追加到已有文件末尾
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        self.lock = threading.Lock()
+        self._pending = 0
+        self._last_flush = time.time()
+        self.f = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, record):
+        with metrics.stage("write"):
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            with self.lock:
+                self.f.write(line)
+                self.count += 1
+                self._pending += 1
+                if self._pending >= self.flush_every or time.time() - self._last_flush >= self.flush_interval:
+                    self._flush()
+        metrics.inc("spider_records_total")
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self._pending = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        with self.lock:
+            if self.f.closed:
+                return
+            self._flush()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MsgpackWriter:
+    """
+    以msgpack格式逐条写记录，接口与JsonlWriter相同，体积更小、读取更快。
+    compression为gzip时整个流用gzip压缩。需要安装msgpack
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY, compression: Optional[str] = None, append=False):
+        """
+        :param path: 输出文件路径
+        :param flush_every: 每写多少条落盘一次
+        :param compression: None或gzip
+        :param append: 是否追加到已有文件末尾
+        """
+        import msgpack
+        if compression not in (None, "gzip"):
+            raise ValueError("unsupported msgpack compression: {}".format(compression))
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self.lock = threading.Lock()
+        self._pending = 0
+        self.packer = msgpack.Packer(use_bin_type=True)
+        mode = "ab" if append else "wb"
+        self.f = gzip.open(path, mode) if compression == "gzip" else open(path, mode)
+
+    def write(self, record):
+        with metrics.stage("write"):
+            data = self.packer.pack(record)
+            with self.lock:
+                self.f.write(data)
+                self.count += 1
+                self._pending += 1
+                if self._pending >= self.flush_every:
+                    self._flush()
+        metrics.inc("spider_records_total")
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.f.flush()
+        self._pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.f.closed:
+                return
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _entity_fields(pa) -> list:
+    return [
+        ("title", pa.string()),
+        ("info", pa.map_(pa.string(), pa.string())),
+        ("paragraph_text", pa.list_(pa.string())),
+        ("summary", pa.string()),
+        ("imgs", pa.list_(pa.string())),
+    ]
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema(_entity_fields(pa) + [
+        # 对齐记录{'url': 中文url, 'chinese': 实体, 语言: 实体, ...}，每种语言的实体为aligned中的一项
+        ("url", pa.string()),
+        ("aligned", pa.list_(pa.struct([("lang", pa.string()), ("entity", pa.struct(_entity_fields(pa)))]))),
+        # 其他形式的记录整条以json保存在extra中
+        ("extra", pa.string()),
+    ])
+
+
+_EMPTY_ROW = {"title": None, "info": None, "paragraph_text": None, "summary": None, "imgs": None, "url": None,
+              "aligned": None, "extra": None}
+
+
+def _to_entity(record) -> Optional[dict]:
+    """
+    :return: {title: {...}}形式的实体记录对应的列，不是这种形式或字段类型不符时返回None
+    """
+    if not isinstance(record, dict) or len(record) != 1:
+        return None
+    title, content = next(iter(record.items()))
+    if not isinstance(title, str) or not isinstance(content, dict):
+        return None
+    entity = {"title": title, "info": [], "paragraph_text": None, "summary": None, "imgs": None}
+    for k, v in content.items():
+        if k in _TEXT_COLUMNS and isinstance(v, str):
+            entity[k] = v
+        elif k in _LIST_COLUMNS and isinstance(v, list) and all(isinstance(x, str) for x in v):
+            entity[k] = v
+        elif isinstance(v, str):
+            entity["info"].append((k, v))
+        else:
+            return None
+    return entity
+
+
+def _to_row(record) -> dict:
+    row = dict(_EMPTY_ROW)
+    entity = _to_entity(record)
+    if entity is not None:
+        row.update(entity)
+        return row
+    if isinstance(record, dict) and isinstance(record.get("url"), str) and len(record) > 1:
+        aligned = []
+        for lang, content in record.items():
+            if lang == "url":
+                continue
+            entity = None if content is None else _to_entity(content)
+            if content is not None and entity is None:
+                break
+            aligned.append({"lang": lang, "entity": entity})
+        else:
+            row["url"] = record["url"]
+            row["aligned"] = aligned
+            return row
+    row["extra"] = json.dumps(record, ensure_ascii=False)
+    return row
+
+
+def _from_entity(entity: dict) -> dict:
+    content = dict(entity["info"] or [])
+    for k in _TEXT_COLUMNS + _LIST_COLUMNS:
+        if entity[k] is not None:
+            content[k] = entity[k]
+    return {entity["title"]: content}
+
+
+def _from_row(row: dict):
+    if row["extra"] is not None:
+        return json.loads(row["extra"])
+    if row["url"] is not None:
+        record = {"url": row["url"]}
+        for item in row["aligned"]:
+            record[item["lang"]] = None if item["entity"] is None else _from_entity(item["entity"])
+        return record
+    return _from_entity(row)
+
+
+class ParquetWriter:
+    """
+    以Parquet格式按row group写记录，接口与JsonlWriter相同。
+    {title: {infobox..., paragraph_text/summary, imgs}}形式的实体记录按列保存（infobox为map列，paragraph_text为list列），
+    {'url', 'chinese', 语言...}形式的对齐记录保存为url列与每种语言一项的aligned列，
+    其他记录整条以json保存，iter_records读出的记录与写入的相同。
+    数据在row group写满或close时才写入文件，文件在close之后才能读取。需要安装pyarrow
+    """
+
+    def __init__(self, path, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression=DEFAULT_PARQUET_COMPRESSION,
+                 append=False):
+        """
+        :param path: 输出文件路径
+        :param row_group_size: 每个row group的记录数
+        :param compression: zstd、snappy、gzip等pyarrow支持的压缩方式，None为不压缩
+        :param append: Parquet不支持追加，必须为False
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if append:
+            raise ValueError("parquet output does not support append")
+        self.pa = pa
+        self.path = path
+        self.row_group_size = row_group_size
+        self.schema = _parquet_schema()
+        self.count = 0
+        self.lock = threading.Lock()
+        self.rows = []
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression or "none")
+        self.closed = False
+
+    def write(self, record):
+        with metrics.stage("write"):
+            row = _to_row(record)
+            with self.lock:
+                self.rows.append(row)
+                self.count += 1
+                if len(self.rows) >= self.row_group_size:
+                    self._flush()
+        metrics.inc("spider_records_total")
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self._flush()
+            self.writer.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def get_output_format(path: str) -> str:
+    """
+    根据扩展名判断文件格式：parquet、msgpack或jsonl
+    """
+    if path.endswith(".parquet"):
+        return "parquet"
+    if path.endswith((".msgpack", ".msgpack.gz", ".mpk")):
+        return "msgpack"
+    return "jsonl"
+
+
+def open_writer(path, append=False, **kwargs):
+    """
+    根据扩展名选择输出格式：.parquet为Parquet，.msgpack/.msgpack.gz为msgpack，其他为JSON Lines
+    :param kwargs: 传给对应writer的参数，如row_group_size、compression
+    """
+    output_format = get_output_format(path)
+    if output_format == "parquet":
+        return ParquetWriter(path, append=append, **kwargs)
+    if output_format == "msgpack":
+        if path.endswith(".gz"):
+            kwargs.setdefault("compression", "gzip")
+        return MsgpackWriter(path, append=append, **kwargs)
+    return JsonlWriter(path, append=append, **kwargs)
+
+
+def _parquet_columns(fields) -> list:
+    """
+    :return: 读取实体记录的fields需要的列，对齐记录与其他记录所在的列总是读取
+    """
+    columns = ["title"] + [c for c in _TEXT_COLUMNS + _LIST_COLUMNS if c in fields]
+    if any(f not in _TEXT_COLUMNS + _LIST_COLUMNS for f in fields):
+        columns.append("info")
+    return columns + ["url", "aligned", "extra"]
+
+
+def _select_entity(entity, fields):
+    if not isinstance(entity, dict) or len(entity) != 1:
+        return entity
+    title, content = next(iter(entity.items()))
+    if not isinstance(content, dict):
+        return entity
+    return {title: {k: v for k, v in content.items() if k in fields}}
+
+
+def _select_fields(record, fields):
+    """
+    实体记录只保留fields中的字段，对齐记录中每种语言的实体同样处理，其他记录不变
+    """
+    if isinstance(record, dict) and isinstance(record.get("url"), str) and len(record) > 1:
+        return {k: v if k == "url" else _select_entity(v, fields) for k, v in record.items()}
+    return _select_entity(record, fields)
+
+
+def iter_records(path, fields=None) -> Iterator:
+    """
+    逐条读取open_writer写出的文件，不会一次性把整个文件读进内存，格式由扩展名决定。
+    JSON Lines兼容以前整个文件是一个JSON数组的旧格式（旧格式只能整体解析）
+    :param fields: 实体记录{title: {...}}中需要的字段（infobox的属性名、paragraph_text、summary、imgs），
+                   为None时返回完整的记录；Parquet文件只读取这些字段所在的列，不需要的paragraph_text等大列不会被解压
+    """
+    output_format = get_output_format(path)
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        columns = None if fields is None else _parquet_columns(fields)
+        for batch in pq.ParquetFile(path).iter_batches(columns=columns):
+            for row in batch.to_pylist():
+                record = _from_row(row if fields is None else dict(_EMPTY_ROW, **row))
+                yield record if fields is None else _select_fields(record, fields)
+        return
+    if fields is not None:
+        for record in iter_records(path):
+            yield _select_fields(record, fields)
+        return
+    if output_format == "msgpack":
+        import msgpack
+        with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+            yield from msgpack.Unpacker(f, raw=False)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first == "[":
+            f.seek(0)
+            yield from json.load(f)
+            return
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_lines(path) -> Iterator[str]:
+    """
+    逐行读取url列表文件，去掉行尾换行符
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                yield line
@@ -0,0 +1,184 @@
+import threading
+from typing import List, Optional
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+# BeautifulSoup不把这些标签中的文本算作.text的一部分（对应bs4中的Stylesheet、Script等string container）
+_NON_TEXT_TAGS = {"style", "script", "template", "rt", "rp"}
+# BeautifulSoup会把只含空白的文本节点压缩为一个换行或空格，这些标签中除外
+_PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+_ASCII_SPACES = " \n\t\x0c\r"
+
+_MISSING = object()
+
+
+class SoupBackend:
+    """
+    原来的BeautifulSoup实现，建树慢但最通用
+    """
+    name = "bs4"
+
+    def parse(self, body: str):
+        return BeautifulSoup(body, features="lxml")
+
+    def find(self, node, tag: str, cls: Optional[str] = None, id: Optional[str] = None):
+        return node.find(tag, self._attrs(cls, id))
+
+    def find_all(self, node, tag: str, cls: Optional[str] = None) -> List:
+        return node.findAll(tag, self._attrs(cls, None))
+
+    def contents(self, node) -> List:
+        return node.contents
+
+    def text(self, node) -> str:
+        return node.text
+
+    def get(self, node, attr: str, default=_MISSING):
+        """
+        :param default: 没有该属性时的返回值，不指定时抛出KeyError
+        """
+        if default is not _MISSING:
+            return node.get(attr, default)
+        return node[attr]
+
+    def parent(self, node):
+        return node.parent
+
+    @staticmethod
+    def _attrs(cls, id) -> dict:
+        attrs = {}
+        if cls is not None:
+            attrs["class"] = cls
+        if id is not None:
+            attrs["id"] = id
+        return attrs
+
+
+class LxmlBackend:
+    """
+    直接使用lxml的树，省去了BeautifulSoup建树的开销。
+    查找与取文本的语义与SoupBackend一致，两者提取出的结果完全相同
+    """
+    name = "lxml"
+
+    def __init__(self):
+        # lxml的parser对象不能在多个线程中同时使用
+        self.local = threading.local()
+
+    def parse(self, body: str):
+        if not hasattr(self.local, "html_parser"):
+            self.local.html_parser = etree.HTMLParser()
+            self.local.utf8_parser = etree.HTMLParser(encoding="utf-8")
+        try:
+            root = etree.fromstring(body, self.local.html_parser)
+        except ValueError:
+            # 带有encoding声明的str不能直接交给lxml
+            root = etree.fromstring(body.encode("utf-8"), self.local.utf8_parser)
+        except etree.XMLSyntaxError:
+            root = None
+        if root is None:
+            root = etree.Element("html")
+        return root
+
+    def find(self, node, tag: str, cls: Optional[str] = None, id: Optional[str] = None):
+        for el in node.iterdescendants(tag):
+            if self._match(el, cls, id):
+                return el
+        return None
+
+    def find_all(self, node, tag: str, cls: Optional[str] = None) -> List:
+        return [el for el in node.iterdescendants(tag) if self._match(el, cls, None)]
+
+    def contents(self, node) -> List:
+        # 与bs4的.contents一样，文本节点也算作子节点
+        preserve = self._preserve_whitespace(node)
+        result = []
+        if node.text:
+            result.append(self._string(node.text, preserve))
+        for child in node:
+            result.append(child)
+            if child.tail:
+                result.append(self._string(child.tail, preserve))
+        return result
+
+    def text(self, node) -> str:
+        if isinstance(node, str):
+            return node
+        preserve = self._preserve_whitespace(node)
+        parts = []
+        if node.text:
+            parts.append(self._string(node.text, preserve))
+        self._append_text(node, parts, preserve)
+        return "".join(parts)
+
+    def get(self, node, attr: str, default=_MISSING):
+        value = node.get(attr)
+        if value is None:
+            if default is not _MISSING:
+                return default
+            raise KeyError(attr)
+        return value
+
+    def parent(self, node):
+        return node.getparent()
+
+    def _append_text(self, node, parts: List[str], preserve: bool):
+        for child in node:
+            tag = child.tag
+            # 注释与processing instruction的tag不是str，只保留它们后面的文本
+            if isinstance(tag, str) and tag not in _NON_TEXT_TAGS:
+                child_preserve = preserve or tag in _PRESERVE_WHITESPACE_TAGS
+                if child.text:
+                    parts.append(self._string(child.text, child_preserve))
+                if len(child):
+                    self._append_text(child, parts, child_preserve)
+            if child.tail:
+                parts.append(self._string(child.tail, preserve))
+
+    @staticmethod
+    def _string(s: str, preserve: bool) -> str:
+        if preserve or s.strip(_ASCII_SPACES):
+            return s
+        return "\n" if "\n" in s else " "
+
+    @staticmethod
+    def _preserve_whitespace(node) -> bool:
+        if node.tag in _PRESERVE_WHITESPACE_TAGS:
+            return True
+        for el in node.iterancestors():
+            if el.tag in _PRESERVE_WHITESPACE_TAGS:
+                return True
+        return False
+
+    @staticmethod
+    def _match(el, cls, id) -> bool:
+        if id is not None and el.get("id") != id:
+            return False
+        if cls is not None:
+            value = el.get("class")
+            if value is None:
+                return False
+            # 与bs4一致：含空格时要求class属性整体相等，否则匹配其中任意一个class
+            if " " in cls:
+                return value == cls
+            return cls in value.split()
+        return True
+
+
+_backends = {
+    SoupBackend.name: SoupBackend,
+    LxmlBackend.name: LxmlBackend,
+}
+
+
+def get_parser(config=None):
+    """
+    根据config.ini中[PARSER]的backend选择html解析后端，默认为lxml
+    """
+    name = LxmlBackend.name
+    if config is not None:
+        name = config.get("PARSER", "backend", fallback=name)
+    if name not in _backends:
+        raise ValueError("parser backend [{}] is not supported".format(name))
+    return _backends[name]()
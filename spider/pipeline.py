@@ -0,0 +1,162 @@
+import concurrent.futures
+import configparser
+import logging
+import queue
+import threading
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from spider.executor import imap_unordered
+from spider.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+# 有网页可以取时，每次最多等待解析结果的时间（秒）
+_POLL_INTERVAL = 0.05
+
+# 每个解析进程中的spider，由init_worker创建，解析函数通过get_worker_spider获取
+_worker_spiders: Dict[str, object] = {}
+
+
+def config_to_dict(config) -> dict:
+    """
+    ConfigParser不方便直接传给子进程，转换为普通的dict
+    """
+    return {section: dict(config[section]) for section in config.sections()}
+
+
+def init_worker(config_dict: dict, spider_specs: Dict[str, Tuple[type, tuple]]):
+    """
+    解析进程的initializer
+    :param config_dict: config_to_dict得到的配置
+    :param spider_specs: {名称: (spider类, 除config外的构造参数)}
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(config_dict)
+    for name, (spider_cls, args) in spider_specs.items():
+        _worker_spiders[name] = spider_cls(config, *args)
+
+
+def get_worker_spider(name: str):
+    return _worker_spiders[name]
+
+
+class FetchParsePipeline:
+    """
+    抓取与解析分离的两级流水线：
+    线程池负责抓取网页，抓到的内容放入有界队列；进程池从队列中取出内容并解析，
+    解析不再与抓取线程争抢GIL。队列满时抓取线程阻塞，解析跟不上时不会无限制地堆积网页
+    """
+
+    def __init__(self, fetch: Callable, parse: Callable, fetch_workers: int, parse_processes: int,
+                 initializer: Optional[Callable] = None, initargs: tuple = (), queue_size=None, ordered=False):
+        """
+        :param fetch: 在抓取线程中调用，参数为输入的item，返回交给parse的payload，返回None表示抓取失败
+        :param parse: 在解析进程中调用，参数为payload，必须是模块级的函数
+        :param fetch_workers: 抓取线程数
+        :param parse_processes: 解析进程数
+        :param initializer: 解析进程的initializer，一般为init_worker
+        :param queue_size: 抓取与解析之间的队列长度，默认为解析进程数的4倍
+        :param ordered: 是否按输入顺序返回结果
+        """
+        self.fetch = fetch
+        self.parse = parse
+        self.fetch_workers = fetch_workers
+        self.parse_processes = parse_processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.queue_size = queue_size or parse_processes * 4
+        self.ordered = ordered
+
+    def run(self, items: Iterable) -> Iterator[Tuple[object, object]]:
+        """
+        :return: (item, 解析结果)的迭代器，抓取或解析失败时解析结果为None；
+                 items本身抛出的异常不会被吞掉，解析中的网页返回完之后重新抛出
+        """
+        payload_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def put(obj) -> bool:
+            # 消费者已经退出时不再阻塞
+            while not stop.is_set():
+                try:
+                    payload_queue.put(obj, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch_one(indexed_item):
+            idx, item = indexed_item
+            try:
+                return idx, item, self.fetch(item)
+            except Exception as e:
+                logger.warning("failed to fetch: {}, err:{}".format(item, e))
+                return idx, item, None
+
+        def produce():
+            try:
+                for fetched in imap_unordered(fetch_one, enumerate(items), self.fetch_workers):
+                    if not put(fetched):
+                        return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(_DONE)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            yield from self._consume(payload_queue, errors)
+        finally:
+            stop.set()
+
+    def _consume(self, payload_queue: queue.Queue, errors: list):
+        max_pending = self.parse_processes * 2
+        next_idx = 0
+        finished = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_processes, initializer=self.initializer,
+                                                    initargs=self.initargs) as executor:
+            pending = {}
+            producing = True
+            while producing or pending:
+                # 解析中的任务过多时只等待解析完成，否则从队列中取新的网页，取网页时最多等待_POLL_INTERVAL，
+                # 之后每轮都收取已经解析完成的结果，不会因为队列暂时为空而积压
+                timeout = None
+                if producing and len(pending) < max_pending:
+                    timeout = 0
+                    try:
+                        fetched = payload_queue.get(timeout=_POLL_INTERVAL if pending else None)
+                    except queue.Empty:
+                        fetched = None
+                    metrics.set("spider_queue_depth", payload_queue.qsize())
+                    if fetched is _DONE:
+                        producing = False
+                    elif fetched is not None:
+                        idx, item, payload = fetched
+                        if payload is None:
+                            finished[idx] = (item, None)
+                        else:
+                            pending[executor.submit(self.parse, payload)] = (idx, item)
+                if pending:
+                    done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        idx, item = pending.pop(future)
+                        try:
+                            finished[idx] = (item, future.result())
+                        except Exception as e:
+                            logger.warning("failed to parse: {}, err:{}".format(item, e))
+                            finished[idx] = (item, None)
+
+                if self.ordered:
+                    while next_idx in finished:
+                        yield finished.pop(next_idx)
+                        next_idx += 1
+                else:
+                    for idx in list(finished):
+                        yield finished.pop(idx)
+        # 输入的迭代器出错时已经交给解析进程的网页照常返回，之后再抛出
+        if errors:
+            raise errors[0]
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+# 这些状态码说明服务端过载或限流，需要降低并发并重试
+THROTTLE_STATUS = {429, 503}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    令牌桶，平均每秒rate个请求，最多允许burst个突发请求
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """
+        尝试取走一个令牌，成功返回0，否则返回还需等待的秒数（调用方需持有锁）
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class HostLimiter:
+    """
+    单个host的限流器：令牌桶限制请求速率，并发上限按AIMD调整——
+    请求成功且延迟正常时每个"往返"加1，遇到429/503、超时或延迟过高时减半；
+    被限流时令牌桶的速率也减半，之后随成功的请求逐步恢复到配置的速率；
+    带Retry-After的响应会让该host上的所有请求暂停到指定时间
+    """
+
+    def __init__(self, rate: float, burst: float, initial_concurrency: float, min_concurrency: float,
+                 max_concurrency: float, latency_threshold: float):
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_threshold = latency_threshold
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        :return: 0表示可以发出请求（占用一个并发名额），否则为建议等待的秒数
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.concurrency):
+                return 0.01
+            wait = self.bucket.reserve(now)
+            if wait > 0:
+                return wait
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def release(self, status: Optional[int], latency: float, retry_after: Optional[float] = None):
+        """
+        请求结束后调用
+        :param status: http状态码，请求异常时为None
+        :param latency: 请求耗时（秒）
+        :param retry_after: 响应中Retry-After的秒数
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if status is None or status in THROTTLE_STATUS or latency > self.latency_threshold:
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            elif status < 500:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            if status in THROTTLE_STATUS:
+                self.bucket.rate = max(self.max_rate / 64, self.bucket.rate / 2)
+            elif status is not None and status < 500:
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 100)
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class RateLimiter:
+    """
+    按host分别限流
+    """
+
+    def __init__(self, rate=20.0, burst=20.0, initial_concurrency=8.0, min_concurrency=1.0, max_concurrency=32.0,
+                 latency_threshold=10.0):
+        self.args = (rate, burst, initial_concurrency, min_concurrency, max_concurrency, latency_threshold)
+        self.hosts: Dict[str, HostLimiter] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> Optional["RateLimiter"]:
+        """
+        根据config.ini中的[RATELIMIT]构造，没有该section时返回None
+        """
+        if not config.has_section("RATELIMIT"):
+            return None
+        section = config["RATELIMIT"]
+        return cls(rate=section.getfloat("rate", 20.0),
+                   burst=section.getfloat("burst", 20.0),
+                   initial_concurrency=section.getfloat("initial_concurrency", 8.0),
+                   min_concurrency=section.getfloat("min_concurrency", 1.0),
+                   max_concurrency=section.getfloat("max_concurrency", 32.0),
+                   latency_threshold=section.getfloat("latency_threshold", 10.0))
+
+    def host(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostLimiter(*self.args)
+            return self.hosts[host]
+
+
+class RetryPolicy:
+    """
+    带随机抖动的指数退避重试（full jitter），服务端给出Retry-After时至少等待该时间
+    """
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=30.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_config(cls, config) -> "RetryPolicy":
+        return cls(max_retries=config.getint("RETRY", "max_retries", fallback=3),
+                   backoff_base=config.getfloat("RETRY", "backoff_base", fallback=0.5),
+                   backoff_max=config.getfloat("RETRY", "backoff_max", fallback=30.0))
+
+    def should_retry(self, attempt: int, status: Optional[int]) -> bool:
+        """
+        :param attempt: 已经重试的次数
+        :param status: http状态码，请求异常时为None
+        """
+        return attempt < self.max_retries and (status is None or status in RETRY_STATUS)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After可以是秒数，也可以是http日期
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+DEFAULT_MIN_INTERVAL = 24 * 3600
+DEFAULT_MAX_INTERVAL = 60 * 24 * 3600
+DEFAULT_INITIAL_INTERVAL = 7 * 24 * 3600
+
+# Wikipedia网页中的版本号，同一个版本的网页内容不变
+_revision_regex = re.compile(r'"wgRevisionId":(\d+)')
+# 内联脚本中有请求id、时间戳等每次请求都不同的内容，计算内容hash时去掉
+_script_regex = re.compile(r"<script\b[^>]*>.*?</script>", re.S | re.I)
+
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+NOT_MODIFIED = "not_modified"
+
+
+def get_revision_id(body: str) -> Optional[int]:
+    """
+    :return: Wikipedia网页的版本号，不是Wikipedia网页时返回None
+    """
+    m = _revision_regex.search(body)
+    return int(m.group(1)) if m is not None else None
+
+
+def content_hash(body: str) -> str:
+    """
+    去掉内联脚本后网页内容的hash
+    """
+    return hashlib.sha1(_script_regex.sub("", body).encode("utf-8")).hexdigest()
+
+
+class PageMeta:
+    def __init__(self, url, fetched_at, next_fetch_at, interval, etag, last_modified, content_hash, revision_id,
+                 checks, changes):
+        self.url = url
+        self.fetched_at = fetched_at
+        self.next_fetch_at = next_fetch_at
+        self.interval = interval
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.revision_id = revision_id
+        self.checks = checks
+        self.changes = changes
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class RecrawlState:
+    """
+    定期刷新语料时每个url的抓取记录：上次抓取时间、ETag/Last-Modified、内容hash、Wikipedia的版本号，
+    以及根据观察到的变化频率调整的重访间隔：内容变化时间隔减半，未变化时间隔加倍，限制在[min_interval, max_interval]内
+    """
+
+    def __init__(self, path, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 initial_interval=DEFAULT_INITIAL_INTERVAL):
+        """
+        :param path: sqlite文件路径，所在目录不存在时自动创建
+        :param min_interval: 最短重访间隔（秒）
+        :param max_interval: 最长重访间隔（秒）
+        :param initial_interval: 第一次抓取后的重访间隔（秒）
+        """
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                next_fetch_at REAL NOT NULL,
+                interval REAL NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                revision_id INTEGER,
+                checks INTEGER NOT NULL DEFAULT 0,
+                changes INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS pages_next_fetch_at ON pages (next_fetch_at);
+        """)
+
+    @classmethod
+    def from_config(cls, config, path=None):
+        """
+        根据config.ini中的[RECRAWL]构造
+        :param path: 为None时使用[RECRAWL]中的state_file
+        """
+        return cls(path or config.get("RECRAWL", "state_file", fallback="data/recrawl.state"),
+                   min_interval=config.getfloat("RECRAWL", "min_interval", fallback=DEFAULT_MIN_INTERVAL),
+                   max_interval=config.getfloat("RECRAWL", "max_interval", fallback=DEFAULT_MAX_INTERVAL),
+                   initial_interval=config.getfloat("RECRAWL", "initial_interval", fallback=DEFAULT_INITIAL_INTERVAL))
+
+    def get(self, url: str) -> Optional[PageMeta]:
+        with self.lock:
+            row = self.conn.execute("SELECT url, fetched_at, next_fetch_at, interval, etag, last_modified, "
+                                    "content_hash, revision_id, checks, changes FROM pages WHERE url = ?",
+                                    (url,)).fetchone()
+        return None if row is None else PageMeta(*row)
+
+    def due(self, urls: Iterable[str], now: Optional[float] = None) -> Iterator[str]:
+        """
+        过滤出需要重访的url：从未抓取过或已到重访时间的
+        """
+        now = time.time() if now is None else now
+        for url in urls:
+            with self.lock:
+                row = self.conn.execute("SELECT next_fetch_at FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None or row[0] <= now:
+                yield url
+
+    def update(self, url: str, result: str, etag=None, last_modified=None, digest=None, revision_id=None):
+        """
+        记录一次抓取的结果并安排下次重访
+        :param result: CHANGED、UNCHANGED（内容hash或版本号相同）或NOT_MODIFIED（服务端返回304）
+        """
+        now = time.time()
+        meta = self.get(url)
+        if meta is None:
+            interval = self.initial_interval
+            checks, changes = 1, 1
+        else:
+            changed = result == CHANGED
+            interval = meta.interval / 2 if changed else meta.interval * 2
+            interval = min(self.max_interval, max(self.min_interval, interval))
+            checks, changes = meta.checks + 1, meta.changes + int(changed)
+            # 304时服务端不一定返回ETag等，沿用之前的值
+            etag = etag or meta.etag
+            last_modified = last_modified or meta.last_modified
+            digest = digest or meta.content_hash
+            revision_id = revision_id or meta.revision_id
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO pages (url, fetched_at, next_fetch_at, interval, etag, "
+                              "last_modified, content_hash, revision_id, checks, changes) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (url, now, now + interval, interval, etag, last_modified, digest, revision_id,
+                               checks, changes))
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
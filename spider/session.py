@@ -0,0 +1,167 @@
+import logging
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from spider.cache import ResponseCache
+from spider.metrics import metrics
+from spider.ratelimit import RateLimiter, RetryPolicy, parse_retry_after
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
+
+
+class SpiderSession:
+    """
+    两个spider共用的HTTP传输层：
+    每个host一个keep-alive连接池（urllib3的连接池本身是线程安全的），
+    代理与默认超时只在构造时设置一次。
+    所有请求都经过按host的限流器，429/5xx与连接错误按重试策略退避重试
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, proxy_url=None, headers=None,
+                 cache: Optional[ResponseCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry: Optional[RetryPolicy] = None):
+        """
+        :param pool_size: 每个host最多保持的连接数，应与ThreadPoolExecutor的线程数一致
+        :param timeout: 默认超时时间（秒）
+        :param proxy_url: 代理地址，如socks5://127.0.0.1:10808，为None时不使用代理
+        :param headers: 每个请求都附带的header
+        :param cache: get_text使用的响应缓存，为None时不缓存
+        :param rate_limiter: 按host的限流器，为None时不限流
+        :param retry: 重试策略，为None时不重试
+        """
+        self.pool_size = pool_size
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry or RetryPolicy(max_retries=0)
+        self.timeout = timeout
+        self.proxies = {}
+        if proxy_url:
+            self.proxies = {
+                'http': proxy_url,
+                'https': proxy_url,
+            }
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.proxies.update(self.proxies)
+        if headers is not None:
+            self.session.headers.update(headers)
+
+    @classmethod
+    def from_config(cls, config, use_proxy=False, headers=None):
+        """
+        根据config.ini中的[HTTP]与[PROXY]构造session
+        :param config: ConfigParser对象
+        :param use_proxy: 是否使用[PROXY]中的代理
+        :param headers: 每个请求都附带的header
+        """
+        proxy_url = None
+        if use_proxy and config.has_section("PROXY"):
+            proxy_url = config["PROXY"].get("url") or None
+        return cls(pool_size=get_pool_size(config),
+                   timeout=config.getfloat("HTTP", "timeout", fallback=DEFAULT_TIMEOUT),
+                   proxy_url=proxy_url,
+                   headers=headers,
+                   cache=ResponseCache.from_config(config),
+                   rate_limiter=RateLimiter.from_config(config),
+                   retry=RetryPolicy.from_config(config))
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            limiter = None
+            if self.rate_limiter is not None:
+                limiter = self.rate_limiter.host(url)
+                limiter.acquire()
+            start = time.monotonic()
+            r = None
+            retry_after = None
+            try:
+                r = self.session.request(method, url, **kwargs)
+                retry_after = parse_retry_after(r.headers.get("Retry-After"))
+            except requests.RequestException as e:
+                metrics.inc("spider_errors_total", stage="fetch", host=host, error=type(e).__name__)
+                # 只有连接错误与超时重试，其他异常（如ChunkedEncodingError、InvalidURL）直接抛出
+                if not isinstance(e, (requests.ConnectionError, requests.Timeout)) \
+                        or not self.retry.should_retry(attempt, None):
+                    raise
+                logger.debug("retry {} after error: {}".format(url, e))
+            finally:
+                # 无论是否出现异常都要归还并发名额，否则该host的名额会逐渐耗尽
+                elapsed = time.monotonic() - start
+                if limiter is not None:
+                    limiter.release(None if r is None else r.status_code, elapsed, retry_after)
+            if r is None:
+                time.sleep(self.retry.delay(attempt))
+                attempt += 1
+                continue
+            # r.elapsed是收到响应头的时间，包括DNS、代理与建立连接，其余为下载body的时间
+            metrics.observe("spider_stage_seconds", r.elapsed.total_seconds(), stage="ttfb", host=host)
+            metrics.observe("spider_stage_seconds", elapsed, stage="fetch", host=host)
+            metrics.inc("spider_requests_total", host=host, status=r.status_code)
+            metrics.inc("spider_bytes_total", len(r.content), host=host)
+            if not self.retry.should_retry(attempt, r.status_code):
+                return r
+            logger.debug("retry {} after status {}".format(url, r.status_code))
+            r.close()
+            time.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+    def get_text(self, url, **kwargs) -> Optional[str]:
+        """
+        获取网页的html文本，状态码不为200时返回None。
+        缓存未过期时直接返回缓存内容，过期后带ETag/Last-Modified重新验证
+        """
+        if self.cache is None:
+            r = self.get(url, **kwargs)
+            if r.status_code != 200:
+                return None
+            return r.text
+
+        entry = self.cache.lookup(url)
+        if entry is not None and entry.is_fresh():
+            metrics.inc("spider_cache_total", result="hit")
+            return entry.text
+        if entry is not None:
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers.update(entry.conditional_headers())
+            kwargs["headers"] = headers
+        r = self.get(url, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            metrics.inc("spider_cache_total", result="revalidated")
+            self.cache.refresh(url)
+            return entry.text
+        metrics.inc("spider_cache_total", result="miss")
+        if r.status_code != 200:
+            return None
+        self.cache.store(url, r.text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        return r.text
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def get_pool_size(config) -> int:
+    """
+    连接池大小，同时也是main.py中ThreadPoolExecutor的线程数
+    """
+    return config.getint("HTTP", "pool_size", fallback=DEFAULT_POOL_SIZE)
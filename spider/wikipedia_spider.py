@@ -1,13 +1,22 @@
-import concurrent
-import json
 import re
 from typing import List, Set, Union
 
-import requests
 from bs4 import BeautifulSoup
-from pandas.io.html import read_html
 from tqdm import tqdm
 
+from spider.align_store import AlignStore
+from spider.archive import read_local_page
+from spider.async_fetcher import AsyncFetcher
+from spider.canonical import CanonicalIndex
+from spider.executor import imap_unordered
+from spider.images import ImageResolver, derive_wiki_image_url
+from spider.langlinks import LanglinksClient
+from spider.metrics import metrics
+from spider.normalize import Normalizer
+from spider.output import JsonlWriter, iter_lines
+from spider.parser import get_parser
+from spider.session import SpiderSession
+
 _wiki_base_url_dict = {
     "en": "https://en.wikipedia.org",
     "ja": "https://ja.wikipedia.org",
@@ -16,9 +25,18 @@ _wiki_base_url_dict = {
     "zh": "https://zh.wikipedia.org"
 }
 
+# p-lang中显示的语言名称 -> 语言代码
+_wiki_lang_code_dict = {
+    "English": "en",
+    "日本語": "ja",
+    "한국어": "ko",
+    "Русский": "ru",
+    "中文": "zh",
+}
+
 _wiki_list_regex_dict = {
-    "en": r"^List of[\s\S]*$",
-    "ja": r"^[\s\S]+一覧$",
+    "en": re.compile(r"^List of[\s\S]*$"),
+    "ja": re.compile(r"^[\s\S]+一覧$"),
 }
 
 
@@ -47,8 +65,19 @@ _is_content_page_func = {
 
 
 class WikiSpider:
+    # process_body的提取逻辑或输出格式变化时加1，离线提取会据此重新解析所有网页
+    extractor_version = 2
+
     def __init__(self, config, language):
         self.proxy_config = config["PROXY"]
+        self.session = SpiderSession.from_config(config, use_proxy=True)
+        self.async_fetcher = AsyncFetcher.from_config(config, use_proxy=True, cache=self.session.cache,
+                                                      rate_limiter=self.session.rate_limiter)
+        self.parser = get_parser(config)
+        self.normalizer = Normalizer.from_config(config)
+        self.image_resolver = ImageResolver(self.session, self.extract_image_url, derive=derive_wiki_image_url,
+                                            workers=self.session.pool_size)
+        self.langlinks = LanglinksClient(self.session)
         if language not in _wiki_base_url_dict:
             raise ValueError("language code [{}] is not supported".format(language))
 
@@ -61,43 +90,52 @@ class WikiSpider:
         return self.get_web_content(url)
 
     def get_web_content(self, url, is_from_file=False) -> dict:
-        if not is_from_file:
-            r = requests.get(url, proxies=self.get_proxy())
+        body = self.get_web_body_text(url, is_from_file)
+        if body is None:
+            return None
+        return self.process_body(body)
 
-            return self.process_body(r.text)
+    def get_web_body_text(self, url, is_from_file=False) -> Union[str, None]:
+        """
+        :param url: url, or file path when is_from_file is True
+        :return: html text, None if the page could not be fetched
+        """
+        if not is_from_file:
+            return self.session.get_text(url)
         else:
-            text = ""
-            with open(url, 'r', encoding='utf-8') as f:
-                text = f.read()
-            return self.process_body(text)
+            return read_local_page(url)
 
     def process_body(self, body: str) -> Union[dict, None]:
         r = {}
-        soup = BeautifulSoup(body, features="lxml")
-        title = self.get_title(soup)
-        if title is None:
-            return None
-        # info = self.get_info(body)
-        info = self.get_info_plus(soup)
-        if info == {}:
-            return None
-        info['paragraph_text'] = self.get_para_text(soup)
-        # img_urls = self.get_image(soup)
+        with metrics.stage("parse"):
+            doc = self.parser.parse(body)
+        with metrics.stage("extract"):
+            title = self.get_title(doc)
+            if title is None:
+                return None
+            # info = self.get_info(body)
+            info = self.get_info_plus(doc)
+            if info == {}:
+                return None
+            info['paragraph_text'] = self.get_para_text(doc)
+        # img_urls = self.get_image(doc)
         # info["imgs"] = img_urls
         r[title] = info
         return r
 
-    def get_title(self, soup: BeautifulSoup):
-        head = soup.find("h1", {"id": "firstHeading"})
+    def get_title(self, doc):
+        head = self.parser.find(doc, "h1", id="firstHeading")
         if head is None:
             return None
-        return head.text
+        return self.normalizer.convert(self.parser.text(head))
 
     def get_info(self, body) -> dict:
         """
         :param body: html content
         :return: dictionary contains property retrieved from wikipedia infobox
         """
+        # pandas只有这个旧方法用到，导入很慢，不在模块加载时导入
+        from pandas.io.html import read_html
         info_dict = {}
         try:
             info_boxes = read_html(str(body), index_col=0, attrs={"class": "infobox"})
@@ -107,8 +145,7 @@ class WikiSpider:
         for k, v in tmp_dict.items():
             info_dict = v
             break  # tmp_dict only has one key
-        # todo：translate to simplified Chinese
-        # remove cite chars and \xa0
+        # remove cite chars and css noise, translate to simplified Chinese if configured
         info_dict = {
             self.strip_info_key(str(k)): self.strip_info_value(str(v)) for
             k, v in
@@ -116,42 +153,52 @@ class WikiSpider:
             k != v and str(k).lower() != "nan" and str(v).lower() != "nan"}
         return info_dict
 
-    def get_info_plus(self, soup: BeautifulSoup):
+    def get_info_plus(self, doc):
 
         infodict = {}
-        infobox = soup.find("table", {"class": "infobox"})
-        rows = infobox.findChildren("tr")
+        infobox = self.parser.find(doc, "table", cls="infobox")
+        rows = self.parser.find_all(infobox, "tr")
         for row in rows:
-            if len(row.contents) != 2:
+            contents = self.parser.contents(row)
+            if len(contents) != 2:
                 continue
             # key = traverse_content('', row.contents[0])
             # value = traverse_content('', row.contents[1])
-            key = row.contents[0].text
-            value = row.contents[1].text
+            key = self.parser.text(contents[0])
+            value = self.parser.text(contents[1])
             infodict[key] = value
-        return infodict
+        return self.normalizer.normalize_info(infodict)
 
-    def get_para_text(self, soup: BeautifulSoup):
+    def get_para_text(self, doc):
         result_list = []
-        body = soup.find("div", {"class": "mw-parser-output"})
-        paragraphs = body.findChildren('p')
+        body = self.parser.find(doc, "div", cls="mw-parser-output")
+        paragraphs = self.parser.find_all(body, 'p')
         for p in paragraphs:
-            result_list.append(p.text)
+            result_list.append(self.normalizer.normalize_text(self.parser.text(p)))
         return result_list
 
-    def get_image(self, soup: BeautifulSoup) -> List[str]:
-        img_urls = []
-        # soup = BeautifulSoup(body, features="lxml")
-        thumbs = soup.findAll("img", {"class": "thumbimage"})
+    def get_image(self, doc) -> List[str]:
+        refs = []
+        thumbs = self.parser.find_all(doc, "img", cls="thumbimage")
         for thumb in thumbs:
-            img_page_url = self.wiki_base_url + thumb.parent["href"]
-            img_page = requests.get(img_page_url, proxies=self.get_proxy())
-            img_page_body = img_page.text
-            s = BeautifulSoup(img_page_body, features="lxml")
-            full_media_div = s.findAll("div", {"class": "fullMedia"})[0]
-            img_url = "https:" + full_media_div.findAll("a", {"class": "internal"})[0]["href"]
-            img_urls.append(img_url)
-        return img_urls
+            img_page_url = self.wiki_base_url + self.parser.get(self.parser.parent(thumb), "href")
+            refs.append((img_page_url, self.parser.get(thumb, "src")))
+        return self.image_resolver.resolve(refs)
+
+    def extract_image_url(self, body: str) -> Union[str, None]:
+        """
+        从File:页面中提取原图地址
+        :param body: File:页面的html
+        :return: 原图地址，页面中没有原图链接时返回None
+        """
+        s = self.parser.parse(body)
+        full_media_divs = self.parser.find_all(s, "div", cls="fullMedia")
+        if len(full_media_divs) == 0:
+            return None
+        links = self.parser.find_all(full_media_divs[0], "a", cls="internal")
+        if len(links) == 0:
+            return None
+        return "https:" + self.parser.get(links[0], "href")
 
     def get_lists(self, lists_of_lists_url: str) -> Set[str]:
         """
@@ -159,12 +206,7 @@ class WikiSpider:
         :param lists_of_lists_url: page url
         :return: set of lists
         """
-        r = requests.get(lists_of_lists_url, proxies=self.get_proxy())
-        body = r.text
-        soup = BeautifulSoup(body, features="lxml")
-        links = soup.findAll("a", {"title": re.compile(_wiki_list_regex_dict[self.language])})
-        list_link_set = {self.wiki_base_url + link["href"] for link in links}
-        return list_link_set
+        return self.get_lists_from_doc(self.parser.parse(self.get_list_page(lists_of_lists_url)))
 
     def get_links_from_list(self, list_url: str) -> Set[str]:
         """
@@ -172,21 +214,54 @@ class WikiSpider:
         :param list_url: page url
         :return: set of related links
         """
-        r = requests.get(list_url, proxies=self.get_proxy())
-        body = r.text
-        soup = BeautifulSoup(body, features="lxml")
-        possible_area = soup.findAll("div", {"class": "mw-parser-output"})
-        if len(possible_area) == 0:
-            return set()
-        area = possible_area[0]
+        return self.get_links_from_list_doc(self.parser.parse(self.get_list_page(list_url)))
 
-        links = area.findAll("a", {"href": re.compile(r"^(/wiki/)[\s\S]*$")})
-        link_set = {self.wiki_base_url + link["href"] for link in links if self.is_content_page(link["href"])}
+    def get_list_page(self, url: str) -> str:
+        """
+        :return: lists_of_lists或list页面的html，下载失败时抛出异常
+        """
+        body = self.session.get_text(url)
+        if body is None:
+            raise ValueError("failed to fetch list page: {}".format(url))
+        return body
+
+    def get_lists_from_doc(self, doc) -> Set[str]:
+        """
+        :param doc: 解析后的页面
+        :return: 页面中标题符合该语言list命名规则的链接
+        """
+        list_regex = _wiki_list_regex_dict[self.language]
+        list_link_set = set()
+        for link in self.parser.find_all(doc, "a"):
+            title = self.parser.get(link, "title", None)
+            href = self.parser.get(link, "href", None)
+            if title is not None and href is not None and list_regex.match(title):
+                list_link_set.add(self.wiki_base_url + href)
+        return list_link_set
+
+    def get_links_from_list_doc(self, doc) -> Set[str]:
+        """
+        :param doc: 解析后的页面
+        :return: 正文中指向词条页面的链接
+        """
+        area = self.parser.find(doc, "div", cls="mw-parser-output")
+        if area is None:
+            return set()
+        link_set = set()
+        for link in self.parser.find_all(area, "a"):
+            href = self.parser.get(link, "href", None)
+            if href is not None and href.startswith("/wiki/") and self.is_content_page(href):
+                link_set.add(self.wiki_base_url + href)
         return link_set
 
-    def align_language_wrapper(self, url, lang_src, lang_tgt):
-        r = requests.get(url, proxies=self.get_proxy())
-        body = r.text
+    def align_language_wrapper(self, url, lang_src, lang_tgt, index: CanonicalIndex = None):
+        r = self.session.get(url)
+        if index is not None and not index.learn(url, r.text):
+            # 重定向到已经对齐过的词条
+            return None
+        return self.get_align_link(url, r.text, lang_src, lang_tgt)
+
+    def get_align_link(self, url, body, lang_src, lang_tgt):
         soup = BeautifulSoup(body, features="lxml")
         lang_nav = soup.find("nav", {"id": "p-lang"})
         link_tag = lang_nav.find("a", string=lang_tgt)
@@ -195,33 +270,59 @@ class WikiSpider:
         tgt_link = link_tag["href"]
         return {lang_src: url, lang_tgt: tgt_link}
 
-    def align_language(self, urls_file, lang_src, lang_tgt: str):
-        with open(urls_file, 'r', encoding='utf-8') as f:
-            urls = [line[:-1] for line in f]
+    def align_language(self, urls_file, lang_src, lang_tgt: str, use_async=False, use_api=False,
+                       index: CanonicalIndex = None, store: AlignStore = None):
+        """
+        :param urls_file: 每行一个lang_src语言的词条url
+        :param lang_src: 词条所在语言在p-lang中的名称，如日本語
+        :param lang_tgt: 目标语言在p-lang中的名称，如中文
+        :param use_async: 使用aiohttp下载词条网页
+        :param use_api: 通过MediaWiki api批量查询跨语言链接，不下载词条网页
+        :param index: 规范化url与重定向的索引，同一个词条的不同写法只查询一次，为None时只做规范化
+        :param store: 不为None时对齐链接同时写入该AlignStore
+        """
+        file_name = f'data/{lang_src}-{lang_tgt}-align-urls.txt'
+        index = index if index is not None else CanonicalIndex()
+        urls = index.unique(iter_lines(urls_file))
         try:
-            result_urls = []
-            with tqdm(total=len(urls)) as pbar:
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    futures = [executor.submit(self.align_language_wrapper, url, lang_src, lang_tgt) for url in urls]
-                    for future in concurrent.futures.as_completed(futures):
-                        r = future.result()
-                        pbar.update(1)
-                        if r is not None:
-                            result_urls.append(r)
-        except:
-            file_name = f'data/{lang_src}-{lang_tgt}-align-urls.txt'
-            with open(file_name, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(result_urls, ensure_ascii=False))
-        else:
-            file_name = f'data/{lang_src}-{lang_tgt}-align-urls.txt'
-            with open(file_name, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(result_urls, ensure_ascii=False))
+            with JsonlWriter(file_name) as writer:
+                def write(url, r):
+                    if r is not None:
+                        writer.write(r)
+                        if store is not None:
+                            store.add_links(r)
+
+                if use_api:
+                    lang_code = _wiki_lang_code_dict[lang_tgt]
+                    with tqdm() as pbar:
+                        for url, links in self.langlinks.align(urls, [lang_code], self.session.pool_size):
+                            pbar.update(1)
+                            if lang_code in links:
+                                write(url, {lang_src: url, lang_tgt: links[lang_code]})
+                elif use_async:
+                    self.async_fetcher.fetch_all(
+                        urls,
+                        lambda url, body: self.get_align_link(url, body, lang_src, lang_tgt)
+                        if index.learn(url, body) else None,
+                        write)
+                else:
+                    with tqdm() as pbar:
+                        for r in imap_unordered(lambda url: self.align_language_wrapper(url, lang_src, lang_tgt, index),
+                                                urls, self.session.pool_size):
+                            pbar.update(1)
+                            write(None, r)
+        finally:
+            if store is not None:
+                store.commit()
+            print(index.report())
 
     def align_chinese_wrapper(self, url):
+        r = self.session.get(url)
+        return self.get_align_chinese_links(url, r.text)
+
+    def get_align_chinese_links(self, url, body):
         lang_ko = '한국어'
         lang_ru = 'Русский'
-        r = requests.get(url, proxies=self.get_proxy())
-        body = r.text
         soup = BeautifulSoup(body, features="lxml")
         lang_nav = soup.find("nav", {"id": "p-lang"})
         link_tag_ko = lang_nav.find("a", string=lang_ko)
@@ -242,39 +343,49 @@ class WikiSpider:
 
         return res_ko, res_ru
 
-    def align_chinese(self, urls_file: str):
-        with open(urls_file, 'r', encoding='utf-8') as f:
-            urls = ['https://zh.wikipedia.org/wiki/' + line[:-1] for line in f]
-
-        # urls = urls[:50]
-
+    def align_chinese(self, urls_file: str, use_async=False, use_api=False, index: CanonicalIndex = None,
+                      store: AlignStore = None):
+        """
+        :param urls_file: 每行一个中文词条名
+        :param index: 规范化url与重定向的索引，同一个词条的不同写法只查询一次，为None时只做规范化
+        :param store: 不为None时对齐链接同时写入该AlignStore
+        """
+        index = index if index is not None else CanonicalIndex()
+        urls = index.unique('https://zh.wikipedia.org/wiki/' + line for line in iter_lines(urls_file))
+        file_name_ko = 'data/chinese-ko-align-urls.txt'
+        file_name_ru = 'data/chinese-ru-align-urls.txt'
         try:
-            result_urls = []
-            with tqdm(total=len(urls)) as pbar:
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    futures = [executor.submit(self.align_chinese_wrapper, url) for url in urls]
-                    for future in concurrent.futures.as_completed(futures):
-                        r = future.result()
+            with JsonlWriter(file_name_ko) as writer_ko, JsonlWriter(file_name_ru) as writer_ru:
+                def write(r):
+                    if r is None:
+                        return
+                    if r[0] is not None:
+                        writer_ko.write(r[0])
+                    if r[1] is not None:
+                        writer_ru.write(r[1])
+                    if store is not None:
+                        for links in r:
+                            if links is not None:
+                                store.add_links(links)
+
+                if use_api:
+                    with tqdm() as pbar:
+                        for url, links in self.langlinks.align(urls, ['ko', 'ru'], self.session.pool_size):
+                            pbar.update(1)
+                            write(({'chinese': url, 'ko': links['ko']} if 'ko' in links else None,
+                                   {'chinese': url, 'ru': links['ru']} if 'ru' in links else None))
+                    return
+                if use_async:
+                    self.async_fetcher.fetch_all(urls, self.get_align_chinese_links, lambda url, r: write(r))
+                    return
+                with tqdm() as pbar:
+                    for r in imap_unordered(self.align_chinese_wrapper, urls, self.session.pool_size):
                         pbar.update(1)
-                        result_urls.append(r)
-        except:
-            ko_list = [u[0] for u in result_urls if u is not None and u[0] is not None]
-            ru_list = [u[1] for u in result_urls if u is not None and u[1] is not None]
-            file_name_ko = 'data/chinese-ko-align-urls.txt'
-            file_name_ru = 'data/chinese-ru-align-urls.txt'
-            with open(file_name_ko, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(ko_list, ensure_ascii=False))
-            with open(file_name_ru, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(ru_list, ensure_ascii=False))
-        else:
-            ko_list = [u[0] for u in result_urls if u is not None and u[0] is not None]
-            ru_list = [u[1] for u in result_urls if u is not None and u[1] is not None]
-            file_name_ko = 'data/chinese-ko-align-urls.txt'
-            file_name_ru = 'data/chinese-ru-align-urls.txt'
-            with open(file_name_ko, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(ko_list, ensure_ascii=False))
-            with open(file_name_ru, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(ru_list, ensure_ascii=False))
+                        write(r)
+        finally:
+            if store is not None:
+                store.commit()
+            print(index.report())
 
     def get_wiki_url(self, keyword: str) -> str:
         return self.wiki_url + keyword
@@ -283,30 +394,10 @@ class WikiSpider:
         return _is_content_page_func[self.language](url)
 
     def strip_info_key(self, info: str) -> str:
-        # r = re.sub(r'\[(\d)*\]', "", info.replace("\xa0", "")
-        #            .replace("\ufeff", "")
-        #            )
-        return info
+        return self.normalizer.normalize_key(info)
 
     def strip_info_value(self, info: str) -> str:
-        r = re.sub(r'\[(\d)*\]', "", info
-                   .replace(".mw-parser-output", "")
-                   .replace(".geo-default", "")
-                   .replace(".geo-dms", "")
-                   .replace(".geo-nondefault", "")
-                   .replace(".longitude", "")
-                   .replace(".latitude", "")
-                   .replace(".geo-dec", "")
-                   .replace(".geo-multi-punct", "")
-                   .replace("{display:inline}", "")
-                   .replace("{display:none}", "")
-                   .replace("{white-space:nowrap}", "")
-                   )
-
-        return r.replace(" ,", "").strip().lstrip(",")
+        return self.normalizer.normalize_value(info)
 
     def get_proxy(self) -> dict:
-        return {
-            'http': self.proxy_config["url"],
-            'https': self.proxy_config["url"],
-        }
+        return self.session.proxies
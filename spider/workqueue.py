@@ -0,0 +1,318 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def shard_of(url: str) -> str:
+    """
+    按host分片，同一个lease中的url来自同一个host，限流在每个worker内部就能生效
+    """
+    return urlsplit(url).netloc
+
+
+class Lease:
+    def __init__(self, lease_id: str, items: List[Tuple[str, int]], expires: float):
+        """
+        :param lease_id: 租约id，完成任务时用于确认租约仍然有效
+        :param items: (url, level)的list
+        :param expires: 租约到期时间，到期未完成的任务会重新分配给其他worker
+        """
+        self.id = lease_id
+        self.items = items
+        self.expires = expires
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "items": self.items, "expires": self.expires}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Lease":
+        return cls(d["id"], [tuple(item) for item in d["items"]], d["expires"])
+
+
+class SqliteWorkQueue:
+    """
+    多个worker共享的任务队列，保存在一个sqlite文件中。
+    worker按批租用url，租约到期未完成的url会重新分配；
+    完成时只接受仍持有租约的url，超时后被重新分配的url以新租约的结果为准，因此每个url只有一份结果。
+    同一台机器上的多个进程可以直接共用sqlite文件，多台机器通过WorkQueueServer共用
+    """
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        :param path: sqlite文件路径
+        :param max_attempts: 每个url最多被租用的次数，超过后标记为失败
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tasks ("
+                          "item TEXT PRIMARY KEY, shard TEXT NOT NULL, level INTEGER NOT NULL, "
+                          "status TEXT NOT NULL, lease_id TEXT, expires REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                          "error TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, shard)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_lease ON tasks (lease_id)")
+
+    def add(self, items: Iterable[str], level=0) -> int:
+        """
+        添加url，已经在队列中的url被忽略
+        :return: 新添加的url数
+        """
+        rows = [(item, shard_of(item), level, PENDING) for item in items]
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR IGNORE INTO tasks (item, shard, level, status) VALUES (?, ?, ?, ?)",
+                                  rows)
+            self.conn.execute("COMMIT")
+            return self.conn.total_changes - before
+
+    def lease(self, batch_size: int, lease_seconds=DEFAULT_LEASE_SECONDS, shard: Optional[str] = None) \
+            -> Optional[Lease]:
+        """
+        租用同一个分片中的最多batch_size个url
+        :param shard: 只从该分片（host）租用，为None时任选一个有任务的分片
+        :return: 没有可租用的url时返回None
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 租约到期且已达到最大次数的url不再分配
+                self.conn.execute("UPDATE tasks SET status = ?, error = 'lease expired too many times' "
+                                  "WHERE status = ? AND expires < ? AND attempts >= ?",
+                                  (FAILED, LEASED, now, self.max_attempts))
+                available = "(status = ? OR (status = ? AND expires < ?))"
+                if shard is None:
+                    row = self.conn.execute("SELECT shard FROM tasks WHERE " + available + " LIMIT 1",
+                                            (PENDING, LEASED, now)).fetchone()
+                    if row is None:
+                        self.conn.execute("COMMIT")
+                        return None
+                    shard = row[0]
+                rows = self.conn.execute("SELECT item, level FROM tasks WHERE shard = ? AND " + available +
+                                         " LIMIT ?", (shard, PENDING, LEASED, now, batch_size)).fetchall()
+                if not rows:
+                    self.conn.execute("COMMIT")
+                    return None
+                lease = Lease(uuid.uuid4().hex, [(item, level) for item, level in rows], now + lease_seconds)
+                self.conn.executemany("UPDATE tasks SET status = ?, lease_id = ?, expires = ?, attempts = attempts + 1 "
+                                      "WHERE item = ?", [(LEASED, lease.id, lease.expires, item) for item, _ in rows])
+                self.conn.execute("COMMIT")
+                return lease
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def renew(self, lease_id: str, lease_seconds=DEFAULT_LEASE_SECONDS) -> bool:
+        """
+        延长租约，处理一批url的时间可能超过lease_seconds时由worker定期调用
+        :return: 租约是否仍然有效
+        """
+        with self.lock:
+            cursor = self.conn.execute("UPDATE tasks SET expires = ? WHERE lease_id = ? AND status = ?",
+                                       (time.time() + lease_seconds, lease_id, LEASED))
+            return cursor.rowcount > 0
+
+    def complete(self, lease_id: str, items: List[str]) -> List[str]:
+        """
+        标记url完成，只接受仍持有该租约的url
+        :return: 被接受的url
+        """
+        accepted = []
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for item in items:
+                cursor = self.conn.execute("UPDATE tasks SET status = ?, expires = NULL "
+                                           "WHERE item = ? AND lease_id = ? AND status = ?",
+                                           (DONE, item, lease_id, LEASED))
+                if cursor.rowcount:
+                    accepted.append(item)
+            self.conn.execute("COMMIT")
+        return accepted
+
+    def fail(self, lease_id: str, item: str, error: str):
+        """
+        url处理失败，未达到最大次数时重新放回队列
+        """
+        with self.lock:
+            self.conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                              "lease_id = NULL, expires = NULL, error = ? WHERE item = ? AND lease_id = ? AND status = ?",
+                              (self.max_attempts, FAILED, PENDING, error, item, lease_id, LEASED))
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def committed(self) -> Dict[str, str]:
+        """
+        :return: 已完成的url -> 完成时的租约id，合并worker输出时只保留与之对应的结果
+        """
+        with self.lock:
+            return dict(self.conn.execute("SELECT item, lease_id FROM tasks WHERE status = ?", (DONE,)).fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class WorkQueueServer:
+    """
+    通过http提供SqliteWorkQueue，多台机器上的worker用HttpWorkQueue连接。
+    接口没有鉴权，监听0.0.0.0时只应在可信的内网中使用，例如：
+
+        with WorkQueueServer(SqliteWorkQueue("data/queue.db"), host="0.0.0.0", port=8765):
+            ...
+    """
+
+    def __init__(self, queue: SqliteWorkQueue, host="127.0.0.1", port=0):
+        self.queue = queue
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def dispatch(self, path: str, args: dict):
+        q = self.queue
+        if path == "/add":
+            return q.add(args["items"], args.get("level", 0))
+        if path == "/lease":
+            lease = q.lease(args["batch_size"], args.get("lease_seconds", DEFAULT_LEASE_SECONDS), args.get("shard"))
+            return None if lease is None else lease.to_dict()
+        if path == "/renew":
+            return q.renew(args["lease_id"], args.get("lease_seconds", DEFAULT_LEASE_SECONDS))
+        if path == "/complete":
+            return q.complete(args["lease_id"], args["items"])
+        if path == "/fail":
+            return q.fail(args["lease_id"], args["item"], args["error"])
+        if path == "/counts":
+            return q.counts()
+        if path == "/committed":
+            return q.committed()
+        raise KeyError(path)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    args = json.loads(self.rfile.read(length) or b"{}")
+                    body = json.dumps({"result": server.dispatch(self.path, args)}, ensure_ascii=False)
+                    status = 200
+                except (KeyError, json.JSONDecodeError) as e:
+                    body = json.dumps({"error": "bad request: {}".format(e)})
+                    status = 400
+                except Exception as e:
+                    logger.exception("work queue request failed: {}".format(self.path))
+                    body = json.dumps({"error": "{}: {}".format(type(e).__name__, e)}, ensure_ascii=False)
+                    status = 500
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class HttpWorkQueue:
+    """
+    WorkQueueServer的客户端，接口与SqliteWorkQueue相同
+    """
+
+    def __init__(self, url: str, timeout=60):
+        import requests
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _call(self, path: str, **args):
+        r = self.session.post(self.url + path, json=args, timeout=self.timeout)
+        if r.status_code in (400, 500):
+            raise RuntimeError("work queue {} failed: {}".format(path, r.json().get("error")))
+        r.raise_for_status()
+        return r.json()["result"]
+
+    def add(self, items: Iterable[str], level=0) -> int:
+        return self._call("/add", items=list(items), level=level)
+
+    def lease(self, batch_size: int, lease_seconds=DEFAULT_LEASE_SECONDS, shard: Optional[str] = None) \
+            -> Optional[Lease]:
+        r = self._call("/lease", batch_size=batch_size, lease_seconds=lease_seconds, shard=shard)
+        return None if r is None else Lease.from_dict(r)
+
+    def renew(self, lease_id: str, lease_seconds=DEFAULT_LEASE_SECONDS) -> bool:
+        return self._call("/renew", lease_id=lease_id, lease_seconds=lease_seconds)
+
+    def complete(self, lease_id: str, items: List[str]) -> List[str]:
+        return self._call("/complete", lease_id=lease_id, items=items)
+
+    def fail(self, lease_id: str, item: str, error: str):
+        self._call("/fail", lease_id=lease_id, item=item, error=error)
+
+    def counts(self) -> Dict[str, int]:
+        return self._call("/counts")
+
+    def committed(self) -> Dict[str, str]:
+        return self._call("/committed")
+
+    def close(self):
+        self.session.close()
+
+
+def open_work_queue(spec: str, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    :param spec: http://host:port为远程队列，否则为sqlite文件路径
+    :param max_attempts: sqlite队列中每个url最多被租用的次数，远程队列由服务端决定
+    """
+    if spec.startswith(("http://", "https://")):
+        return HttpWorkQueue(spec)
+    return SqliteWorkQueue(spec, max_attempts)